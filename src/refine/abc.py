@@ -6,7 +6,9 @@ from __future__ import annotations
 
 from abc import ABC
 from collections.abc import Generator
+from contextlib import ExitStack
 from contextlib import contextmanager
+from contextlib import nullcontext
 from dataclasses import replace
 from typing import TYPE_CHECKING
 from typing import Any
@@ -24,6 +26,8 @@ from libcst.codemod import VisitorBasedCodemodCommand
 from libcst.codemod.visitors import AddImportsVisitor
 from libcst.codemod.visitors import RemoveImportsVisitor
 
+from refine.profile import _PROFILER_KEY
+
 AddRemoveImport: TypeAlias = tuple[str, str | None, str | None]
 
 _SHARED_WRAPPER_KEY = "__refine_shared_wrapper__"
@@ -44,7 +48,7 @@ class BaseConfig(msgspec.Struct, kw_only=True, frozen=True, forbid_unknown_field
         """
         Paths of external files whose CONTENTS affect this codemod's output.
 
-        The run cache hashes these files' bytes into its context key so
+        The run cache hashes these files' bytes into the codemod's key so
         editing them invalidates cached results. Override in configs that
         reference external configuration files.
         """
@@ -143,20 +147,27 @@ class BaseCodemod(VisitorBasedCodemodCommand, ABC, Generic[CodemodConfigType]):
         when the tree object actually changed. The deep copy is skipped only
         for the pristine parser output (guaranteed duplicate-free); rebuilt
         wrappers for transformed trees keep libcst's safety copy.
+
+        When profiling, building the wrapper and resolving the metadata is
+        accounted as the file's ``metadata`` phase.
         """
         oldwrapper = self.context.wrapper
-        wrapper: cst.MetadataWrapper | None = self.context.scratch.get(_SHARED_WRAPPER_KEY)
-        if wrapper is None or wrapper.module is not module:
-            metadata_manager = self.context.metadata_manager
-            filename = self.context.filename
-            if metadata_manager is not None and filename:
-                cache = metadata_manager.get_cache_for_path(filename)
-            else:
-                cache = {}
-            pristine = self.context.scratch.get(_PRISTINE_TREE_KEY)
-            wrapper = cst.MetadataWrapper(module, unsafe_skip_copy=module is pristine, cache=cache)
-            self.context.scratch[_SHARED_WRAPPER_KEY] = wrapper
-        with self.resolve(wrapper):
+        profiler = self.context.scratch.get(_PROFILER_KEY)
+        with ExitStack() as stack:
+            with profiler.phase("metadata") if profiler is not None else nullcontext():
+                wrapper: cst.MetadataWrapper | None = self.context.scratch.get(_SHARED_WRAPPER_KEY)
+                if wrapper is None or wrapper.module is not module:
+                    metadata_manager = self.context.metadata_manager
+                    filename = self.context.filename
+                    if metadata_manager is not None and filename:
+                        cache = metadata_manager.get_cache_for_path(filename)
+                    else:
+                        cache = {}
+                    pristine = self.context.scratch.get(_PRISTINE_TREE_KEY)
+                    wrapper = cst.MetadataWrapper(module, unsafe_skip_copy=module is pristine, cache=cache)
+                    self.context.scratch[_SHARED_WRAPPER_KEY] = wrapper
+                # Entering resolve() is what resolves the metadata.
+                stack.enter_context(self.resolve(wrapper))
             self.context = replace(self.context, wrapper=wrapper)
             try:
                 yield wrapper.module
@@ -1,8 +1,29 @@
 """
 Persistent run cache.
 
-Skips files whose content is unchanged since the last run under the same
-"context" (refine version + selected codemods + their source + their config).
+Records, for each file found clean, which codemods it is clean under: each
+codemod has its own key (refine version + the codemod's source + its config),
+so changing the configuration of one codemod, or selecting another one, only
+gets that codemod to run again, not the others. A file is skipped once its
+content is unchanged and clean under every selected codemod. The warnings
+the codemods emitted on it are recorded too, and reported again when skipped.
+So are the failures, of files which fail to parse or make a codemod crash:
+until its content or the codemods change, such a file fails the same way.
+
+Next to the digest of each clean file, the cache records its size,
+modification time and inode. While those still match, the file is known clean
+without being read. Like git's index, a file modified within the timestamp
+granularity of the cache's own write could keep the same modification time, so
+such "racily clean" entries are not trusted, and the file is hashed.
+
+Where the entries are kept is up to a :class:`CacheBackend`, selected with the
+``cache_backend`` setting:
+
+- ``msgpack`` (default): a single file, read whole when the run starts and
+  rewritten whole when it ends. Of concurrent runs, the last one to end wins.
+- ``sqlite``: an SQLite database in WAL mode, looked up file by file, and
+  updated in a single transaction per run. Concurrent runs, even with
+  different codemods, keep each other's entries.
 """
 
 from __future__ import annotations
@@ -11,6 +32,13 @@ import hashlib
 import inspect
 import logging
 import os
+import sqlite3
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections.abc import Mapping
+from collections.abc import Sequence
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -23,79 +51,239 @@ if TYPE_CHECKING:
 log = logging.getLogger(__name__)
 
 _CACHE_FILE_NAME = "cache.msgpack"
+#: Bumped whenever the msgpack payload changes, discarding the files with another one.
+_PAYLOAD_VERSION = 4
+_SQLITE_FILE_NAME = "cache.sqlite3"
+#: Bumped whenever the SQLite schema changes, discarding databases with another one.
+_SQLITE_SCHEMA_VERSION = 4
+#: How long an SQLite entry's stat is not trusted for, after it was written.
+#: Unlike the msgpack file's modification time, the time the entry was written
+#: comes from the system clock, which filesystem timestamps can lag behind by
+#: up to their granularity: two seconds on FAT.
+_SQLITE_RACY_NS = 2_000_000_000
+#: Length of the codemod keys, in hexadecimal digits. Each clean file records
+#: one per codemod, and 64 bits are plenty to tell configurations apart.
+_CODEMOD_KEY_LENGTH = 16
+
+
+class FileStat(msgspec.Struct, frozen=True, array_like=True):
+    """
+    What :func:`os.stat` tells about a file, enough to notice it changed.
+    """
+
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def of(cls, filename: str) -> FileStat:
+        """
+        Stat ``filename``, following symbolic links.
+        """
+        stat = os.stat(filename)
+        return cls(size=stat.st_size, mtime_ns=stat.st_mtime_ns, inode=stat.st_ino)
+
+
+class CachedFailure(msgspec.Struct, frozen=True):
+    """
+    How processing a file failed.
+    """
+
+    #: Key of each codemod selected when it failed, by codemod name.
+    codemods: dict[str, str]
+    message: str
+    traceback: str
+    warnings: list[str] = msgspec.field(default_factory=list)
+
+
+class CacheEntry(msgspec.Struct, frozen=True):
+    """
+    What the cache knows about a clean file.
+    """
+
+    digest: str
+    #: Key of each codemod the content is clean under, by codemod name.
+    codemods: dict[str, str]
+    #: The file's stat when found clean, if known, and not racily clean.
+    stat: FileStat | None = None
+    #: Warnings the codemods emitted on the content, by codemod name.
+    warnings: dict[str, list[str]] = msgspec.field(default_factory=dict)
+    #: How processing the content last failed, if it did.
+    failure: CachedFailure | None = None
 
 
 class _CachePayload(msgspec.Struct):
-    context_key: str
-    files: dict[str, str] = msgspec.field(default_factory=dict)
+    version: int
+    files: dict[str, CacheEntry] = msgspec.field(default_factory=dict)
+    #: Seconds the last transform of each file took. Only used to schedule
+    #: work, so kept whatever the codemods.
+    durations: dict[str, float] = msgspec.field(default_factory=dict)
 
 
-def _hash(data: bytes) -> str:
-    return hashlib.sha256(data).hexdigest()
+def source_digest(source: str) -> str:
+    """
+    Digest of a file's content, as recorded by :meth:`Cache.mark_clean`.
+
+    It is the id git gives the same content as a blob, so the cache can be
+    looked up with the ids git already knows, without reading the files.
+    """
+    data = source.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data, usedforsecurity=False).hexdigest()
 
 
-def compute_context_key(
+def compute_codemod_key(
     *,
     refine_version: str,
-    codemods: list[type[BaseCodemod]],
-    codemod_configs: dict[str, BaseConfig],
+    codemod: type[BaseCodemod],
+    codemod_config: BaseConfig,
 ) -> str:
+    """
+    Key of a codemod's results: files found clean under another key must be processed again.
+    """
     hasher = hashlib.sha256()
     hasher.update(refine_version.encode())
-    for codemod in sorted(codemods, key=lambda c: c.NAME):
-        hasher.update(codemod.NAME.encode())
-        source_file = inspect.getsourcefile(codemod)
-        if source_file and Path(source_file).exists():
-            hasher.update(Path(source_file).read_bytes())
-        codemod_config = codemod_configs[codemod.NAME]
-        hasher.update(msgspec.json.encode(codemod_config))
-        for cache_key_path in codemod_config.cache_key_paths():
-            path = Path(cache_key_path)
-            try:
-                hasher.update(path.read_bytes())
-            except OSError:
-                # Missing file: config validation already errors on this
-                # elsewhere; fall back to hashing the path string so the key
-                # is still deterministic.
-                hasher.update(cache_key_path.encode())
-    return hasher.hexdigest()
+    hasher.update(codemod.NAME.encode())
+    source_file = inspect.getsourcefile(codemod)
+    if source_file and Path(source_file).exists():
+        hasher.update(Path(source_file).read_bytes())
+    hasher.update(msgspec.json.encode(codemod_config))
+    for cache_key_path in codemod_config.cache_key_paths():
+        path = Path(cache_key_path)
+        try:
+            hasher.update(path.read_bytes())
+        except OSError:
+            # Missing file: config validation already errors on this
+            # elsewhere; fall back to hashing the path string so the key
+            # is still deterministic.
+            hasher.update(cache_key_path.encode())
+    return hasher.hexdigest()[:_CODEMOD_KEY_LENGTH]
 
 
-class Cache:
+def _merged(previous: CacheEntry | None, entry: CacheEntry) -> CacheEntry:
+    """
+    ``entry``, still clean under the codemods ``previous`` was clean under if of the same content.
+
+    Only the failure of ``entry``, if any, is kept: the content was processed again since ``previous``.
     """
-    Content-hash cache over a single msgpack file.
+    if previous is None or previous.digest != entry.digest:
+        return entry
+    codemods = {**previous.codemods, **entry.codemods}
+    # Under the same key, a codemod emits the same warnings on the same content:
+    # only those of the codemods now under another key are superseded.
+    warnings = {
+        name: messages
+        for name, messages in previous.warnings.items()
+        if codemods.get(name) == previous.codemods.get(name)
+    }
+    return msgspec.structs.replace(entry, codemods=codemods, warnings={**warnings, **entry.warnings})
+
+
+class CacheBackend(ABC):
+    """
+    Where the run cache keeps its entries.
+
+    Entries are only guaranteed to be persisted by :meth:`flush`.
     """
 
-    def __init__(self, cache_dir: Path, context_key: str, files: dict[str, str]) -> None:
+    @abstractmethod
+    def get(self, filename: str) -> CacheEntry | None:
+        """
+        The entry recorded for ``filename``, if any, without its stat if racily clean.
+        """
+
+    @abstractmethod
+    def put(self, filename: str, entry: CacheEntry) -> None:
+        """
+        Record ``entry`` for ``filename``, replacing any previous one.
+        """
+
+    @abstractmethod
+    def duration(self, filename: str) -> float | None:
+        """
+        Seconds the last recorded transform of ``filename`` took, if any.
+        """
+
+    @abstractmethod
+    def record_duration(self, filename: str, seconds: float) -> None:
+        """
+        Record how many seconds transforming ``filename`` took.
+        """
+
+    @abstractmethod
+    def refresh(self) -> None:
+        """
+        Pick up the entries other processes persisted since, if not already looked up live.
+        """
+
+    @abstractmethod
+    def flush(self) -> None:
+        """
+        Persist the recorded entries.
+        """
+
+
+class MsgpackBackend(CacheBackend):
+    """
+    Every entry in a single msgpack file, read whole and rewritten whole.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
         self._cache_dir = cache_dir
-        self._context_key = context_key
-        self._files = files
+        self._files, self._durations = self._read_payload(cache_dir / _CACHE_FILE_NAME)
+        self._signature = self._file_signature()
 
-    @classmethod
-    def load(cls, cache_dir: Path, context_key: str) -> Cache:
-        """Load cache from disk; return empty cache if missing or corrupted."""
-        cache_file = cache_dir / _CACHE_FILE_NAME
-        files: dict[str, str] = {}
+    @staticmethod
+    def _read_payload(cache_file: Path) -> tuple[dict[str, CacheEntry], dict[str, float]]:
         if cache_file.exists():
             try:
                 payload = msgspec.msgpack.decode(cache_file.read_bytes(), type=_CachePayload)
             except (msgspec.DecodeError, msgspec.ValidationError, OSError) as exc:
                 log.debug("Discarding unreadable cache file %s: %s", cache_file, exc)
             else:
-                if payload.context_key == context_key:
-                    files = payload.files
-        return cls(cache_dir, context_key, files)
+                if payload.version == _PAYLOAD_VERSION:
+                    return payload.files, payload.durations
+                log.debug("Discarding cache file %s, of version %s", cache_file, payload.version)
+        return {}, {}
 
-    def is_clean(self, filename: str, source: str) -> bool:
-        """Check if file content hash matches cached entry."""
-        return self._files.get(filename) == _hash(source.encode())
+    def _file_signature(self) -> tuple[int, int] | None:
+        try:
+            stat = (self._cache_dir / _CACHE_FILE_NAME).stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
-    def mark_clean(self, filename: str, source: str) -> None:
-        """Record file content hash in cache."""
-        self._files[filename] = _hash(source.encode())
+    def refresh(self) -> None:
+        """Reload the cache if another process rewrote it since it was loaded or flushed."""
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._files, self._durations = self._read_payload(self._cache_dir / _CACHE_FILE_NAME)
+            self._signature = signature
 
-    def dump(self) -> None:
-        """Write cache to disk, pruning entries for deleted absolute paths."""
+    def get(self, filename: str) -> CacheEntry | None:
+        """The entry recorded for ``filename``, without its stat if modified no earlier than the file was written."""
+        entry = self._files.get(filename)
+        if (
+            entry is not None
+            and entry.stat is not None
+            and (self._signature is None or entry.stat.mtime_ns >= self._signature[0])
+        ):
+            return msgspec.structs.replace(entry, stat=None)
+        return entry
+
+    def put(self, filename: str, entry: CacheEntry) -> None:
+        """Record ``entry`` for ``filename``, until the next flush."""
+        self._files[filename] = entry
+
+    def duration(self, filename: str) -> float | None:
+        """Seconds the last recorded transform of ``filename`` took, if any."""
+        return self._durations.get(filename)
+
+    def record_duration(self, filename: str, seconds: float) -> None:
+        """Record how many seconds transforming ``filename`` took, until the next flush."""
+        self._durations[filename] = seconds
+
+    def flush(self) -> None:
+        """Write the cache file, pruning entries for deleted absolute paths."""
         self._cache_dir.mkdir(parents=True, exist_ok=True)
         gitignore = self._cache_dir / ".gitignore"
         if not gitignore.exists():
@@ -103,9 +291,321 @@ class Cache:
         # Opportunistic pruning: drop entries for files that no longer exist.
         # Only prune absolute paths; keep relative paths as they may be valid in a different cwd.
         files = {
-            filename: digest
-            for filename, digest in self._files.items()
+            filename: entry
+            for filename, entry in self._files.items()
+            if not os.path.isabs(filename) or os.path.exists(filename)
+        }
+        durations = {
+            filename: seconds
+            for filename, seconds in self._durations.items()
             if not os.path.isabs(filename) or os.path.exists(filename)
         }
-        payload = _CachePayload(context_key=self._context_key, files=files)
+        payload = _CachePayload(version=_PAYLOAD_VERSION, files=files, durations=durations)
         (self._cache_dir / _CACHE_FILE_NAME).write_bytes(msgspec.msgpack.encode(payload))
+        self._signature = self._file_signature()
+
+
+class SqliteBackend(CacheBackend):
+    """
+    An SQLite database in WAL mode, shared by concurrent processes.
+
+    Entries are looked up one query per file, rather than all loaded upfront.
+    Those recorded are kept in memory until :meth:`flush` writes them in a
+    single transaction, so readers are never blocked and writers only wait on
+    each other for as long as that transaction lasts.
+
+    Unlike with :class:`MsgpackBackend`, the entries of files which were since
+    deleted are not pruned: that would take checking every entry.
+    """
+
+    def __init__(self, cache_dir: Path) -> None:
+        self._cache_dir = cache_dir
+        self._pending: dict[str, CacheEntry] = {}
+        self._pending_durations: dict[str, float] = {}
+        # Ingestion looks files up from several threads.
+        self._lock = threading.Lock()
+        self._connection = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        gitignore = self._cache_dir / ".gitignore"
+        if not gitignore.exists():
+            gitignore.write_text("*\n")
+        connection = sqlite3.connect(
+            self._cache_dir / _SQLITE_FILE_NAME,
+            # How long to wait for a concurrent writer's transaction to end.
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            # In WAL mode, only a power loss could lose the last transactions, never corrupt the database.
+            connection.execute("PRAGMA synchronous = NORMAL")
+            if connection.execute("PRAGMA user_version").fetchone()[0] != _SQLITE_SCHEMA_VERSION:
+                self._create_schema(connection)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    @staticmethod
+    def _create_schema(connection: sqlite3.Connection) -> None:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have created it while this one waited for the lock.
+            if connection.execute("PRAGMA user_version").fetchone()[0] != _SQLITE_SCHEMA_VERSION:
+                for table in ("files", "durations", "contexts"):
+                    connection.execute(f"DROP TABLE IF EXISTS {table}")
+                connection.execute(
+                    """
+                    CREATE TABLE files (
+                        filename TEXT PRIMARY KEY,
+                        digest TEXT NOT NULL,
+                        codemods BLOB NOT NULL,
+                        warnings BLOB,
+                        failure BLOB,
+                        size INTEGER,
+                        mtime_ns INTEGER,
+                        inode INTEGER,
+                        written_ns INTEGER NOT NULL
+                    ) WITHOUT ROWID
+                    """
+                )
+                connection.execute(
+                    "CREATE TABLE durations (filename TEXT PRIMARY KEY, seconds REAL NOT NULL) WITHOUT ROWID"
+                )
+                connection.execute(f"PRAGMA user_version = {_SQLITE_SCHEMA_VERSION}")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _select(self, filename: str) -> CacheEntry | None:
+        row = self._connection.execute(
+            """
+            SELECT digest, codemods, warnings, failure, size, mtime_ns, inode, written_ns
+            FROM files WHERE filename = ?
+            """,
+            (filename,),
+        ).fetchone()
+        if row is None:
+            return None
+        digest, codemods, warnings, failure, size, mtime_ns, inode, written_ns = row
+        stat = None
+        if size is not None and mtime_ns < written_ns - _SQLITE_RACY_NS:
+            stat = FileStat(size=size, mtime_ns=mtime_ns, inode=inode)
+        return CacheEntry(
+            digest=digest,
+            codemods=msgspec.msgpack.decode(codemods, type=dict[str, str]),
+            stat=stat,
+            warnings={} if warnings is None else msgspec.msgpack.decode(warnings, type=dict[str, list[str]]),
+            failure=None if failure is None else msgspec.msgpack.decode(failure, type=CachedFailure),
+        )
+
+    def get(self, filename: str) -> CacheEntry | None:
+        """Look the entry recorded for ``filename`` up, without its stat if modified around when it was written."""
+        with self._lock:
+            entry = self._pending.get(filename)
+            if entry is not None:
+                # Not written yet, so racily clean.
+                return msgspec.structs.replace(entry, stat=None)
+            return self._select(filename)
+
+    def put(self, filename: str, entry: CacheEntry) -> None:
+        """Record ``entry`` for ``filename``, in memory until the next flush."""
+        with self._lock:
+            self._pending[filename] = entry
+
+    def duration(self, filename: str) -> float | None:
+        """Look the seconds the last recorded transform of ``filename`` took up."""
+        with self._lock:
+            seconds = self._pending_durations.get(filename)
+            if seconds is not None:
+                return seconds
+            row = self._connection.execute("SELECT seconds FROM durations WHERE filename = ?", (filename,)).fetchone()
+        return None if row is None else row[0]
+
+    def record_duration(self, filename: str, seconds: float) -> None:
+        """Record how many seconds transforming ``filename`` took, in memory until the next flush."""
+        with self._lock:
+            self._pending_durations[filename] = seconds
+
+    def refresh(self) -> None:
+        """Nothing to do: entries are looked up live."""
+
+    def flush(self) -> None:
+        """
+        Write the recorded entries in a single transaction.
+
+        Entries for the same content are merged with those concurrent runs
+        wrote meanwhile, so files stay clean under the codemods of both.
+        """
+        with self._lock:
+            written_ns = time.time_ns()
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = []
+                for filename, entry in self._pending.items():
+                    merged = _merged(self._select(filename), entry)
+                    stat = (None, None, None) if merged.stat is None else msgspec.structs.astuple(merged.stat)
+                    warnings = msgspec.msgpack.encode(merged.warnings) if merged.warnings else None
+                    failure = None if merged.failure is None else msgspec.msgpack.encode(merged.failure)
+                    rows.append(
+                        (
+                            filename,
+                            merged.digest,
+                            msgspec.msgpack.encode(merged.codemods),
+                            warnings,
+                            failure,
+                            *stat,
+                            written_ns,
+                        )
+                    )
+                self._connection.executemany(
+                    """
+                    INSERT OR REPLACE INTO files
+                        (filename, digest, codemods, warnings, failure, size, mtime_ns, inode, written_ns)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO durations (filename, seconds) VALUES (?, ?)",
+                    self._pending_durations.items(),
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            self._pending.clear()
+            self._pending_durations.clear()
+
+
+class Cache:
+    """
+    Content-hash cache, over a :class:`CacheBackend`.
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self._backend = backend
+
+    @classmethod
+    def load(cls, cache_dir: Path, *, backend: str = "msgpack") -> Cache:
+        """
+        Open the cache with the ``backend`` named; it is empty if missing or corrupted.
+        """
+        if backend == "sqlite":
+            try:
+                return cls(SqliteBackend(cache_dir))
+            except sqlite3.Error as exc:
+                log.warning("Unable to open the SQLite cache in %s, using the msgpack one instead: %s", cache_dir, exc)
+        return cls(MsgpackBackend(cache_dir))
+
+    def refresh(self) -> None:
+        """Pick up what other processes wrote to the cache since it was loaded or dumped."""
+        self._backend.refresh()
+
+    def is_clean(self, filename: str, source: str, codemods: Mapping[str, str]) -> bool:
+        """Check if file content is clean under each of ``codemods``, keys by codemod name."""
+        clean = self.clean_codemods(filename, source_digest(source))
+        return all(clean.get(name) == key for name, key in codemods.items())
+
+    def clean_codemods(self, filename: str, digest: str) -> Mapping[str, str]:
+        """
+        The keys of the codemods the content of ``filename`` is clean under, by codemod name.
+
+        Arguments:
+            filename: The file to look up.
+            digest: The digest of its current content, computed with :func:`source_digest`.
+        """
+        entry = self.entry_for_digest(filename, digest)
+        return {} if entry is None else entry.codemods
+
+    def entry_for_digest(self, filename: str, digest: str) -> CacheEntry | None:
+        """
+        The entry of ``filename``, if recorded for the content of ``digest``.
+        """
+        entry = self._backend.get(filename)
+        if entry is None or entry.digest != digest:
+            return None
+        return entry
+
+    def entry_for_stat(self, filename: str, stat: FileStat) -> CacheEntry | None:
+        """
+        The entry of ``filename``, if its stat is still the one it had when recorded.
+
+        Entries recorded no earlier than the cache was last written are racily
+        clean: the file could have changed since within the same timestamp, so
+        they never match, and the file must be hashed instead.
+        """
+        entry = self._backend.get(filename)
+        if entry is None or entry.stat != stat:
+            return None
+        return entry
+
+    def mark_clean(
+        self,
+        filename: str,
+        source: str,
+        codemods: Mapping[str, str],
+        stat: FileStat | None = None,
+        warnings: Mapping[str, Sequence[str]] | None = None,
+    ) -> None:
+        """Record file content as clean under ``codemods``, along with the file's stat when known."""
+        self.mark_clean_digest(filename, source_digest(source), codemods, stat, warnings)
+
+    def mark_clean_digest(
+        self,
+        filename: str,
+        digest: str,
+        codemods: Mapping[str, str],
+        stat: FileStat | None = None,
+        warnings: Mapping[str, Sequence[str]] | None = None,
+    ) -> None:
+        """
+        Record the content of ``filename`` as clean under ``codemods``, along with the file's stat when known.
+
+        It stays clean under the codemods it already was clean under, if unchanged, with their warnings.
+
+        Arguments:
+            filename: The clean file.
+            digest: The digest of its content, computed with :func:`source_digest`.
+            codemods: The keys of the codemods it is clean under, by codemod name.
+            stat: Its stat, taken before reading it.
+            warnings: The warnings the codemods which ran on it emitted, by codemod name.
+        """
+        entry = CacheEntry(
+            digest=digest,
+            codemods=dict(codemods),
+            stat=stat,
+            warnings={name: list(messages) for name, messages in (warnings or {}).items() if messages},
+        )
+        self._backend.put(filename, _merged(self._backend.get(filename), entry))
+
+    def mark_failed(self, filename: str, digest: str, failure: CachedFailure, stat: FileStat | None = None) -> None:
+        """
+        Record processing the content of ``filename`` as failing, along with the file's stat when known.
+
+        It stays clean under the codemods it already was clean under, if unchanged.
+
+        Arguments:
+            filename: The failed file.
+            digest: The digest of its content, computed with :func:`source_digest`.
+            failure: How processing it failed.
+            stat: Its stat, taken before reading it.
+        """
+        entry = CacheEntry(digest=digest, codemods={}, stat=stat, failure=failure)
+        self._backend.put(filename, _merged(self._backend.get(filename), entry))
+
+    def duration(self, filename: str) -> float | None:
+        """Seconds the last recorded transform of the file took, if any."""
+        return self._backend.duration(filename)
+
+    def record_duration(self, filename: str, seconds: float) -> None:
+        """Record how many seconds transforming the file took."""
+        self._backend.record_duration(filename, seconds)
+
+    def dump(self) -> None:
+        """Persist the cache."""
+        self._backend.flush()
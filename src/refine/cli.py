@@ -8,27 +8,40 @@ from __future__ import annotations
 
 import argparse
 import logging
+import os
 import pathlib
 import pprint
 import sys
+from collections.abc import Iterable
+from collections.abc import Iterator
 from multiprocessing import freeze_support
+from typing import TYPE_CHECKING
+from typing import Any
 from typing import NoReturn
 
 import msgspec.structs
 import py_walk
 
 from refine import __version__
+from refine import daemon
+from refine import git
 from refine.config import Config
 from refine.exc import InvalidConfigError
 from refine.exc import RefineSystemExit
-from refine.processor import ParallelTransformResult
-from refine.processor import Processor
-from refine.registry import Registry
+
+if TYPE_CHECKING:
+    # Imported where used: they import libCST, which runs forwarded to a daemon never need.
+    from refine.processor import ParallelTransformResult
+    from refine.processor import Processor
+    from refine.registry import Registry
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(message)s")
 
 log = logging.getLogger(__name__)
 
+#: Number of slowest files ``--profile`` lists, unless the ``profile`` setting says otherwise.
+PROFILE_SLOWEST = 10
+
 
 class CLI:
     """
@@ -40,8 +53,12 @@ class CLI:
     registry: Registry
     processor: Processor
 
+    #: Whether ``--daemon`` forwards the run to a running daemon. The daemon's own
+    #: CLI turns this off so it never forwards to itself.
+    forward_to_daemon: bool = True
+
     def __init__(self) -> None:
-        self.files: list[pathlib.Path] = []
+        self.files: Iterable[pathlib.Path] = ()
         self.parser = self._setup_parser()
 
     def run(self, argv: list[str] | None = None) -> NoReturn:
@@ -51,6 +68,11 @@ class CLI:
         if argv is None:
             argv = sys.argv[1:]
 
+        if self._is_subcommand(argv, "daemon"):
+            self._run_daemon_command(argv[1:])
+        if self._is_subcommand(argv, "tune"):
+            self._run_tune_command(argv[1:])
+
         args = self.parser.parse_args(argv)
         if args.quiet:
             logging.getLogger().setLevel(logging.ERROR)
@@ -58,18 +80,67 @@ class CLI:
             logging.getLogger().setLevel(logging.DEBUG)
             logging.getLogger("py_walk").setLevel(logging.INFO)
 
+        if args.daemon and self.forward_to_daemon:
+            exitcode = daemon.forward(argv, cwd=os.getcwd())
+            if exitcode is not None:
+                self.parser.exit(status=exitcode)
+            log.debug("No refine daemon is running; processing in-process")
+
+        from refine import tune  # noqa: PLC0415
+
         self.config = self._load_config(args.config)
-        config_overrides = {}
+        recommendation = tune.load_recommendation(self.config.resolved_cache_dir())
+        if recommendation is not None:
+            # The tuned settings only stand in for those the configuration leaves out.
+            tuned = self.config.unconfigured(recommendation.as_config())
+            if tuned:
+                log.info(
+                    "Using the settings saved by 'refine tune' in %s: %s",
+                    self.config.resolved_cache_dir() / tune.RECOMMENDATION_FILE,
+                    ", ".join(f"{name}={value}" for name, value in tuned.items()),
+                )
+                self.config = msgspec.structs.replace(self.config, **tuned)
+        config_overrides: dict[str, Any] = {}
         if args.fail_fast:
             config_overrides["fail_fast"] = True
+        if args.check:
+            config_overrides["check"] = True
+        if args.diff:
+            config_overrides["diff"] = True
+        if args.exit_on_first_change:
+            config_overrides["exit_on_first_change"] = True
         if args.hide_progress:
             config_overrides["hide_progress"] = True
         if args.respect_gitignore:
             config_overrides["respect_gitignore"] = True
         if args.process_pool_size:
             config_overrides["process_pool_size"] = args.process_pool_size
+        if args.ingest_concurrency:
+            config_overrides["ingest_concurrency"] = args.ingest_concurrency
+        if args.executor:
+            config_overrides["executor"] = args.executor
+        if args.file_timeout is not None:
+            config_overrides["file_timeout"] = args.file_timeout
+        if args.codemod_timeout is not None:
+            config_overrides["codemod_timeout"] = args.codemod_timeout
+        if args.worker_max_rss is not None:
+            config_overrides["worker_max_rss"] = args.worker_max_rss
+        if args.batch_size is not None:
+            config_overrides["batch_size"] = args.batch_size
+        if args.profile and not self.config.profile:
+            config_overrides["profile"] = PROFILE_SLOWEST
+        if args.trace_file is not None:
+            config_overrides["trace_file"] = str(args.trace_file)
+        if args.fsync is not None:
+            config_overrides["fsync"] = args.fsync
         if args.no_cache:
             config_overrides["cache"] = False
+        if args.no_output_cache:
+            config_overrides["output_cache"] = False
+        if args.cache_paranoid:
+            config_overrides["cache_paranoid"] = True
+        if args.retry_failures:
+            config_overrides["retry_failures"] = True
 
         if args.codemod_paths:
             self.config.codemod_paths.clear()
@@ -90,8 +161,7 @@ class CLI:
                     continue
                 self.config.codemod_paths.append(strpath)
 
-        self.registry = Registry()
-        self.registry.load(self.config.codemod_paths)
+        self.registry = self._load_registry(self.config.codemod_paths)
 
         available_codemods = {codemod.NAME: codemod.get_short_description() for codemod in self.registry.codemods()}
 
@@ -150,26 +220,21 @@ class CLI:
         if not paths:
             paths.append(repo_root)
 
-        ignore_patterns: list[str] = [
-            *self.config.exclude_patterns,
-            "**/__pycache__/**",
-        ]
-        gitignore_file = repo_root / ".gitignore"
-        if self.config.respect_gitignore and gitignore_file.exists():
-            ignore_patterns.extend(
-                pattern
-                for pattern in gitignore_file.read_text().splitlines()
-                if pattern and not pattern.startswith("#")
-            )
-
         for path in paths:
-            if path.is_file():
-                if self._append_path(path, repo_root=repo_root, files=self.files) is False:
-                    self.parser.exit(status=1)
-                continue
-            for subpath in py_walk.walk(path, match=["*.py"], mode="only-files", ignore=ignore_patterns):
-                if self._append_path(subpath, repo_root=repo_root, files=self.files) is False:
-                    self.parser.exit(status=1)
+            # Validate the explicitly passed paths before anything gets processed.
+            if self._resolve_path(path, repo_root=repo_root) is None:
+                self.parser.exit(status=1)
+        if args.since is not None or args.staged:
+            try:
+                changed_files = git.changed_files(repo_root, since=args.since, staged=args.staged)
+            except git.GitError as exc:
+                log.error(str(exc))  # noqa: TRY400
+                self.parser.exit(status=1)
+            self.files = self._filter_files(
+                changed_files, paths, repo_root=repo_root, ignore_patterns=self._ignore_patterns(repo_root)
+            )
+        else:
+            self.files = self._iter_files(paths, repo_root=repo_root, ignore_patterns=self._ignore_patterns(repo_root))
 
         self.codemods = list(
             self.registry.codemods(select_codemods=self.config.select, exclude_codemods=self.config.exclude)
@@ -183,13 +248,31 @@ class CLI:
             log.info(" - %s: %s", codemod.NAME, codemod.get_short_description())
 
         try:
-            self.processor = Processor(config=self.config, registry=self.registry, codemods=self.codemods)
+            self.processor = self._get_processor()
         except InvalidConfigError as exc:
             log.error(str(exc))  # noqa: TRY400
             self.parser.exit(status=1)
 
         self._process_files()
 
+    def _load_registry(self, codemod_paths: list[str]) -> Registry:
+        """
+        Load the registry of available codemods.
+        """
+        from refine.registry import Registry  # noqa: PLC0415
+
+        registry = Registry()
+        registry.load(codemod_paths)
+        return registry
+
+    def _get_processor(self) -> Processor:
+        """
+        Create the processor for the selected codemods.
+        """
+        from refine.processor import Processor  # noqa: PLC0415
+
+        return Processor(config=self.config, registry=self.registry, codemods=self.codemods)
+
     def _process_files(self) -> NoReturn:
         """
         Process the files with the selected codemods.
@@ -198,6 +281,9 @@ class CLI:
             result: ParallelTransformResult = self.processor.process(self.files)
             if result.failures:
                 self.parser.exit(status=1)
+            if self.config.check and result.changed:
+                log.info("%s files would be changed", result.changed)
+                self.parser.exit(status=1)
         except RefineSystemExit as exc:
             self.parser.exit(status=exc.code, message=exc.message)
         except SystemExit as exc:
@@ -237,6 +323,63 @@ class CLI:
             default=None,
             help="Number of processes to use for parallel processing. Defaults to the number of available CPUs.",
         )
+        parser.add_argument(
+            "--ingest-concurrency",
+            type=int,
+            default=None,
+            help="Number of threads reading, hashing and gating files ahead of the processing pool.",
+        )
+        parser.add_argument(
+            "--executor",
+            choices=("auto", "process", "thread", "interpreter", "sync"),
+            default=None,
+            help="How files are processed in parallel.",
+        )
+        parser.add_argument(
+            "--file-timeout",
+            type=float,
+            default=None,
+            help="Seconds a worker may spend on a single file before it is killed. 0 means no limit.",
+        )
+        parser.add_argument(
+            "--codemod-timeout",
+            type=float,
+            default=None,
+            help="Seconds a single codemod may spend on a single file. 0 means no limit.",
+        )
+        parser.add_argument(
+            "--worker-max-rss",
+            type=int,
+            default=None,
+            help="Resident memory, in MiB, past which a worker process is replaced. 0 means never.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of files sent to a worker per task. 0 sizes batches adaptively.",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            default=False,
+            help=(
+                "Print how long each processing phase took, along with the slowest files "
+                f"({PROFILE_SLOWEST} unless the `profile` setting says otherwise)."
+            ),
+        )
+        parser.add_argument(
+            "--trace-file",
+            type=pathlib.Path,
+            default=None,
+            help="Write a trace of the run to this file, to inspect in Perfetto (https://ui.perfetto.dev).",
+        )
+        parser.add_argument(
+            "--fsync",
+            choices=("per-file", "batch", "none"),
+            default=None,
+            help="How rewritten files are made durable: fsync each file, sync them in groups, or not at all.",
+        )
         verbosity_group = parser.add_mutually_exclusive_group()
         verbosity_group.add_argument(
             "--quiet",
@@ -265,12 +408,72 @@ class CLI:
             default=False,
             help="Exit as soon as possible on the first processing error",
         )
+        parser.add_argument(
+            "--since",
+            metavar="REF",
+            default=None,
+            help=(
+                "Only process the Python files git lists as changed since the current branch forked from REF, "
+                "committed or not, and the untracked ones."
+            ),
+        )
+        parser.add_argument(
+            "--staged",
+            action="store_true",
+            default=False,
+            help="Only process the Python files with changes staged in git, since REF when --since is also passed.",
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            default=False,
+            help="Don't write the files back, exit with a non-zero status if any file would change.",
+        )
+        parser.add_argument(
+            "--diff",
+            action="store_true",
+            default=False,
+            help="Don't write the files back, print a unified diff of each file which would change to stdout.",
+        )
+        parser.add_argument(
+            "--exit-on-first-change",
+            action="store_true",
+            default=False,
+            help="Exit as soon as possible after the first file which changes, or would change.",
+        )
         parser.add_argument(
             "--no-cache",
             action="store_true",
             default=False,
             help="Do not read or write the run cache.",
         )
+        parser.add_argument(
+            "--no-output-cache",
+            action="store_true",
+            default=False,
+            help="Do not replay, nor store, the outputs of transformed files.",
+        )
+        parser.add_argument(
+            "--cache-paranoid",
+            action="store_true",
+            default=False,
+            help="Hash every file to tell whether it changed, never trusting its size and modification time.",
+        )
+        parser.add_argument(
+            "--retry-failures",
+            action="store_true",
+            default=False,
+            help="Process again the files the cache knows failed, rather than reporting their failure again.",
+        )
+        parser.add_argument(
+            "--daemon",
+            action="store_true",
+            default=False,
+            help=(
+                "Forward this run to a running refine daemon (see 'refine daemon start'), "
+                "falling back to processing in-process when no daemon is running."
+            ),
+        )
         parser.add_argument(
             "--list-codemods",
             "--list",
@@ -326,9 +529,229 @@ class CLI:
         )
         return parser
 
-    def _append_path(self, path: pathlib.Path, repo_root: pathlib.Path, files: list[pathlib.Path]) -> bool:
+    def _is_subcommand(self, argv: list[str], name: str) -> bool:
+        """
+        Whether ``argv`` runs the ``name`` subcommand.
+
+        A file or directory called ``name`` is one to process, not the subcommand.
+        """
+        return argv[:1] == [name] and not os.path.exists(name)
+
+    def _setup_daemon_parser(self) -> argparse.ArgumentParser:
+        """
+        Setup the ``refine daemon`` command line parser.
+        """
+        parser = argparse.ArgumentParser(
+            description="Manage the refine daemon serving the current directory.",
+            prog="refine daemon",
+        )
+        parser.add_argument("action", choices=("start", "stop", "status"), help="What to do with the daemon.")
+        parser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=daemon.DEFAULT_IDLE_TIMEOUT,
+            help="Seconds without requests after which the daemon exits. Defaults to %(default)s.",
+        )
+        parser.add_argument(
+            "--foreground",
+            action="store_true",
+            default=False,
+            help="Serve from this process instead of starting a background daemon.",
+        )
+        return parser
+
+    def _run_daemon_command(self, argv: list[str]) -> NoReturn:
+        """
+        Start, stop or query the daemon serving the current directory.
+        """
+        parser = self._setup_daemon_parser()
+        args = parser.parse_args(argv)
+        if not daemon.SUPPORTED:
+            log.error("The refine daemon is not supported on this platform")
+            parser.exit(status=1)
+        cwd = os.getcwd()
+        if args.action == "status":
+            status = daemon.status(cwd)
+            if status is None:
+                log.info("No refine daemon is running for %s", cwd)
+                parser.exit(status=1)
+            log.info(
+                "refine daemon %s (pid %s) serving %s; %s runs, up for %.0f seconds",
+                status.version,
+                status.pid,
+                status.cwd,
+                status.runs,
+                status.uptime,
+            )
+            parser.exit()
+        if args.action == "stop":
+            if not daemon.stop(cwd):
+                log.info("No refine daemon is running for %s", cwd)
+            parser.exit()
+        if args.foreground:
+            try:
+                daemon.serve(cwd, idle_timeout=args.idle_timeout)
+            except daemon.DaemonError as exc:
+                log.error(str(exc))  # noqa: TRY400
+                parser.exit(status=1)
+            parser.exit()
+        try:
+            pid = daemon.start(cwd, idle_timeout=args.idle_timeout)
+        except daemon.DaemonError as exc:
+            log.error(str(exc))  # noqa: TRY400
+            parser.exit(status=1)
+        log.info("refine daemon (pid %s) serving %s", pid, cwd)
+        parser.exit()
+
+    def _setup_tune_parser(self) -> argparse.ArgumentParser:
         """
-        Append a path to the list of paths if it is not already present.
+        Setup the ``refine tune`` command line parser.
+        """
+        parser = argparse.ArgumentParser(
+            description=(
+                "Time the selected codemods over a sample of the files under several executors, "
+                "pool sizes and batch sizes, and save the fastest settings to the cache directory. "
+                "Later runs use them for the settings the configuration leaves out."
+            ),
+            prog="refine tune",
+        )
+        parser.add_argument(
+            "files", metavar="FILE", nargs="*", type=pathlib.Path, help="Files or directories to sample from."
+        )
+        parser.add_argument(
+            "--config",
+            type=pathlib.Path,
+            help="Path to config file. Defaults to '%(default)s' on the current directory.",
+            default=".refine.toml",
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=200,
+            help="Number of files to time each setting on. Defaults to %(default)s.",
+        )
+        parser.add_argument(
+            "--max-jobs",
+            type=int,
+            default=None,
+            help="Largest pool size to try. Defaults to the number of available CPUs.",
+        )
+        return parser
+
+    def _run_tune_command(self, argv: list[str]) -> NoReturn:
+        """
+        Find and save the fastest executor, pool size and batch size for this tree.
+        """
+        from refine import tune  # noqa: PLC0415
+
+        parser = self._setup_tune_parser()
+        args = parser.parse_args(argv)
+        if args.sample < 1:
+            parser.error("--sample must be at least 1")
+
+        self.config = self._load_config(args.config)
+        self.registry = self._load_registry(self.config.codemod_paths)
+        codemods = list(
+            self.registry.codemods(select_codemods=self.config.select, exclude_codemods=self.config.exclude)
+        )
+        if not codemods:
+            log.error("No codemods selected. Exiting.")
+            parser.exit(status=1)
+
+        repo_root = pathlib.Path(self.config.repo_root)
+        paths: list[pathlib.Path] = args.files or [repo_root]
+        for path in paths:
+            if self._resolve_path(path, repo_root=repo_root) is None:
+                parser.exit(status=1)
+        files = tune.sample(
+            list(self._iter_files(paths, repo_root=repo_root, ignore_patterns=self._ignore_patterns(repo_root))),
+            args.sample,
+        )
+        if not files:
+            log.error("No files to tune on. Exiting.")
+            parser.exit(status=1)
+
+        log.info("Timing %s codemods over %s files:", len(codemods), len(files))
+        recommendation = tune.tune(self.config, self.registry, codemods, files, max_jobs=args.max_jobs)
+        path = tune.save_recommendation(self.config.resolved_cache_dir(), recommendation)
+        log.info(
+            "Fastest: the %s executor, %s jobs, batch size %s. Saved to %s",
+            recommendation.executor,
+            recommendation.process_pool_size,
+            recommendation.batch_size or "auto",
+            path,
+        )
+        parser.exit()
+
+    def _ignore_patterns(self, repo_root: pathlib.Path) -> list[str]:
+        """
+        Glob patterns of the paths not to process.
+        """
+        ignore_patterns: list[str] = [
+            *self.config.exclude_patterns,
+            "**/__pycache__/**",
+        ]
+        gitignore_file = repo_root / ".gitignore"
+        if self.config.respect_gitignore and gitignore_file.exists():
+            ignore_patterns.extend(
+                pattern
+                for pattern in gitignore_file.read_text().splitlines()
+                if pattern and not pattern.startswith("#")
+            )
+        return ignore_patterns
+
+    def _iter_files(
+        self, paths: list[pathlib.Path], repo_root: pathlib.Path, ignore_patterns: list[str]
+    ) -> Iterator[pathlib.Path]:
+        """
+        Lazily discover the files to process, each one once.
+
+        Being a generator, the processor starts working on the first files while
+        the rest of the tree is still being walked. The ``paths`` must have been
+        validated already: files found under them which resolve outside the repo
+        root, through symlinks, are skipped rather than failing a run which may
+        have processed files already.
+        """
+        seen: set[pathlib.Path] = set()
+        for path in paths:
+            subpaths: Iterable[pathlib.Path]
+            if path.is_file():
+                subpaths = (path,)
+            else:
+                subpaths = py_walk.walk(path, match=["*.py"], mode="only-files", ignore=ignore_patterns)
+            for subpath in subpaths:
+                resolved_path = subpath.resolve()
+                if not resolved_path.is_relative_to(repo_root):
+                    log.warning(
+                        "Skipping %s: it resolves to %s, outside the repo root %s", subpath, resolved_path, repo_root
+                    )
+                    continue
+                if resolved_path not in seen:
+                    seen.add(resolved_path)
+                    yield resolved_path
+
+    def _filter_files(
+        self,
+        files: list[pathlib.Path],
+        paths: list[pathlib.Path],
+        repo_root: pathlib.Path,
+        ignore_patterns: list[str],
+    ) -> list[pathlib.Path]:
+        """
+        Keep the ``files`` which discovering ``paths`` would have found.
+        """
+        roots = [path.resolve() for path in paths]
+        ignore = py_walk.get_parser_from_list(ignore_patterns, base_dir=repo_root)
+        return [
+            resolved_path
+            for resolved_path in (path.resolve() for path in files)
+            if any(resolved_path == root or resolved_path.is_relative_to(root) for root in roots)
+            and not ignore.match(resolved_path)
+        ]
+
+    def _resolve_path(self, path: pathlib.Path, repo_root: pathlib.Path) -> pathlib.Path | None:
+        """
+        Resolve a path, returning ``None`` when it is not inside the repo root.
         """
         resolved_path: pathlib.Path = path.resolve()
         try:
@@ -340,11 +763,8 @@ class CLI:
                 path,
                 repo_root,
             )
-            return False
-        else:
-            if resolved_path not in files:
-                files.append(resolved_path)
-            return True
+            return None
+        return resolved_path
 
     def _load_config(self, path: pathlib.Path) -> Config:
         """
@@ -372,7 +792,7 @@ class CLI:
                 config = Config.from_pyproject_file(pyproject_config_file)
             else:
                 log.debug("Loading default configuration")
-                config = Config()
+                config = Config.from_dict({})
 
         log.debug("Loaded config:\n%s", pprint.pformat(config.as_dict()))
         return config
@@ -9,6 +9,7 @@ import os
 import tomllib
 from pathlib import Path
 from typing import Any
+from typing import Literal
 
 import msgspec
 
@@ -23,6 +24,12 @@ def _cpu_count() -> int:
     return max((os.cpu_count() or 1) - 1, 1)
 
 
+def _ingest_concurrency() -> int:
+    # Reading and hashing release the GIL, but the gates do not: past a few
+    # threads there is little left to gain.
+    return min(os.cpu_count() or 1, 8)
+
+
 class Config(msgspec.Struct, kw_only=True, frozen=True):
     """
     Main codemod configuration schema.
@@ -53,6 +60,76 @@ class Config(msgspec.Struct, kw_only=True, frozen=True):
     Defaults to the number of available CPUs.
     """
 
+    ingest_concurrency: int = msgspec.field(default_factory=_ingest_concurrency)
+    """
+    Number of threads reading, hashing and gating files ahead of the processing pool.
+    Set it to 1 to do that serially. Defaults to the number of available CPUs, up to 8.
+    """
+
+    executor: Literal["auto", "process", "thread", "interpreter", "sync"] = "auto"
+    """
+    How files are processed in parallel.
+
+    - `process`: a pool of worker processes.
+    - `thread`: a pool of threads, only parallel on free-threaded Python builds.
+    - `interpreter`: a pool of subinterpreters, Python 3.14+. Falls back to `process` when
+      a codemod cannot be imported in a subinterpreter.
+    - `sync`: no parallelism, everything runs in the main process.
+    - `auto` (default): `sync` for a single job, otherwise `thread` on free-threaded Python builds,
+      then `interpreter` when possible, and `process` otherwise. Always `process` when
+      `file_timeout` or `worker_max_rss` is set, which only it enforces.
+    """
+
+    batch_size: int = 0
+    """
+    Number of files sent to a worker per task.
+    Defaults to 0, which sizes each batch from the files' sizes and how fast the workers get through them.
+    """
+
+    file_timeout: float = 0.0
+    """
+    Seconds a worker may spend on a single file. A worker going past it is killed and replaced,
+    the file is reported as failed and the run carries on. Only the `process` executor enforces it,
+    which `auto` picks when it is set.
+    Defaults to 0, no limit.
+    """
+
+    codemod_timeout: float = 0.0
+    """
+    Seconds a single codemod may spend on a single file before the file is reported as failed.
+    Only enforced on Unix, by the `process` and `sync` executors, and only between Python
+    instructions, so use it along with `file_timeout`. Defaults to 0, no limit.
+    """
+
+    worker_max_rss: int = 0
+    """
+    Resident memory, in MiB, past which a process pool worker is retired, once done with its
+    current batch, and replaced by a fresh one. Defaults to 0, never retire workers.
+    """
+
+    profile: int = 0
+    """
+    When above 0, time each phase of processing every file (reading, hashing, gating, parsing,
+    each codemod, metadata resolution, codegen and writing) and print a report at the end of
+    the run, listing this many of the slowest files. Defaults to 0, no profiling.
+    """
+
+    trace_file: str = ""
+    """
+    Path of a file to write a trace of the run to, in the Trace Event Format, for Perfetto
+    or `chrome://tracing` to show. Defaults to an empty string, no tracing.
+    """
+
+    fsync: Literal["per-file", "batch", "none"] = "per-file"
+    """
+    How the rewritten files are made durable. Files are always replaced atomically.
+
+    - `per-file` (default): each file is fsynced before it replaces the original.
+    - `batch`: the files are committed in groups, as results come in: one `syncfs` per filesystem
+      (one fsync per file outside Linux), then the renames, then one fsync per directory.
+    - `none`: no fsync at all. Fastest, but a crash may lose the most recent rewrites.
+    """
+
     repo_root: str = msgspec.field(default_factory=os.getcwd)
     """
     The root directory of the repository.
@@ -64,6 +141,21 @@ class Config(msgspec.Struct, kw_only=True, frozen=True):
     Stop processing as soon as possible after the first error.
     """
 
+    check: bool = False
+    """
+    Only report the files which would change, without writing them. The run fails when any would.
+    """
+
+    diff: bool = False
+    """
+    Print a unified diff of each file which would change to stdout, without writing it.
+    """
+
+    exit_on_first_change: bool = False
+    """
+    Stop processing as soon as possible after the first file which changes, or would change.
+    """
+
     respect_gitignore: bool = False
     """
     Ignore files and directories listed in `.gitignore`.
@@ -89,8 +181,67 @@ class Config(msgspec.Struct, kw_only=True, frozen=True):
     Directory (relative to ``repo_root`` unless absolute) holding the run cache.
     """
 
+    cache_key: Literal["content", "git"] = "content"
+    """
+    How the cache tells whether a file changed since it was last found clean.
+
+    - `content` (default): hash the content of every file, unless its size, modification
+      time and inode are still those it had when last found clean (see `cache_paranoid`).
+    - `git`: get the blob ids of the files git tracks, and which are unmodified in the
+      worktree, from git in one call, and only read the files the cache does not know
+      under those ids. Other files are read and hashed like with `content`.
+    """
+
+    cache_backend: Literal["msgpack", "sqlite"] = "msgpack"
+    """
+    Where the run cache keeps its entries, in `cache_dir`.
+
+    - `msgpack` (default): a single file, read whole when a run starts and rewritten whole
+      when it ends. Of concurrent runs, the last one to end wins.
+    - `sqlite`: an SQLite database in WAL mode, looked up file by file and updated in a
+      single transaction per run, which concurrent runs (pre-commit hooks, editors) share
+      safely. Runs over a handful of files of a large tree no longer load its whole cache.
+    """
+
+    cache_paranoid: bool = False
+    """
+    Whether to always hash the content of the files, rather than trusting their size,
+    modification time and inode to tell they did not change since last found clean.
+
+    Only needed where tools rewrite files keeping their size and modification time.
+    """
+
+    retry_failures: bool = False
+    """
+    Whether to process again the files which failed to parse, or made a codemod crash, last
+    time they were processed with the same content and codemods. Otherwise the cache
+    reports the same failure again, without processing them.
+    """
+
+    output_cache: bool = True
+    """
+    Whether to keep the output of each transformed file, and write it again without running
+    the codemods when the file comes back with the same content (branch switches, rebases,
+    reverts). Disabled along with `cache`.
+    """
+
+    output_cache_dir: str = ""
+    """
+    Directory (relative to ``repo_root`` unless absolute) holding the output cache, the
+    `outputs` directory of `cache_dir` when empty. Several checkouts, or CI runners, can
+    share the same directory.
+    """
+
+    output_cache_max_size: int = 512
+    """
+    Size, in MiB, past which the least recently used outputs are evicted from the output
+    cache. Zero for no limit.
+    """
+
     __remaining_config__: dict[str, Any] = msgspec.field(default_factory=dict)
 
+    __configured__: set[str] = msgspec.field(default_factory=set)
+
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> Config:
         """
@@ -105,6 +256,7 @@ class Config(msgspec.Struct, kw_only=True, frozen=True):
         try:
             config = msgspec.convert(data, type=Config)
             config.__remaining_config__.update({k: v for (k, v) in data.items() if k not in config.__struct_fields__})
+            config.__configured__.update(k for k in data if k in config.__struct_fields__)
         except msgspec.ValidationError as exc:
             error = f"Invalid configuration: {exc}"
             raise InvalidConfigError(error) from exc
@@ -149,6 +301,32 @@ class Config(msgspec.Struct, kw_only=True, frozen=True):
         else:
             return cls.from_dict(data.get("tool", {}).get("refine", {}))
 
+    def unconfigured(self, settings: dict[str, Any]) -> dict[str, Any]:
+        """
+        Return those of ``settings`` the loaded configuration leaves to their built-in default.
+        """
+        return {name: value for name, value in settings.items() if name not in self.__configured__}
+
+    def resolved_cache_dir(self) -> Path:
+        """
+        The cache directory, resolved against ``repo_root`` when relative.
+        """
+        cache_dir = Path(self.cache_dir)
+        if not cache_dir.is_absolute():
+            cache_dir = Path(self.repo_root) / cache_dir
+        return cache_dir
+
+    def resolved_output_cache_dir(self) -> Path:
+        """
+        The output cache directory, resolved against ``repo_root`` when relative.
+        """
+        if not self.output_cache_dir:
+            return self.resolved_cache_dir() / "outputs"
+        output_cache_dir = Path(self.output_cache_dir)
+        if not output_cache_dir.is_absolute():
+            output_cache_dir = Path(self.repo_root) / output_cache_dir
+        return output_cache_dir
+
     def as_dict(self) -> dict[str, Any]:
         """
         Convert the configuration to a dictionary.
@@ -0,0 +1,615 @@
+"""
+Persistent refine daemon.
+
+Every ``refine`` run pays the same fixed startup cost: importing libCST and the
+codemods (sqlfluff alone is a large chunk of it), scanning the ``refine.mods``
+entry points, loading the run cache and spinning up the worker pool. For a
+pre-commit hook touching a handful of files, that cost dominates the actual work.
+
+``refine daemon start`` launches a background process, listening on a Unix socket,
+which keeps all of that warm. ``refine --daemon ...`` then forwards its command line
+and working directory to the daemon, which runs it exactly like an in-process run
+would, streaming back the output and the exit code. When no daemon is running, the
+client falls back to processing in-process.
+
+The daemon serves one run at a time, so runs never race on the run cache. It exits
+on its own after being idle for a while.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import TextIO
+
+import msgspec
+
+from refine import __version__
+from refine.exc import RefineError
+
+if TYPE_CHECKING:
+    from refine.config import Config
+    from refine.processor import Processor
+    from refine.registry import Registry
+
+log = logging.getLogger(__name__)
+
+#: Whether this platform can run the daemon (it needs Unix domain sockets).
+SUPPORTED = sys.platform != "win32" and hasattr(socket, "AF_UNIX")
+
+#: Seconds without requests after which a daemon exits on its own.
+DEFAULT_IDLE_TIMEOUT = 30 * 60.0
+
+#: Seconds ``refine daemon start`` waits for the background daemon to answer.
+START_TIMEOUT = 30.0
+
+#: The environment variables a forwarded run gets from its client; anything else
+#: (tokens, credentials) stays out of the daemon.
+FORWARDED_ENV = frozenset(
+    (
+        "COLUMNS",
+        "FORCE_COLOR",
+        "HOME",
+        "LANG",
+        "LANGUAGE",
+        "LINES",
+        "NO_COLOR",
+        "PATH",
+        "PYTHONPATH",
+        "TERM",
+        "TMPDIR",
+        "TZ",
+        "VIRTUAL_ENV",
+    )
+)
+
+#: Prefixes of the environment variables forwarded too: locale settings, and git's,
+#: which hooks rely on (``GIT_INDEX_FILE`` for ``--staged``, say).
+FORWARDED_ENV_PREFIXES = ("LC_", "GIT_", "REFINE_")
+
+_HEADER_SIZE = 4
+
+#: The exit code of a run the daemon is terminated in the middle of: 128 + SIGTERM, as shells report it.
+_TERMINATED_EXIT_CODE = 143
+
+
+class _Terminated(BaseException):
+    """
+    Raised by the ``SIGTERM`` handler, for the daemon to exit, whatever it is doing.
+
+    Neither an :class:`Exception` nor a :class:`SystemExit`, so the run it
+    interrupts does not take it for its own error, or exit code.
+    """
+
+
+class DaemonError(RefineError):
+    """
+    Raised when the daemon cannot be started or served.
+    """
+
+
+class _RunRequest(msgspec.Struct, tag="run"):
+    argv: list[str]
+    cwd: str
+    env: dict[str, str]
+    version: str
+
+
+class _PingRequest(msgspec.Struct, tag="ping"):
+    pass
+
+
+class _StopRequest(msgspec.Struct, tag="stop"):
+    pass
+
+
+_Request = _RunRequest | _PingRequest | _StopRequest
+
+
+class _OutputFrame(msgspec.Struct, tag="output"):
+    stream: str
+    data: str
+
+
+class _ExitFrame(msgspec.Struct, tag="exit"):
+    code: int
+
+
+class _RejectFrame(msgspec.Struct, tag="reject"):
+    reason: str
+
+
+class DaemonStatus(msgspec.Struct, tag="status"):
+    """
+    What a running daemon reports about itself.
+    """
+
+    pid: int
+    version: str
+    cwd: str
+    uptime: float
+    runs: int
+
+
+_Frame = _OutputFrame | _ExitFrame | _RejectFrame | DaemonStatus
+
+_request_decoder = msgspec.msgpack.Decoder(_Request)
+_frame_decoder = msgspec.msgpack.Decoder(_Frame)
+
+
+def _runtime_dir() -> str:
+    """
+    Return the directory holding the daemon sockets, creating it when missing.
+
+    ``$XDG_RUNTIME_DIR/refine`` when set, else ``refine-<uid>`` in the temporary
+    directory, so it stays well within the Unix socket path length limit. Whoever
+    binds a socket first gets the environment of the runs forwarded to it, and
+    decides their exit codes: the directory must be private to the current user.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    path = os.path.join(base, "refine") if base else os.path.join(tempfile.gettempdir(), f"refine-{os.getuid()}")
+    try:
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(path, 0o700)
+        info = os.lstat(path)
+    except OSError as exc:
+        error = f"Cannot create the refine daemon directory {path}: {exc}"
+        raise DaemonError(error) from exc
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        error = f"{path} is not a directory private to the current user"
+        raise DaemonError(error)
+    return path
+
+
+def socket_path(cwd: str) -> str:
+    """
+    Return the socket path of the daemon serving ``cwd``.
+    """
+    digest = hashlib.sha256(os.path.realpath(cwd).encode()).hexdigest()[:16]
+    return os.path.join(_runtime_dir(), f"{digest}.sock")
+
+
+def _peer_uid(sock: socket.socket, path: str) -> int:
+    """
+    Return the user ID of the process on the other end of ``sock``, connected to ``path``.
+    """
+    if hasattr(socket, "SO_PEERCRED"):
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", credentials)
+        return uid
+    # No peer credentials on this platform: whoever created the socket file then.
+    return os.stat(path).st_uid
+
+
+def _forwarded_env() -> dict[str, str]:
+    return {
+        name: value
+        for name, value in os.environ.items()
+        if name in FORWARDED_ENV or name.startswith(FORWARDED_ENV_PREFIXES)
+    }
+
+
+def _send(sock: socket.socket, message: msgspec.Struct) -> None:
+    payload = msgspec.msgpack.encode(message)
+    sock.sendall(len(payload).to_bytes(_HEADER_SIZE, "big") + payload)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            error = "Connection closed mid-message"
+            raise ConnectionError(error)
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock: socket.socket) -> bytes:
+    size = int.from_bytes(_recv_exactly(sock, _HEADER_SIZE), "big")
+    return _recv_exactly(sock, size)
+
+
+@contextlib.contextmanager
+def _connect(cwd: str) -> Iterator[socket.socket | None]:
+    """
+    Connect to the daemon serving ``cwd``, yielding ``None`` when there is none.
+    """
+    if not SUPPORTED:
+        yield None
+        return
+    try:
+        path = socket_path(cwd)
+    except DaemonError as exc:
+        log.warning("Not using the refine daemon: %s", exc)
+        yield None
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            yield None
+            return
+        if _peer_uid(sock, path) != os.getuid():
+            log.warning("Not using the refine daemon: %s is served by another user", path)
+            yield None
+        else:
+            yield sock
+    finally:
+        sock.close()
+
+
+def forward(argv: list[str], cwd: str, stdout: TextIO | None = None, stderr: TextIO | None = None) -> int | None:
+    """
+    Run ``argv`` on the daemon serving ``cwd``, streaming its output to ``stdout``/``stderr``.
+
+    Returns the exit code of the run, or ``None`` when no daemon could take the run
+    (none running, one from a different refine version, or one not run by the current
+    user), in which case the caller should process in-process. Only the environment
+    variables in :data:`FORWARDED_ENV` (or starting with one of the
+    :data:`FORWARDED_ENV_PREFIXES`) are passed on to the run.
+    """
+    streams = {"stdout": stdout or sys.stdout, "stderr": stderr or sys.stderr}
+    with _connect(cwd) as sock:
+        if sock is None:
+            return None
+        received_output = False
+        try:
+            _send(sock, _RunRequest(argv=argv, cwd=cwd, env=_forwarded_env(), version=__version__))
+            while True:
+                frame = _frame_decoder.decode(_recv(sock))
+                if isinstance(frame, _OutputFrame):
+                    received_output = True
+                    stream = streams[frame.stream]
+                    stream.write(frame.data)
+                    stream.flush()
+                elif isinstance(frame, _ExitFrame):
+                    return frame.code
+                elif isinstance(frame, _RejectFrame):
+                    log.debug("The refine daemon rejected the run: %s", frame.reason)
+                    return None
+        except (OSError, msgspec.DecodeError) as exc:
+            if not received_output:
+                log.debug("Lost the connection to the refine daemon: %s", exc)
+                return None
+            log.error("Lost the connection to the refine daemon mid-run: %s", exc)  # noqa: TRY400
+            return 1
+
+
+def status(cwd: str) -> DaemonStatus | None:
+    """
+    Return the status of the daemon serving ``cwd``, or ``None`` when there is none.
+    """
+    with _connect(cwd) as sock:
+        if sock is None:
+            return None
+        try:
+            _send(sock, _PingRequest())
+            frame = _frame_decoder.decode(_recv(sock))
+        except (OSError, msgspec.DecodeError):
+            return None
+        if isinstance(frame, DaemonStatus):
+            return frame
+        return None
+
+
+def stop(cwd: str) -> bool:
+    """
+    Ask the daemon serving ``cwd`` to exit.
+
+    Returns ``False`` when there was no daemon to stop.
+    """
+    with _connect(cwd) as sock:
+        if sock is None:
+            return False
+        try:
+            _send(sock, _StopRequest())
+            _recv(sock)
+        except OSError:
+            return False
+        return True
+
+
+def start(cwd: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> int:
+    """
+    Start a background daemon serving ``cwd`` and wait until it answers.
+
+    Returns the daemon's PID.
+    """
+    running = status(cwd)
+    if running is not None:
+        error = f"A refine daemon (pid {running.pid}) is already serving {cwd}"
+        raise DaemonError(error)
+    log_path = Path(socket_path(cwd)).with_suffix(".log")
+    with open(log_path, "ab") as log_fh:
+        process = subprocess.Popen(  # noqa: S603
+            [
+                sys.executable,
+                "-m",
+                "refine",
+                "daemon",
+                "start",
+                "--foreground",
+                f"--idle-timeout={idle_timeout}",
+            ],
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=log_fh,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            error = f"The refine daemon exited with code {process.returncode}; see {log_path}"
+            raise DaemonError(error)
+        running = status(cwd)
+        if running is not None:
+            return running.pid
+        time.sleep(0.1)
+    process.terminate()
+    error = f"The refine daemon did not answer within {START_TIMEOUT} seconds; see {log_path}"
+    raise DaemonError(error)
+
+
+class _StreamWriter(io.TextIOBase):
+    """
+    Text stream forwarding everything written to it to the client as output frames.
+    """
+
+    def __init__(self, sock: socket.socket, stream: str) -> None:
+        self._sock = sock
+        self._stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if data:
+            _send(self._sock, _OutputFrame(stream=self._stream, data=data))
+        return len(data)
+
+
+class _WarmState:
+    """
+    The registries and processors a daemon keeps alive between runs.
+    """
+
+    def __init__(self, cwd: str) -> None:
+        self.cwd = cwd
+        self.started = time.monotonic()
+        self.runs = 0
+        self._registries: dict[tuple[str, ...], tuple[Any, Registry]] = {}
+        self._processors: dict[bytes, Processor] = {}
+
+    def registry(self, codemod_paths: list[str]) -> Registry:
+        from refine.registry import Registry  # noqa: PLC0415
+
+        key = tuple(codemod_paths)
+        # Codemods loaded from paths are re-loaded when their files change.
+        signature = [
+            (str(fpath), fpath.stat().st_mtime_ns)
+            for path in codemod_paths
+            for fpath in sorted(Path(path).glob("*.py"))
+        ]
+        cached = self._registries.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        registry = Registry()
+        registry.load(codemod_paths)
+        self._registries[key] = (signature, registry)
+        return registry
+
+    def processor(self, config: Config, registry: Registry, codemods: list[Any]) -> Processor:
+        from refine.processor import Processor  # noqa: PLC0415
+
+        key = msgspec.json.encode(
+            [config, [f"{codemod.__module__}.{codemod.__qualname__}" for codemod in codemods]],
+            order="deterministic",
+        )
+        processor = self._processors.get(key)
+        if processor is not None and processor.registry is registry:
+            if processor.cache is not None:
+                # Another refine process may have written the cache meanwhile.
+                processor.cache.refresh()
+            return processor
+        if processor is not None:
+            processor.close()
+        processor = Processor(config=config, registry=registry, codemods=codemods, keep_pool=True)
+        self._processors[key] = processor
+        return processor
+
+    def close(self) -> None:
+        for processor in self._processors.values():
+            processor.close()
+        self._processors.clear()
+
+
+@contextlib.contextmanager
+def _client_context(request: _RunRequest, sock: socket.socket) -> Iterator[None]:
+    """
+    Run the block as if it was the client process: its cwd, environment and output streams.
+    """
+    stdout = _StreamWriter(sock, "stdout")
+    stderr = _StreamWriter(sock, "stderr")
+    root_logger = logging.getLogger()
+    loggers = [root_logger, logging.getLogger("py_walk")]
+    levels = [logger.level for logger in loggers]
+    handler_streams = []
+    for handler in root_logger.handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream in (sys.stderr, sys.__stderr__):
+            handler_streams.append((handler, handler.setStream(stderr)))
+    environ = dict(os.environ)
+    cwd = os.getcwd()
+    try:
+        os.chdir(request.cwd)
+        os.environ.clear()
+        os.environ.update(request.env)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            yield
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        for handler, stream in handler_streams:
+            handler.setStream(stream)
+        for logger, level in zip(loggers, levels, strict=True):
+            logger.setLevel(level)
+
+
+def _run(request: _RunRequest, sock: socket.socket, state: _WarmState) -> int:
+    from refine.cli import CLI  # noqa: PLC0415
+
+    class DaemonCLI(CLI):
+        forward_to_daemon = False
+
+        def _load_registry(self, codemod_paths: list[str]) -> Registry:
+            return state.registry(codemod_paths)
+
+        def _get_processor(self) -> Processor:
+            return state.processor(self.config, self.registry, self.codemods)
+
+    with _client_context(request, sock):
+        try:
+            DaemonCLI().run(request.argv)
+        except SystemExit as exc:
+            if exc.code is None:
+                return 0
+            if isinstance(exc.code, int):
+                return exc.code
+            sys.stderr.write(f"{exc.code}\n")
+            return 1
+        except Exception:
+            log.exception("The refine daemon failed to process the run")
+            return 1
+    return 0
+
+
+def _bind(path: str) -> socket.socket:
+    """
+    Bind a Unix socket at ``path``, replacing the stale socket a daemon may have left behind.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        owner = os.lstat(path).st_uid
+        if owner != os.getuid():
+            error = f"{path} belongs to another user (uid {owner})"
+            raise DaemonError(error)
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Never accessible to anyone else, not even between binding and a chmod.
+    umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    except OSError:
+        server.close()
+        raise
+    finally:
+        os.umask(umask)
+    return server
+
+
+def serve(cwd: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> None:
+    """
+    Serve runs for ``cwd`` from this process until stopped or idle for ``idle_timeout`` seconds.
+    """
+    if not SUPPORTED:
+        error = "The refine daemon is not supported on this platform"
+        raise DaemonError(error)
+    if status(cwd) is not None:
+        error = f"A refine daemon is already serving {cwd}"
+        raise DaemonError(error)
+    path = socket_path(cwd)
+
+    state = _WarmState(cwd)
+    # Warm up: import every entry-point codemod (and with them sqlfluff & co).
+    state.registry([])
+
+    def _terminate(signum: int, frame: object) -> None:
+        raise _Terminated
+
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, _terminate)
+
+    server = _bind(path)
+    try:
+        server.listen()
+        server.settimeout(idle_timeout)
+        log.info("refine daemon (pid %s) serving %s on %s", os.getpid(), cwd, path)
+        while True:
+            try:
+                conn, _ = server.accept()
+            except TimeoutError:
+                log.info("refine daemon idle for %s seconds; exiting", idle_timeout)
+                break
+            with conn:
+                conn.settimeout(None)
+                try:
+                    if _handle(conn, state):
+                        break
+                except OSError as exc:
+                    log.debug("Lost the connection to the client: %s", exc)
+    except _Terminated:
+        log.info("refine daemon terminated; exiting")
+    finally:
+        server.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        state.close()
+
+
+def _handle(conn: socket.socket, state: _WarmState) -> bool:
+    """
+    Handle one client connection.
+
+    Returns ``True`` when the daemon should exit.
+    """
+    try:
+        request = _request_decoder.decode(_recv(conn))
+    except (msgspec.DecodeError, msgspec.ValidationError) as exc:
+        log.debug("Dropping bad request: %s", exc)
+        return False
+    if isinstance(request, _StopRequest):
+        _send(conn, _ExitFrame(code=0))
+        return True
+    if isinstance(request, _PingRequest):
+        _send(
+            conn,
+            DaemonStatus(
+                pid=os.getpid(),
+                version=__version__,
+                cwd=state.cwd,
+                uptime=time.monotonic() - state.started,
+                runs=state.runs,
+            ),
+        )
+        return False
+    if request.version != __version__:
+        _send(conn, _RejectFrame(reason=f"daemon runs refine {__version__}, not {request.version}"))
+        return False
+    state.runs += 1
+    try:
+        code = _run(request, conn, state)
+    except _Terminated:
+        # Terminated mid-run: the client must not take the run for a successful one.
+        with contextlib.suppress(OSError):
+            _send(conn, _ExitFrame(code=_TERMINATED_EXIT_CODE))
+        raise
+    _send(conn, _ExitFrame(code=code))
+    return False
@@ -31,6 +31,12 @@ class ConfigLoadError(RefineError):
         self.message = message
 
 
+class CodemodTimeoutError(RefineError):
+    """
+    A codemod ran out of its time budget on a file.
+    """
+
+
 class RefineSystemExit(SystemExit):
     """
     Refine system exit exception that accepts a message argument.
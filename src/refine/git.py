@@ -0,0 +1,107 @@
+"""
+Asking git which files changed, for ``--since`` and ``--staged`` runs.
+"""
+
+from __future__ import annotations
+
+import logging
+import shutil
+import subprocess
+from pathlib import Path
+
+from refine.exc import RefineError
+
+log = logging.getLogger(__name__)
+
+
+class GitError(RefineError):
+    """
+    Raised when git cannot tell which files changed.
+    """
+
+
+def changed_files(repo_root: Path, *, since: str | None = None, staged: bool = False) -> list[Path]:
+    """
+    The Python files under ``repo_root`` which were added or modified.
+
+    With ``since``, the files changed since the current branch forked from
+    ``since`` (their merge base), committed or not, along with the untracked
+    files which are not ignored. With ``staged``, only the changes staged in
+    the index, since ``since`` or, without it, since ``HEAD``.
+
+    Renamed files are listed under their new name, deleted files are left out.
+
+    Arguments:
+        repo_root: The directory to list the changed files of.
+        since: A git revision.
+        staged: Only list the staged changes.
+
+    Returns:
+        The absolute paths of the changed files.
+    """
+    command = ["diff", "--name-only", "-z", "--relative", "--find-renames", "--diff-filter=ACMR"]
+    if staged:
+        command.append("--cached")
+    if since is not None:
+        command.append(_git(repo_root, "merge-base", since, "HEAD").strip())
+    names = _git(repo_root, *command, "--", "*.py").split("\0")
+    if since is not None and not staged:
+        names.extend(_git(repo_root, "ls-files", "-z", "--others", "--exclude-standard", "--", "*.py").split("\0"))
+
+    files: list[Path] = []
+    for name in dict.fromkeys(names):
+        path = repo_root / name
+        # Deleted from the working tree since being staged, or a directory named like a Python file.
+        if name and path.is_file():
+            files.append(path)
+    log.debug("git lists %d changed files", len(files))
+    return files
+
+
+def blob_ids(repo_root: Path) -> dict[str, str]:
+    """
+    The git blob ids of the files under ``repo_root`` whose worktree content is the one git tracks.
+
+    Files modified in the worktree, or merely touched since the index was last
+    refreshed, are left out, as are symbolic links and unmerged files.
+
+    Arguments:
+        repo_root: The directory to list the files of.
+
+    Returns:
+        The blob id of each file, by absolute path.
+    """
+    modified = set(_git(repo_root, "diff-files", "--name-only", "-z", "--relative").split("\0"))
+    root = repo_root.resolve()
+    ids: dict[str, str] = {}
+    entries = _git(repo_root, "ls-files", "--stage", "-z").split("\0")
+    for entry in entries:
+        if not entry:
+            continue
+        # <mode> SP <object> SP <stage> TAB <file>
+        info, _, name = entry.partition("\t")
+        mode, blob_id, stage = info.split(" ")
+        if mode in ("100644", "100755") and stage == "0" and name not in modified:
+            ids[str(root / name)] = blob_id
+    log.debug("git knows the blob ids of %d unmodified files", len(ids))
+    return ids
+
+
+def _git(repo_root: Path, *args: str) -> str:
+    binary = shutil.which("git")
+    if binary is None:
+        error = "Unable to find the git executable"
+        raise GitError(error)
+    try:
+        process = subprocess.run(  # noqa: S603 -- `binary` comes from shutil.which(), not untrusted input
+            [binary, *args],
+            cwd=repo_root,
+            capture_output=True,
+            check=True,
+            encoding="utf-8",
+            errors="surrogateescape",
+        )
+    except subprocess.CalledProcessError as exc:
+        error = f"'git {' '.join(args)}' failed: {exc.stderr.strip()}"
+        raise GitError(error) from exc
+    return process.stdout
@@ -0,0 +1,163 @@
+"""
+Content-addressed cache of the codemods' outputs.
+
+When a file comes back with a content it already had when it was last
+transformed (branch switches, rebases, reverts, CI runs over pull requests
+sharing a base), its output is known: the :class:`OutputStore` hands it back,
+for the processor to write without parsing the file nor running any codemod.
+
+The store is a directory of plain files, which several checkouts or CI runners
+can share:
+
+- ``objects/<digest>``: each output, by its own digest, stored once however
+  many inputs it is the output of.
+- ``results/<key>``: the digest of the output of a transformation, keyed by
+  :func:`output_key`.
+
+Files are written atomically, and the outputs are checked against their
+digest when read, so concurrent writers and truncated files only ever cause a
+miss. Reading a result refreshes its modification time, which is what
+:meth:`OutputStore.prune` evicts the least recently used files by.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+from collections.abc import Iterable
+from collections.abc import Iterator
+from pathlib import Path
+
+from refine.cache import source_digest
+
+log = logging.getLogger(__name__)
+
+#: What :meth:`OutputStore.prune` brings the store down to, as a fraction of its maximum size,
+#: so that it does not have to prune again after every run.
+_PRUNE_TARGET = 0.8
+
+
+def output_key(codemod_keys: Iterable[str], path: str, digest: str) -> str:
+    """
+    The key of the output of a transformation.
+
+    Arguments:
+        codemod_keys: The keys of the codemods applied, in order.
+        path: The path of the file, relative to the repository root: codemods may depend on it.
+        digest: The digest of the file's content, computed with :func:`refine.cache.source_digest`.
+    """
+    hasher = hashlib.sha256()
+    for codemod_key in codemod_keys:
+        hasher.update(codemod_key.encode())
+        hasher.update(b"\0")
+    hasher.update(path.encode("utf-8", "surrogateescape"))
+    hasher.update(b"\0")
+    hasher.update(digest.encode())
+    return hasher.hexdigest()
+
+
+class OutputStore:
+    """
+    A directory of codemod outputs, bounded in size.
+    """
+
+    def __init__(self, root: Path, *, max_size: int) -> None:
+        self.root = root
+        #: Bytes :meth:`prune` keeps the store under, zero for no bound.
+        self.max_size = max_size
+
+    def load(self, key: str) -> str | None:
+        """
+        The output stored under ``key``, if any.
+        """
+        result = self._path("results", key)
+        try:
+            digest = result.read_text(encoding="ascii").strip()
+            obj = self._path("objects", digest)
+            code = obj.read_bytes().decode("utf-8")
+        except (OSError, ValueError):
+            return None
+        if source_digest(code) != digest:
+            log.debug("Ignoring the corrupted output %s in %s", digest, self.root)
+            return None
+        for path in (result, obj):
+            with contextlib.suppress(OSError):
+                # Recently used: keep it from being evicted.
+                os.utime(path)
+        return code
+
+    def store(self, key: str, code: str) -> None:
+        """
+        Store ``code`` as the output under ``key``.
+
+        The store is only an optimization: failing to write to it is logged, not raised.
+        """
+        digest = source_digest(code)
+        try:
+            obj = self._path("objects", digest)
+            if obj.exists():
+                with contextlib.suppress(OSError):
+                    os.utime(obj)
+            else:
+                self._write(obj, code.encode("utf-8"))
+            self._write(self._path("results", key), f"{digest}\n".encode("ascii"))
+        except OSError as exc:
+            log.debug("Unable to store an output in %s: %s", self.root, exc)
+
+    def prune(self) -> int:
+        """
+        Evict the least recently used files once the store grows past its maximum size.
+
+        Returns the number of bytes evicted.
+        """
+        if self.max_size <= 0:
+            return 0
+        files = []
+        total = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.max_size:
+            return 0
+        evicted = 0
+        target = total - int(self.max_size * _PRUNE_TARGET)
+        for _, size, path in sorted(files):
+            if evicted >= target:
+                break
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+                evicted += size
+        log.debug("Evicted %d bytes from the output cache in %s", evicted, self.root)
+        return evicted
+
+    def _path(self, kind: str, name: str) -> Path:
+        return self.root / kind / name[:2] / name[2:]
+
+    def _entries(self) -> Iterator[os.DirEntry[str]]:
+        for kind in ("objects", "results"):
+            try:
+                buckets = list(os.scandir(self.root / kind))
+            except OSError:
+                continue
+            for bucket in buckets:
+                with contextlib.suppress(OSError), os.scandir(bucket.path) as entries:
+                    yield from (entry for entry in entries if entry.is_file())
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(tmp_fd, "wb") as wfh:
+                wfh.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,389 @@
+"""
+Process pool exchanging msgpack-encoded messages with its workers.
+
+``concurrent.futures.ProcessPoolExecutor`` pickles every task and every result,
+along with any exception object and traceback they carry. This pool keeps a
+pipe to each of its worker processes instead, and sends the requests and
+responses over it encoded with ``msgspec.msgpack`` against known types. Nothing
+is pickled past the start of a worker, which gets its initializer arguments
+handed over once.
+
+A request is answered with a stream of items, sent back one by one as the
+worker produces them. That lets the pool bound the time a worker may spend on
+any single item: a worker going past it is killed and replaced. Likewise, a
+worker reports its resident memory after each request, and is retired and
+replaced once it grows past a threshold.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from typing import Any
+from typing import Generic
+from typing import Self
+from typing import TypeVar
+
+import msgspec
+
+from refine.exc import RefineError
+
+if TYPE_CHECKING:
+    import multiprocessing.context
+    from multiprocessing.connection import Connection
+    from multiprocessing.process import BaseProcess
+    from types import TracebackType
+
+log = logging.getLogger(__name__)
+
+_Request = TypeVar("_Request")
+_Response = TypeVar("_Response")
+
+#: Seconds a worker is given to exit once told to, before being terminated.
+_STOP_TIMEOUT = 5.0
+
+# First byte of every message a worker sends back.
+_READY = b"\x00"
+_ITEM = b"\x01"
+_DONE = b"\x02"
+_ERROR = b"\x03"
+
+
+class WorkerError(RefineError):
+    """
+    A task raised in its worker process, or the worker process died running it.
+    """
+
+
+class WorkerTimeoutError(WorkerError):
+    """
+    A worker went past the time allowed for one item, and was killed.
+    """
+
+    def __init__(self, message: str, partial: list[Any]) -> None:
+        super().__init__(message)
+        #: The items the worker had sent back before getting stuck.
+        self.partial = partial
+
+
+@dataclass(frozen=True)
+class WorkerStats:
+    """
+    Resource usage of one of a pool's worker slots, since the pool started.
+    """
+
+    #: Number of worker processes the slot retired for using too much memory.
+    recycled: int
+    #: Highest resident memory, in bytes, any of the slot's processes reported.
+    peak_rss: int
+
+
+class _SlotStats:
+    def __init__(self) -> None:
+        self.recycled = 0
+        self.peak_rss = 0
+
+
+class _TaskError(msgspec.Struct, frozen=True):
+    message: str
+    traceback: str
+
+
+def _current_rss() -> int:
+    """
+    Resident memory of the current process, in bytes, or 0 when unknown.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as rfh:
+            return int(rfh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource  # noqa: PLC0415  # not available on Windows
+    except ImportError:
+        return 0
+    # No /proc (e.g. macOS): the peak is the closest we get.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _worker_main(
+    conn: Connection,
+    handler: Callable[[Any], Iterable[Any]],
+    request_type: Any,
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+) -> None:
+    if initializer is not None:
+        initializer(*initargs)
+    decoder = msgspec.msgpack.Decoder(request_type)
+    encoder = msgspec.msgpack.Encoder()
+    conn.send_bytes(_READY)
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except EOFError:
+            # The parent went away.
+            return
+        if not data:
+            # Told to stop.
+            return
+        try:
+            for item in handler(decoder.decode(data)):
+                conn.send_bytes(_ITEM + encoder.encode(item))
+        except Exception as exc:  # noqa: BLE001  # reported to the parent
+            error = _TaskError(message=f"{type(exc).__name__}: {exc}", traceback=traceback.format_exc())
+            conn.send_bytes(_ERROR + encoder.encode(error))
+        else:
+            conn.send_bytes(_DONE + _current_rss().to_bytes(8, "big"))
+
+
+class WorkerPool(Generic[_Request, _Response]):
+    """
+    Pool of worker processes running ``handler`` on msgpack-encoded requests.
+
+    Worker processes are spawned on demand, up to ``workers`` of them, and a
+    worker dying is replaced by a new one for the next request. Each worker is
+    driven by a thread of the parent process, which sends it one request at a
+    time and resolves the request's future with the list of items the handler
+    produced for it.
+
+    Arguments:
+        workers: Maximum number of worker processes.
+        mp_context: The multiprocessing context to start the workers with.
+        handler: Module level function called in a worker with each decoded
+            request, returning (or yielding) the response items.
+        request_type: Type the requests are decoded as, in the workers.
+        response_type: Type the response items are decoded as, in the parent process.
+        initializer: Module level function called once when a worker starts.
+        initargs: Arguments passed to ``initializer``.
+        item_timeout: Seconds a worker may spend producing a single item. A
+            worker going past it is killed, and the request's future fails with
+            :class:`WorkerTimeoutError`.
+        max_rss: Resident memory, in bytes, past which a worker is retired once
+            done with its current request, and replaced.
+        on_spawn: Called with the PID of each worker, and the
+            :func:`time.perf_counter` at which it was started and was ready.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        workers: int,
+        mp_context: multiprocessing.context.BaseContext,
+        handler: Callable[[_Request], Iterable[_Response]],
+        request_type: Any,
+        response_type: Any,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple[Any, ...] = (),
+        item_timeout: float | None = None,
+        max_rss: int | None = None,
+        on_spawn: Callable[[int, float, float], None] | None = None,
+    ) -> None:
+        self._max_workers = workers
+        self._item_timeout = item_timeout
+        self._max_rss = max_rss
+        self._on_spawn = on_spawn
+        self._context = mp_context
+        self._worker_args = (handler, request_type, initializer, initargs)
+        self._encoder = msgspec.msgpack.Encoder()
+        self._response_decoder: msgspec.msgpack.Decoder[Any] = msgspec.msgpack.Decoder(response_type)
+        self._error_decoder = msgspec.msgpack.Decoder(_TaskError)
+        self._tasks: queue.SimpleQueue[tuple[concurrent.futures.Future[list[_Response]], _Request] | None] = (
+            queue.SimpleQueue()
+        )
+        self._idle = threading.Semaphore(0)
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._stats: list[_SlotStats] = []
+        self._shutdown = False
+
+    def submit(self, request: _Request) -> concurrent.futures.Future[list[_Response]]:
+        """
+        Schedule ``request`` to be handled by a worker.
+        """
+        future: concurrent.futures.Future[list[_Response]] = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                error = "cannot schedule new requests after shutdown"
+                raise RuntimeError(error)
+            self._tasks.put((future, request))
+            # Only bring up another worker when none is waiting for work.
+            if not self._idle.acquire(blocking=False) and len(self._threads) < self._max_workers:
+                stats = _SlotStats()
+                thread = threading.Thread(
+                    target=self._drive_worker,
+                    args=(stats,),
+                    name=f"refine-pool-{len(self._threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+                self._stats.append(stats)
+        return future
+
+    def stats(self) -> tuple[WorkerStats, ...]:
+        """
+        Resource usage of each worker slot brought up so far.
+        """
+        with self._lock:
+            return tuple(WorkerStats(recycled=stats.recycled, peak_rss=stats.peak_rss) for stats in self._stats)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        """
+        Stop the workers once the requests submitted so far are handled.
+
+        Arguments:
+            wait: Wait for the workers to stop.
+            cancel_futures: Cancel the requests no worker started on yet.
+        """
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        task = self._tasks.get_nowait()
+                    except queue.Empty:
+                        break
+                    if task is not None:
+                        task[0].cancel()
+            for _ in self._threads:
+                self._tasks.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self) -> Self:
+        """
+        Use the pool as a context manager, shutting it down on exit.
+        """
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        """
+        Shut the pool down, waiting for the workers to stop.
+        """
+        self.shutdown(wait=True)
+
+    def _drive_worker(self, stats: _SlotStats) -> None:
+        worker: tuple[BaseProcess, Connection] | None = None
+        try:
+            while (task := self._tasks.get()) is not None:
+                future, request = task
+                if future.set_running_or_notify_cancel():
+                    try:
+                        if worker is None:
+                            worker = self._spawn()
+                    except WorkerError as exc:
+                        future.set_exception(exc)
+                    else:
+                        if not self._run(worker, future, request, stats):
+                            self._stop(worker)
+                            worker = None
+                self._idle.release()
+        finally:
+            if worker is not None:
+                self._stop(worker)
+
+    def _run(
+        self,
+        worker: tuple[BaseProcess, Connection],
+        future: concurrent.futures.Future[list[_Response]],
+        request: _Request,
+        stats: _SlotStats,
+    ) -> bool:
+        """
+        Have ``worker`` handle ``request``, resolving its future.
+
+        Returns False when the worker is gone, or must be retired, and has to be replaced.
+        """
+        process, conn = worker
+        items: list[_Response] = []
+        try:
+            conn.send_bytes(self._encoder.encode(request))
+            while True:
+                if self._item_timeout is not None and not conn.poll(self._item_timeout):
+                    process.kill()
+                    process.join()
+                    error = f"Worker process {process.pid} spent more than {self._item_timeout}s on a single item"
+                    future.set_exception(WorkerTimeoutError(error, partial=items))
+                    return False
+                reply = conn.recv_bytes()
+                if reply[:1] != _ITEM:
+                    break
+                items.append(self._response_decoder.decode(reply[1:]))
+        except (EOFError, OSError):
+            process.join(_STOP_TIMEOUT)
+            error = f"Worker process {process.pid} died (exit code {process.exitcode})"
+            future.set_exception(WorkerError(error))
+            return False
+        except Exception as exc:  # noqa: BLE001  # an undecodable response must not leave the future hanging
+            future.set_exception(exc)
+            return False
+        if reply[:1] == _DONE:
+            # Account for the worker before resolving the future, so whoever
+            # waits on it sees up to date stats.
+            rss = int.from_bytes(reply[1:], "big")
+            retire = self._max_rss is not None and rss > self._max_rss
+            with self._lock:
+                stats.peak_rss = max(stats.peak_rss, rss)
+                stats.recycled += retire
+            future.set_result(items)
+            if retire:
+                log.debug("Retiring pool worker process %s, using %d bytes of memory", process.pid, rss)
+                return False
+        else:
+            task_error = self._error_decoder.decode(reply[1:])
+            future.set_exception(WorkerError(f"{task_error.message}\n{task_error.traceback}"))
+        return True
+
+    def _spawn(self) -> tuple[BaseProcess, Connection]:
+        started = time.perf_counter()
+        parent_conn, child_conn = self._context.Pipe(duplex=True)
+        process = self._context.Process(  # type: ignore[attr-defined]
+            target=_worker_main,
+            args=(child_conn, *self._worker_args),
+            daemon=True,
+        )
+        process.start()
+        # The worker holds its own end now: closing ours lets EOF through if it dies.
+        child_conn.close()
+        # Wait for the initializer to be done: its time does not count against the item timeout.
+        try:
+            parent_conn.recv_bytes()
+        except EOFError:
+            process.join(_STOP_TIMEOUT)
+            parent_conn.close()
+            error = f"Worker process {process.pid} failed to start (exit code {process.exitcode})"
+            raise WorkerError(error) from None
+        log.debug("Started pool worker process %s", process.pid)
+        if self._on_spawn is not None:
+            self._on_spawn(process.pid, started, time.perf_counter())
+        return process, parent_conn
+
+    @staticmethod
+    def _stop(worker: tuple[BaseProcess, Connection]) -> None:
+        process, conn = worker
+        with contextlib.suppress(OSError):
+            conn.send_bytes(b"")
+        process.join(_STOP_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        conn.close()
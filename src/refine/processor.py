@@ -6,26 +6,33 @@ A fair chunk of this module just piggybacks on what libCST does, we just adapt t
 
 from __future__ import annotations
 
+import collections
 import concurrent.futures
 import contextlib
+import difflib
 import fnmatch
+import heapq
+import importlib
 import itertools
 import logging
 import multiprocessing
 import os
 import os.path
-import shutil
+import signal
+import subprocess
 import sys
-import tempfile
+import threading
+import time
 import traceback
 from collections.abc import Callable
 from collections.abc import Iterable
 from collections.abc import Iterator
 from collections.abc import Mapping
 from dataclasses import dataclass
-from functools import partial
 from pathlib import Path
 from typing import TYPE_CHECKING
+from typing import Any
+from typing import Literal
 from typing import ParamSpec
 from typing import TypeVar
 
@@ -33,25 +40,39 @@ import libcst as cst
 import msgspec
 from libcst.codemod import CodemodContext
 from libcst.codemod import SkipFile
-from libcst.codemod._cli import ExecutionResult
 from libcst.codemod._cli import Progress
-from libcst.codemod._cli import print_execution_result
-from libcst.codemod._runner import SkipReason
-from libcst.codemod._runner import TransformExit
-from libcst.codemod._runner import TransformFailure
-from libcst.codemod._runner import TransformSkip
-from libcst.codemod._runner import TransformSuccess
 from libcst.helpers import calculate_module_and_package
 from libcst.metadata import FullRepoManager
 
 from refine import __version__
+from refine import git
 from refine.abc import _PRISTINE_TREE_KEY
 from refine.abc import BaseCodemod
 from refine.abc import BaseConfig
 from refine.cache import Cache
-from refine.cache import compute_context_key
+from refine.cache import CachedFailure
+from refine.cache import CacheEntry
+from refine.cache import FileStat
+from refine.cache import compute_codemod_key
+from refine.cache import source_digest
+from refine.exc import CodemodTimeoutError
 from refine.exc import InvalidConfigError
 from refine.exc import RefineSystemExit
+from refine.outputs import OutputStore
+from refine.outputs import output_key
+from refine.pool import WorkerPool
+from refine.pool import WorkerStats
+from refine.pool import WorkerTimeoutError
+from refine.profile import _PROFILER_KEY
+from refine.profile import Profiler
+from refine.profile import ProfileReport
+from refine.profile import Span
+from refine.profile import Timing
+from refine.profile import Tracer
+from refine.writeback import commit
+from refine.writeback import discard
+from refine.writeback import stage
+from refine.writeback import write_atomically
 
 if TYPE_CHECKING:
     from libcst.metadata.base_provider import ProviderT
@@ -66,6 +87,27 @@ log = logging.getLogger(__name__)
 #: (require_serial: false in old hook configs), so each one must stay small.
 PRE_COMMIT_MAX_JOBS = 2
 
+#: Number of tasks kept in flight per pool worker.
+_IN_FLIGHT_PER_JOB = 2
+
+#: Source bytes in the first adaptively sized batch, before any worker reported back.
+_BATCH_INITIAL_BYTES = 16 * 1024
+#: Bounds, in source bytes, of an adaptively sized batch.
+_BATCH_MIN_BYTES = 4 * 1024
+_BATCH_MAX_BYTES = 1024 * 1024
+#: Upper bound on the number of files in an adaptively sized batch.
+_BATCH_MAX_FILES = 64
+#: How long a worker should spend on one adaptively sized batch.
+_BATCH_TARGET_SECONDS = 0.05
+
+#: Number of work items held back so the most expensive ones are dispatched first.
+_SCHEDULE_LOOKAHEAD = 256
+#: Rough transform cost, in seconds per source byte and codemod, of a file with no recorded duration.
+_ESTIMATED_SECONDS_PER_BYTE = 2e-6
+_MIB = 1024 * 1024
+#: Outputs replayed from the output cache, with ``fsync = "batch"``, committed as a group.
+_REPLAY_COMMIT_GROUP = 64
+
 
 def _get_pool_context() -> multiprocessing.context.BaseContext:
     if sys.platform == "win32":
@@ -87,6 +129,11 @@ def _compute_jobs(*, configured_pool_size: int, total_files: int, chunk_size: in
 _P = ParamSpec("_P")
 _R = TypeVar("_R")
 
+#: Callable submitting a batch of work items to the pool workers.
+_SubmitBatch = Callable[[list["_Work"]], concurrent.futures.Future[list["_FileResult"]]]
+#: Either kind of pool :meth:`Processor.process` dispatches its work to.
+_Pool = concurrent.futures.Executor | WorkerPool[list["_Work"], "_FileResult"]
+
 
 class _SyncExecutor(concurrent.futures.Executor):
     """
@@ -112,10 +159,183 @@ class _SyncExecutor(concurrent.futures.Executor):
         return future
 
 
+class _StreamingProgress(Progress):
+    """
+    libCST's progress bar, for a total that grows as files are discovered.
+    """
+
+    def __init__(self, *, enabled: bool) -> None:
+        super().__init__(enabled=enabled, total=0)
+
+    def discovered(self) -> None:
+        self.total += 1
+        self.pretty_precision = len(str(self.total // 100)) - 1
+
+
 class _Work(msgspec.Struct, frozen=True):
     filename: str
     source: str
     codemod_names: tuple[str, ...]
+    #: Warnings cached for the codemods the file is clean under, to report along with the others.
+    cached_warnings: tuple[str, ...] = ()
+    #: The output cached for the file's content, for the parent to write rather than transforming it.
+    output: str | None = None
+    #: Time spent ingesting the file, when profiling.
+    timings: dict[str, Timing] = msgspec.field(default_factory=dict)
+    #: Spans traced while ingesting the file, when tracing.
+    spans: tuple[Span, ...] = ()
+
+
+class _Batcher:
+    """
+    Groups work items into batches, each batch being dispatched as a single task.
+
+    With a fixed ``size`` every task carries up to that many files. Otherwise
+    batches are sized by source bytes, aiming at ``_BATCH_TARGET_SECONDS`` of
+    work per task, and the byte target is retuned from the latency the workers
+    report back.
+    """
+
+    def __init__(self, *, size: int, max_files: int = _BATCH_MAX_FILES) -> None:
+        self.size = size
+        self.max_files = size or max_files
+        self.target_bytes = _BATCH_INITIAL_BYTES
+        self._bytes_per_second: float | None = None
+
+    def batches(self, work_items: Iterator[_Work]) -> Iterator[list[_Work]]:
+        batch: list[_Work] = []
+        batch_bytes = 0
+        for work in work_items:
+            batch.append(work)
+            batch_bytes += len(work.source)
+            if len(batch) >= self.max_files or (not self.size and batch_bytes >= self.target_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+        if batch:
+            yield batch
+
+    def observe(self, batch_bytes: int, seconds: float) -> None:
+        """
+        Retune the byte target from how long a worker took on a batch.
+        """
+        if self.size or seconds <= 0:
+            return
+        bytes_per_second = batch_bytes / seconds
+        if self._bytes_per_second is not None:
+            # Smooth out the odd slow file so batch sizes do not swing around.
+            bytes_per_second = 0.7 * self._bytes_per_second + 0.3 * bytes_per_second
+        self._bytes_per_second = bytes_per_second
+        self.target_bytes = min(
+            max(int(bytes_per_second * _BATCH_TARGET_SECONDS), _BATCH_MIN_BYTES),
+            _BATCH_MAX_BYTES,
+        )
+
+
+class _FileResult(msgspec.Struct, frozen=True):
+    """
+    The outcome of processing one file.
+
+    Unlike libCST's ``ExecutionResult``, it does not carry the file's code nor
+    live exception objects, so it stays small when crossing the pool boundary.
+    """
+
+    filename: str
+    status: Literal["success", "failure", "skip", "exit"]
+    changed: bool = False
+    warnings: tuple[str, ...] = ()
+    #: Digest of the unchanged (or failing) file content, for the run cache to record.
+    digest: str | None = None
+    #: The warnings each codemod which emitted any did, for the run cache to record.
+    codemod_warnings: dict[str, tuple[str, ...]] = msgspec.field(default_factory=dict)
+    #: Why the file was skipped, or the error it failed with.
+    message: str = ""
+    traceback: str = ""
+    #: Seconds the transform took, zero for files which were never dispatched.
+    duration: float = 0.0
+    #: Time spent in each phase, when profiling.
+    timings: dict[str, Timing] = msgspec.field(default_factory=dict)
+    #: Spans traced while processing the file, when tracing.
+    spans: tuple[Span, ...] = ()
+    #: Temporary file holding the new content, for the parent to commit, with ``fsync = "batch"``.
+    staged: str = ""
+    #: Unified diff of the change, with ``diff`` enabled.
+    diff: str = ""
+
+    @classmethod
+    def failure(
+        cls, filename: str, exc: Exception, warnings: Iterable[str] = (), digest: str | None = None
+    ) -> _FileResult:
+        """
+        Build a failure result from the exception being handled.
+        """
+        formatted_traceback = traceback.format_exc()
+        if isinstance(exc, subprocess.CalledProcessError) and exc.output:
+            output = exc.output.decode("utf-8") if isinstance(exc.output, bytes) else exc.output
+            formatted_traceback = f"{output}\n{formatted_traceback}"
+        return cls(
+            filename=filename,
+            status="failure",
+            warnings=tuple(warnings),
+            digest=digest,
+            message=str(exc),
+            traceback=formatted_traceback,
+        )
+
+
+@dataclass(frozen=True)
+class StageThroughput:
+    """
+    How fast one stage of a :meth:`Processor.process` run got through its files.
+    """
+
+    #: Number of files the stage handled.
+    files: int
+    #: Wall-clock seconds the stage needed for them.
+    seconds: float
+    #: Number of threads or processes the stage ran on.
+    workers: int
+
+    @property
+    def files_per_second(self) -> float:
+        """
+        Files handled per second.
+        """
+        return self.files / self.seconds if self.seconds else 0.0
+
+
+class _IngestTimer:
+    """
+    Thread-safe accounting of the files ingested, and of the wall-clock time ingesting them spanned.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self.files = 0
+        #: When the first file started being ingested, and the last one was done, if any.
+        self.started: float | None = None
+        self.ended: float | None = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timed(self) -> Iterator[None]:
+        started = time.perf_counter()
+        with self._lock:
+            if self.started is None:
+                self.started = started
+        try:
+            yield
+        finally:
+            ended = time.perf_counter()
+            with self._lock:
+                self.files += 1
+                self.ended = ended if self.ended is None else max(self.ended, ended)
+
+    def as_throughput(self) -> StageThroughput:
+        seconds = 0.0
+        if self.started is not None and self.ended is not None:
+            seconds = self.ended - self.started
+        return StageThroughput(files=self.files, seconds=seconds, workers=self.workers)
 
 
 @dataclass(frozen=True)
@@ -135,6 +355,14 @@ class ParallelTransformResult:
     skips: int
     #: Number of files that were actually modified
     changed: int
+    #: Throughput of reading, hashing and gating the files.
+    ingestion: StageThroughput | None = None
+    #: Throughput of transforming the files that needed it.
+    transform: StageThroughput | None = None
+    #: Memory usage and recycling of each process pool worker slot.
+    workers: tuple[WorkerStats, ...] = ()
+    #: Per-phase timings of the run, when profiling.
+    profile: ProfileReport | None = None
 
 
 class _ResultTally:
@@ -142,47 +370,73 @@ class _ResultTally:
     Accumulates per-file processing outcomes for a single :meth:`Processor.process` run.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        *,
+        profile: ProfileReport | None = None,
+        tracer: Tracer | None = None,
+        dry_run: bool = False,
+        exit_on_change: bool = False,
+    ) -> None:
         self.successes: int = 0
         self.failures: int = 0
         self.warnings: int = 0
         self.skips: int = 0
         self.changed: int = 0
-
-    def account(self, result: ExecutionResult, progress: Progress, *, repo_root: str, fail_fast: bool) -> bool:
+        #: Set once fail_fast, or exit_on_change, tripped: nothing else should be dispatched.
+        self.stopped: bool = False
+        #: Whether changed files are only reported, and not written.
+        self.dry_run = dry_run
+        #: Stop at the first changed file.
+        self.exit_on_change = exit_on_change
+        self.ingestion: StageThroughput | None = None
+        self.transform: StageThroughput | None = None
+        self.workers: tuple[WorkerStats, ...] = ()
+        self.profile = profile
+        self.tracer = tracer or Tracer(enabled=False)
+
+    def account(self, result: _FileResult, progress: Progress, *, repo_root: str, fail_fast: bool) -> bool:
         """
         Update the running counters for one result.
 
-        Returns True when processing should stop (fail_fast tripped).
+        Returns True when processing should stop (fail_fast, or exit_on_change, tripped).
         """
         # Print an execution result, keep track of failures
         _print_parallel_result(
             result,
             progress,
             repo_root=repo_root,
-            unified_diff=False,
             show_changed=True,
             show_successes=False,
-            hide_generated=True,
-            hide_blacklisted=True,
+            dry_run=self.dry_run,
         )
         progress.print(self.successes + self.failures + self.skips)
+        if self.profile is not None and result.timings:
+            self.profile.add(result.filename, result.timings)
+        self.tracer.add(result.spans, file=result.filename)
 
-        if isinstance(result.transform_result, TransformFailure):
+        if result.status == "failure":
             self.failures += 1
-        elif isinstance(result.transform_result, TransformSuccess):
+        elif result.status == "success":
             self.successes += 1
             if result.changed:
                 self.changed += 1
-        elif isinstance(result.transform_result, (TransformExit, TransformSkip)):
+        else:
             self.skips += 1
 
-        if isinstance(result.transform_result, TransformFailure) and fail_fast:
+        if not (result.status == "failure" and fail_fast):
+            self.warnings += len(result.warnings)
+        if self.stops(result, fail_fast=fail_fast):
+            self.stopped = True
             return True
-
-        self.warnings += len(result.transform_result.warning_messages)
         return False
 
+    def stops(self, result: _FileResult, *, fail_fast: bool) -> bool:
+        """
+        Whether accounting ``result`` stops processing (fail_fast, or exit_on_change, tripping).
+        """
+        return (result.status == "failure" and fail_fast) or (result.changed and self.exit_on_change)
+
     def as_result(self) -> ParallelTransformResult:
         return ParallelTransformResult(
             successes=self.successes,
@@ -190,6 +444,10 @@ class _ResultTally:
             skips=self.skips,
             warnings=self.warnings,
             changed=self.changed,
+            ingestion=self.ingestion,
+            transform=self.transform,
+            workers=self.workers,
+            profile=self.profile,
         )
 
 
@@ -198,10 +456,22 @@ class Processor:
     Refine codemod processor.
     """
 
-    def __init__(self, config: Config, registry: Registry, codemods: list[type[BaseCodemod]]) -> None:
+    def __init__(
+        self,
+        config: Config,
+        registry: Registry,
+        codemods: list[type[BaseCodemod]],
+        *,
+        keep_pool: bool = False,
+    ) -> None:
         self.config = config
         self.registry = registry
         self.codemods = codemods
+        #: Keep the worker pool alive between :meth:`process` calls (used by the daemon).
+        #: Callers setting this must call :meth:`close` once done with the processor.
+        self.keep_pool = keep_pool
+        self._pool: _Pool | None = None
+        self._pool_key: tuple[str, int] | None = None
         codemod_configs = {}
         for codemod in codemods:
             config_dict = config.__remaining_config__.get(codemod.NAME, {})
@@ -220,97 +490,291 @@ class Processor:
         self.codemods_by_name = {codemod.NAME: codemod for codemod in codemods}
 
         self.cache: Cache | None = None
+        #: Git blob ids of the files of the current run git tracks unmodified, with ``cache_key = "git"``.
+        self._blob_ids: dict[str, str] = {}
+        #: Stat of the files of the current run dispatched to the pool, for the cache to record once found clean.
+        self._stats: dict[str, FileStat] = {}
+        #: Key of each codemod's results in the cache, by codemod name.
+        self.codemod_keys: dict[str, str] = {}
+        #: The output cache, shared with the pool workers, which store the outputs.
+        self.outputs: OutputStore | None = None
+        #: Whether the outputs of the current run only depend on each file, so can be cached.
+        self._cacheable_outputs = False
         if config.cache:
-            cache_dir = Path(config.cache_dir)
-            if not cache_dir.is_absolute():
-                cache_dir = Path(config.repo_root) / cache_dir
-            self.cache = Cache.load(
-                cache_dir,
-                compute_context_key(
+            self.cache = Cache.load(config.resolved_cache_dir(), backend=config.cache_backend)
+            if config.output_cache is True:
+                self.outputs = OutputStore(
+                    config.resolved_output_cache_dir(), max_size=config.output_cache_max_size * _MIB
+                )
+            self.codemod_keys = {
+                codemod.NAME: compute_codemod_key(
                     refine_version=__version__,
-                    codemods=codemods,
-                    codemod_configs=codemod_configs,
-                ),
-            )
+                    codemod=codemod,
+                    codemod_config=codemod_configs[codemod.NAME],
+                )
+                for codemod in codemods
+            }
 
-    def _build_work(self, files: list[str]) -> Iterator[_Work | ExecutionResult]:
+    def __getstate__(self) -> dict[str, Any]:
+        """
+        Pickle what the pool workers need, leaving out what only the parent process uses.
+        """
+        state = self.__dict__.copy()
+        state.update(registry=None, cache=None, _pool=None, _pool_key=None, _blob_ids={}, _stats={})
+        return state
+
+    def _build_work(self, files: Iterable[str], timer: _IngestTimer) -> Iterator[_Work | _FileResult]:
         """
         Read each file once in the parent and decide which codemods apply.
 
-        Yields ready-made clean ExecutionResults for files no codemod wants,
-        and _Work items (carrying the already-read source) for the rest.
+        Yields ready-made results for files no codemod wants (or failing to read),
+        and _Work items (carrying the already-read source) for the rest, in the
+        order of ``files``. Files are only read as the items are consumed.
+
+        With an ``ingest_concurrency`` above one, a bounded number of files are
+        ingested ahead on a thread pool: reading and hashing release the GIL, so
+        this overlaps nicely with the gates and with result accounting.
         """
-        for filename in files:
+        if timer.workers <= 1:
+            for filename in files:
+                with timer.timed():
+                    item = self._ingest(filename)
+                yield item
+            return
+
+        def _timed_ingest(filename: str) -> _Work | _FileResult:
+            with timer.timed():
+                return self._ingest(filename)
+
+        pending: collections.deque[concurrent.futures.Future[_Work | _FileResult]] = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=timer.workers, thread_name_prefix="refine-ingest"
+        ) as executor:
             try:
-                with open(filename, encoding="utf-8") as rfh:
-                    source = rfh.read()
-            except Exception as exc:
-                yield ExecutionResult(
-                    filename=filename,
-                    changed=False,
-                    transform_result=TransformFailure(
-                        error=exc, traceback_str=traceback.format_exc(), warning_messages=[]
-                    ),
-                )
-                continue
+                for filename in files:
+                    pending.append(executor.submit(_timed_ingest, filename))
+                    if len(pending) >= timer.workers * _IN_FLIGHT_PER_JOB:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # Stopped early (fail_fast): drop the files not being read yet, and wait for
+                # those being read, for the new contents they staged to be dropped too.
+                for future in pending:
+                    future.cancel()
+                concurrent.futures.wait(pending)
+                dropped = [future.result() for future in pending if not future.cancelled() and not future.exception()]
+                discard(item.staged for item in dropped if isinstance(item, _FileResult) and item.staged)
+
+    def _ingest(self, filename: str) -> _Work | _FileResult:
+        """
+        Read one file, check it against the cache and the codemod gates.
+        """
+        profiler = Profiler(enabled=self.config.profile > 0, trace=bool(self.config.trace_file))
+        with profiler.span("ingest"):
+            item = self._read_and_gate(filename, profiler)
+        if profiler.active:
+            item = msgspec.structs.replace(item, timings=profiler.timings(), spans=profiler.spans())
+        return item
+
+    def _read_and_gate(self, filename: str, profiler: Profiler) -> _Work | _FileResult:
+        # The digest of the file's content, and its cache entry, once known.
+        digest = self._blob_ids.get(filename)
+        entry: CacheEntry | None = None
+        if self.cache is not None and digest is not None:
+            # Git knows the file's content: no need to read it to find it clean.
+            with profiler.phase("cache"):
+                entry = self.cache.entry_for_digest(filename, digest)
+            if entry is not None and (cached := self._cached_result(filename, entry)) is not None:
+                return cached
+
+        stat = self._stat(filename, profiler)
+        if self.cache is not None and digest is None and stat is not None:
+            with profiler.phase("cache"):
+                entry = self.cache.entry_for_stat(filename, stat)
+            if entry is not None:
+                digest = entry.digest
+                if (cached := self._cached_result(filename, entry)) is not None:
+                    return cached
 
-            if self.cache is not None and self.cache.is_clean(filename, source):
-                yield ExecutionResult(
-                    filename=filename,
-                    changed=False,
-                    transform_result=TransformSuccess(warning_messages=[], code=source),
-                )
-                continue
+        try:
+            with profiler.phase("read"), open(filename, encoding="utf-8") as rfh:
+                source = rfh.read()
+        except Exception as exc:
+            return _FileResult.failure(filename, exc)
+
+        if self.cache is not None and digest is None:
+            with profiler.phase("cache"):
+                digest = source_digest(source)
+                entry = self.cache.entry_for_digest(filename, digest)
+            if entry is not None and (cached := self._cached_result(filename, entry)) is not None:
+                # Racily known, or touched without being changed: record the current stat.
+                if stat is not None and entry.failure is not None and cached.status == "failure":
+                    self.cache.mark_failed(filename, digest, entry.failure, stat)
+                elif stat is not None:
+                    self.cache.mark_clean_digest(filename, digest, self.codemod_keys, stat)
+                return cached
+
+        applicable = self._gate(
+            filename, source, self._pending_codemods({} if entry is None else entry.codemods), profiler
+        )
+        cached_warnings = self._cached_warnings(entry)
+        if not applicable:
+            if self.cache is not None and digest is not None:
+                with profiler.phase("cache"):
+                    self.cache.mark_clean_digest(filename, digest, self.codemod_keys, stat)
+            return _FileResult(filename=filename, status="success", warnings=cached_warnings)
+        output = None
+        if digest is not None:
+            output = self._load_output(self._output_key(filename, digest, applicable), profiler)
+        if stat is not None and output is None:
+            self._stats[filename] = stat
+        return _Work(
+            filename=filename,
+            source=source,
+            codemod_names=tuple(applicable),
+            cached_warnings=cached_warnings,
+            output=output,
+        )
 
-            applicable = []
-            for codemod in self.codemods:
-                codemod_config = self.codemod_configs[codemod.NAME]
-                excluded = False
-                for pattern in codemod_config.exclude:
-                    if fnmatch.fnmatch(filename, pattern):
-                        log.debug(
-                            "Skipping %s on %s: excluded by pattern %r",
-                            codemod.NAME,
-                            os.path.relpath(filename, self.config.repo_root),
-                            pattern,
-                        )
-                        excluded = True
-                        break
-                if excluded:
-                    continue
-                try:
-                    wanted = codemod.should_process(source, filename)
-                except Exception as exc:
-                    # Gates must fail open: never silently skip work.
-                    log.warning("Gate %s failed on %s; processing the file: %s", codemod.NAME, filename, exc)
-                    wanted = True
-                if wanted:
-                    applicable.append(codemod.NAME)
-            if not applicable:
-                if self.cache is not None:
-                    self.cache.mark_clean(filename, source)
-                yield ExecutionResult(
-                    filename=filename,
-                    changed=False,
-                    transform_result=TransformSuccess(warning_messages=[], code=source),
-                )
+    def _output_key(self, filename: str, digest: str, codemod_names: Iterable[str]) -> str:
+        return output_key(
+            (self.codemod_keys[name] for name in codemod_names),
+            Path(os.path.relpath(filename, self.config.repo_root)).as_posix(),
+            digest,
+        )
+
+    def _load_output(self, key: str, profiler: Profiler) -> str | None:
+        """
+        The output cached under ``key``, if any.
+
+        Only loaded while ingesting: the parent writes it, once it knows the run goes on.
+        """
+        if self.outputs is None or not self._cacheable_outputs:
+            return None
+        with profiler.phase("replay"):
+            return self.outputs.load(key)
+
+    def _replay(self, work: _Work, output: str) -> _FileResult:
+        """
+        Write the ``output`` cached for ``work``, rather than transforming its file again.
+        """
+        log.debug("Replaying the cached output of %s", os.path.relpath(work.filename, self.config.repo_root))
+        profiler = Profiler(enabled=self.config.profile > 0, trace=bool(self.config.trace_file), timings=work.timings)
+        result = self._write_back(work.filename, work.source, output, work.cached_warnings, profiler)
+        return msgspec.structs.replace(result, timings=profiler.timings(), spans=work.spans + profiler.spans())
+
+    def _cached_result(self, filename: str, entry: CacheEntry) -> _FileResult | None:
+        """
+        The result of processing ``filename`` its cache ``entry`` already tells, if any.
+
+        That is the failure it ended in with the same codemods, unless ``retry_failures``
+        is set, or a success if it is clean under every codemod.
+        """
+        failure = entry.failure
+        if failure is not None and failure.codemods == self.codemod_keys and self.config.retry_failures is not True:
+            log.debug("Replaying the cached failure of %s", os.path.relpath(filename, self.config.repo_root))
+            return _FileResult(
+                filename=filename,
+                status="failure",
+                warnings=tuple(failure.warnings),
+                message=failure.message,
+                traceback=failure.traceback,
+            )
+        if self._pending_codemods(entry.codemods):
+            return None
+        return _FileResult(filename=filename, status="success", warnings=self._cached_warnings(entry))
+
+    def _cached_warnings(self, entry: CacheEntry | None) -> tuple[str, ...]:
+        """
+        The warnings recorded in ``entry`` for the codemods its file is clean under.
+        """
+        if entry is None or not entry.warnings:
+            return ()
+        return tuple(
+            itertools.chain.from_iterable(
+                entry.warnings.get(codemod.NAME, ())
+                for codemod in self.codemods
+                if entry.codemods.get(codemod.NAME) == self.codemod_keys[codemod.NAME]
+            )
+        )
+
+    def _pending_codemods(self, clean: Mapping[str, str]) -> list[type[BaseCodemod]]:
+        """
+        The codemods a file still has to go through, given those it is ``clean`` under.
+        """
+        return [
+            codemod
+            for codemod in self.codemods
+            if codemod.NAME not in clean or clean[codemod.NAME] != self.codemod_keys[codemod.NAME]
+        ]
+
+    def _gate(self, filename: str, source: str, codemods: list[type[BaseCodemod]], profiler: Profiler) -> list[str]:
+        """
+        The names of the ``codemods`` which want to process ``filename``.
+        """
+        applicable = []
+        for codemod in codemods:
+            codemod_config = self.codemod_configs[codemod.NAME]
+            excluded = False
+            for pattern in codemod_config.exclude:
+                if fnmatch.fnmatch(filename, pattern):
+                    log.debug(
+                        "Skipping %s on %s: excluded by pattern %r",
+                        codemod.NAME,
+                        os.path.relpath(filename, self.config.repo_root),
+                        pattern,
+                    )
+                    excluded = True
+                    break
+            if excluded:
                 continue
-            yield _Work(filename=filename, source=source, codemod_names=tuple(applicable))
+            try:
+                with profiler.phase("gate"):
+                    wanted = codemod.should_process(source, filename)
+            except Exception as exc:
+                # Gates must fail open: never silently skip work.
+                log.warning("Gate %s failed on %s; processing the file: %s", codemod.NAME, filename, exc)
+                wanted = True
+            if wanted:
+                applicable.append(codemod.NAME)
+        return applicable
+
+    def _stat(self, filename: str, profiler: Profiler) -> FileStat | None:
+        """
+        Stat ``filename`` for the cache, unless it is disabled or ``cache_paranoid`` is set.
 
-    def process(self, files: list[Path]) -> ParallelTransformResult:
+        The stat is taken before the file is read: were the file changed in
+        between, the stat recorded would not match the changed file.
         """
-        Process the passed in list of paths.
+        if self.cache is None or self.config.cache_paranoid is True:
+            return None
+        try:
+            with profiler.phase("stat"):
+                return FileStat.of(filename)
+        except OSError:
+            # Reading the file reports the error.
+            return None
+
+    def process(self, files: Iterable[Path]) -> ParallelTransformResult:
+        """
+        Process the passed in paths.
+
+        ``files`` is consumed lazily, as a stream: paths are read, gated and
+        dispatched while later ones are still being discovered, and only a bounded
+        window of file contents is held in memory at any time. Duplicate paths are
+        processed once, in the order they are first seen.
         """
-        _files = sorted({str(fpath) for fpath in files})
-        total = len(_files)
-        progress = Progress(enabled=self.config.hide_progress is False, total=total)
+        progress = _StreamingProgress(enabled=self.config.hide_progress is False)
         chunk_size = 4
 
-        if total == 0:
+        filenames = self._iter_filenames(files, progress)
+        first_filename = next(filenames, None)
+        if first_filename is None:
             # Zero input files: preserve the original "no jobs to run" error.
             jobs = _compute_jobs(
                 configured_pool_size=self.config.process_pool_size,
-                total_files=total,
+                total_files=0,
                 chunk_size=chunk_size,
                 env=os.environ,
             )
@@ -318,26 +782,7 @@ class Processor:
                 error = "Must have at least one job to process!"
                 raise RefineSystemExit(code=1, message=error)
             return ParallelTransformResult(successes=0, failures=0, skips=0, warnings=0, changed=0)
-
-        work_items: list[_Work] = []
-        pre_results: list[ExecutionResult] = []
-        for item in self._build_work(_files):
-            if isinstance(item, _Work):
-                work_items.append(item)
-            else:
-                pre_results.append(item)
-
-        # Pool is sized after gating: files no codemod wants are never
-        # dispatched, so they must not inflate the job count.
-        jobs = _compute_jobs(
-            configured_pool_size=self.config.process_pool_size,
-            total_files=len(work_items),
-            chunk_size=chunk_size,
-            env=os.environ,
-        )
-        if work_items and jobs < 1:
-            error = "Must have at least one job to process!"
-            raise RefineSystemExit(code=1, message=error)
+        filenames = itertools.chain((first_filename,), filenames)
 
         inherited_dependencies: set[ProviderT] = set()
         for codemod in self.codemods:
@@ -347,121 +792,605 @@ class Processor:
         metadata_manager: FullRepoManager | None = None
         if any(getattr(provider, "gen_cache", None) for provider in inherited_dependencies):
             # Only providers with a gen_cache (e.g. FullyQualifiedNameProvider,
-            # TypeInferenceProvider) need repo-wide cache resolution.
+            # TypeInferenceProvider) need repo-wide cache resolution, which means
+            # knowing every path up front: the stream of paths is materialised.
+            all_filenames = list(filenames)
+            filenames = iter(all_filenames)
             metadata_manager = FullRepoManager(
                 self.config.repo_root,
-                _files,
+                all_filenames,
                 list(inherited_dependencies),
             )
             metadata_manager.resolve_cache()
-
-        tally = _ResultTally()
+        # Codemods resolving repo-wide metadata depend on other files than the one they transform.
+        self._cacheable_outputs = metadata_manager is None
+
+        tally = _ResultTally(
+            profile=ProfileReport() if self.config.profile > 0 else None,
+            tracer=Tracer(enabled=bool(self.config.trace_file)),
+            dry_run=self.config.check or self.config.diff,
+            exit_on_change=self.config.exit_on_first_change,
+        )
+        ingest_timer = _IngestTimer(workers=max(self.config.ingest_concurrency, 1))
+        self._blob_ids = self._git_blob_ids(tally.tracer)
+        self._stats = {}
 
         try:
-            # Account the already-decided (gated-out / cached) results first: they
-            # need no dispatch, and letting fail_fast trip here avoids opening a
-            # pool at all.
-            stop = self._account_results(pre_results, progress, tally)
-            if work_items and not stop:
-                pool_impl: Callable[[], concurrent.futures.Executor]
-                if len(work_items) == 1 or jobs == 1:
-                    # Simple case, we should not pay for process overhead.
-                    # Let's just use a synchronous executor.
-                    jobs = 1
-                    pool_impl = _SyncExecutor
-                elif getattr(sys, "_is_gil_enabled", lambda: True)():
-                    # No max_tasks_per_child: workers live for the whole run instead
-                    # of being killed and re-spawned (re-importing everything) every
-                    # few tasks. The forkserver context preloads refine.processor.
-                    pool_impl = partial(
-                        concurrent.futures.ProcessPoolExecutor,
-                        max_workers=jobs,
-                        mp_context=_get_pool_context(),
+            # Already-decided (gated-out / cached) results are accounted as they
+            # stream by; only the work items are dispatched.
+            work_items = self._work_only(self._build_work(filenames, ingest_timer), progress, tally)
+
+            # Pool is sized after gating: files no codemod wants are never
+            # dispatched, so they must not inflate the job count. Prefetching
+            # enough work items to saturate the pool is all it takes to size it
+            # exactly like knowing every work item would.
+            prefetch_size = max(self.config.process_pool_size * chunk_size, 1)
+            prefetched = list(itertools.islice(work_items, prefetch_size))
+            jobs = _compute_jobs(
+                configured_pool_size=self.config.process_pool_size,
+                total_files=len(prefetched),
+                chunk_size=chunk_size,
+                env=os.environ,
+            )
+            if prefetched and jobs < 1:
+                error = "Must have at least one job to process!"
+                raise RefineSystemExit(code=1, message=error)
+
+            if prefetched and not tally.stopped:
+                pool_kind, jobs, window, batcher = self._plan_dispatch(
+                    jobs,
+                    len(prefetched),
+                    # Fewer items than asked for were prefetched: that is the whole run.
+                    run_prefetched=len(prefetched) < prefetch_size,
+                )
+                transform_started = time.perf_counter()
+                with self._executor(pool_kind, jobs, metadata_manager, tally) as submit:
+                    transformed = self._run_pool(
+                        submit,
+                        window,
+                        batcher,
+                        self._by_cost(itertools.chain(prefetched, work_items), pool_kind),
+                        progress,
+                        tally,
                     )
-                else:
-                    # Free-threaded CPython: processes buy us nothing, use threads.
-                    pool_impl = partial(concurrent.futures.ThreadPoolExecutor, max_workers=jobs)
-                self._run_pool(pool_impl, jobs, work_items, metadata_manager, progress, tally)
+                tally.transform = StageThroughput(
+                    files=transformed,
+                    seconds=time.perf_counter() - transform_started,
+                    workers=jobs,
+                )
         finally:
             progress.clear()
             if self.cache is not None:
                 self.cache.dump()
+            if self.outputs is not None and tally.changed:
+                with tally.tracer.span("prune outputs"):
+                    self.outputs.prune()
+            tally.ingestion = ingest_timer.as_throughput()
+            self._report_run(tally)
 
         # Return whether there was one or more failure.
         return tally.as_result()
 
-    def _account_results(self, results: Iterable[ExecutionResult], progress: Progress, tally: _ResultTally) -> bool:
+    def _report_run(self, tally: _ResultTally) -> None:
+        """
+        Log the run's throughput, worker stats and profile, and write its trace out.
         """
-        Account an iterable of already-computed results.
+        for name, throughput in (("Ingestion", tally.ingestion), ("Transform", tally.transform)):
+            if throughput is not None:
+                log.debug(
+                    "%s: %d files in %.3fs on %d workers (%.1f files/s)",
+                    name,
+                    throughput.files,
+                    throughput.seconds,
+                    throughput.workers,
+                    throughput.files_per_second,
+                )
+        # Only worth more than a debug message when the user asked for recycling.
+        level = logging.INFO if self.config.worker_max_rss else logging.DEBUG
+        for slot, stats in enumerate(tally.workers):
+            log.log(
+                level,
+                "Worker %d: peak RSS %.1f MiB, recycled %d times",
+                slot,
+                stats.peak_rss / _MIB,
+                stats.recycled,
+            )
+        if tally.profile is not None:
+            log.info("%s", tally.profile.render(slowest=self.config.profile))
+        if self.config.trace_file:
+            tally.tracer.dump(Path(self.config.trace_file))
+            log.info("Wrote the run's trace to %s", self.config.trace_file)
 
-        Returns True when processing should stop (fail_fast tripped).
+    def _iter_filenames(self, files: Iterable[Path], progress: _StreamingProgress) -> Iterator[str]:
         """
-        for result in results:
-            self._mark_clean_if_unchanged(result)
-            if tally.account(result, progress, repo_root=self.config.repo_root, fail_fast=self.config.fail_fast):
-                return True
-        return False
+        Yield each distinct path once, growing the progress total as paths are discovered.
+        """
+        seen: set[str] = set()
+        for fpath in files:
+            filename = str(fpath)
+            if filename in seen:
+                continue
+            seen.add(filename)
+            progress.discovered()
+            yield filename
 
-    def _run_pool(
+    def _work_only(
+        self, items: Iterable[_Work | _FileResult], progress: Progress, tally: _ResultTally
+    ) -> Iterator[_Work]:
+        """
+        Yield the work items of ``items``, accounting the already-decided results in between.
+
+        The outputs replayed from the output cache are written here, one file
+        at a time, and never once stopped. Those staged are committed in groups
+        of up to ``_REPLAY_COMMIT_GROUP``, and only accounted once committed.
+
+        Stops early once ``fail_fast``, or ``exit_on_first_change``, trips.
+        """
+
+        def account(result: _FileResult) -> bool:
+            return tally.account(result, progress, repo_root=self.config.repo_root, fail_fast=self.config.fail_fast)
+
+        staged: list[_FileResult] = []
+        try:
+            for item in items:
+                if isinstance(item, _FileResult):
+                    result = item
+                else:
+                    if item.output is None:
+                        if item.spans:
+                            # Ingestion happened here, in the parent: no need to ship its spans to the workers.
+                            tally.tracer.add(item.spans, file=item.filename)
+                            yield msgspec.structs.replace(item, spans=())
+                        else:
+                            yield item
+                        continue
+                    if tally.stopped:
+                        # Stopped while accounting the transformed files.
+                        return
+                    result = self._replay(item, item.output)
+                if result.staged:
+                    staged.append(result)
+                    if len(staged) < _REPLAY_COMMIT_GROUP and not tally.stops(result, fail_fast=self.config.fail_fast):
+                        continue
+                    results, staged = staged, []
+                else:
+                    results = [result]
+                if self._commit_and_account(results, tally, account):
+                    return
+            results, staged = staged, []
+            self._commit_and_account(results, tally, account)
+        finally:
+            # Stopped early: drop the new contents which were never committed.
+            discard(result.staged for result in staged)
+
+    @contextlib.contextmanager
+    def _executor(
         self,
-        pool_impl: Callable[[], concurrent.futures.Executor],
+        pool_kind: str,
         jobs: int,
-        work_items: list[_Work],
         metadata_manager: FullRepoManager | None,
+        tally: _ResultTally,
+    ) -> Iterator[_SubmitBatch]:
+        """
+        Provide the means to submit batches of work to the workers for one :meth:`process` run.
+
+        Process pool workers get this processor and ``metadata_manager``
+        installed once, when they start, and exchange msgpack-encoded work items
+        and results with the parent. Threads share this processor.
+
+        Without ``keep_pool`` the pool lives for this run only. With it, a
+        process/thread pool is kept for later runs and only replaced when a run
+        needs a different kind of pool or more workers than it has.
+
+        Once the run is over, the process pool's worker stats are stored on
+        ``tally``. Those of a kept pool cover every run since it started.
+        """
+        if pool_kind == "sync":
+            yield self._submitter(_SyncExecutor(), pool_kind, metadata_manager)
+            return
+        if not self.keep_pool or (pool_kind in ("process", "interpreter") and metadata_manager is not None):
+            # The metadata manager is resolved per run, and is baked into the
+            # process pool workers: such a pool cannot be kept.
+            with self._new_executor(pool_kind, jobs, metadata_manager, tally.tracer) as pool:
+                try:
+                    yield self._submitter(pool, pool_kind, metadata_manager)
+                finally:
+                    if isinstance(pool, WorkerPool):
+                        tally.workers = pool.stats()
+            return
+        if self._pool is not None and self._pool_key is not None:
+            kept_kind, kept_jobs = self._pool_key
+            if kept_kind != pool_kind or kept_jobs < jobs:
+                self.close()
+        if self._pool is None:
+            # Size a kept pool for the largest run this processor may see; idle
+            # workers are only spawned on demand.
+            jobs = max(
+                jobs,
+                _compute_jobs(
+                    configured_pool_size=self.config.process_pool_size,
+                    total_files=sys.maxsize,
+                    chunk_size=1,
+                    env=os.environ,
+                ),
+            )
+            self._pool = self._new_executor(pool_kind, jobs, None)
+            self._pool_key = (pool_kind, jobs)
+        try:
+            yield self._submitter(self._pool, pool_kind, None)
+        finally:
+            if isinstance(self._pool, WorkerPool):
+                tally.workers = self._pool.stats()
+
+    def _submitter(self, pool: _Pool, pool_kind: str, metadata_manager: FullRepoManager | None) -> _SubmitBatch:
+        if isinstance(pool, WorkerPool):
+            # The workers run _iter_batch_in_worker, with this processor installed.
+            return pool.submit
+
+        def submit(batch: list[_Work]) -> concurrent.futures.Future[list[_FileResult]]:
+            if pool_kind == "interpreter":
+                # Each interpreter has this processor installed, like the process pool workers.
+                return pool.submit(_process_batch_in_worker, batch)
+            return pool.submit(self._process_batch, metadata_manager, batch)
+
+        return submit
+
+    def _new_executor(
+        self, pool_kind: str, jobs: int, metadata_manager: FullRepoManager | None, tracer: Tracer | None = None
+    ) -> _Pool:
+        if pool_kind == "process":
+            # Workers live for the whole run instead of being killed and
+            # re-spawned (re-importing everything) every few tasks. The
+            # forkserver context preloads refine.processor.
+            return WorkerPool(
+                workers=jobs,
+                mp_context=_get_pool_context(),
+                handler=_iter_batch_in_worker,
+                request_type=list[_Work],
+                response_type=_FileResult,
+                initializer=_init_worker,
+                initargs=(self, metadata_manager),
+                item_timeout=self.config.file_timeout or None,
+                max_rss=self.config.worker_max_rss * _MIB or None,
+                on_spawn=tracer.worker_started if tracer is not None and tracer.enabled else None,
+            )
+        if pool_kind == "interpreter":
+            return concurrent.futures.InterpreterPoolExecutor(  # type: ignore[attr-defined]
+                max_workers=jobs,
+                initializer=_init_worker,
+                initargs=(self, metadata_manager),
+            )
+        return concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+
+    def close(self) -> None:
+        """
+        Shut down a worker pool kept alive by ``keep_pool``.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._pool_key = None
+
+    def _plan_dispatch(self, jobs: int, prefetched: int, *, run_prefetched: bool) -> tuple[str, int, int, _Batcher]:
+        """
+        Pick the executor kind, job count, in-flight window and batching for a run.
+        """
+        executor = self.config.executor
+        # Only process pool workers get killed past file_timeout, and retired past worker_max_rss.
+        supervised = bool(self.config.file_timeout or self.config.worker_max_rss)
+        if executor == "auto" and supervised:
+            executor = "process"
+        if executor == "sync" or (executor == "auto" and (prefetched == 1 or jobs == 1)):
+            # Simple case, we should not pay for process overhead.
+            # Let's just use a synchronous executor. Nothing crosses a process
+            # boundary either: batching would only make the progress reporting coarser.
+            if supervised:
+                _warn_unsupervised("sync")
+            return "sync", 1, 1, _Batcher(size=1)
+        # Keep a couple of tasks queued per job, so workers never
+        # starve while the parent reads and gates the next files.
+        window = jobs * _IN_FLIGHT_PER_JOB
+        pool_kind: str = executor
+        if executor == "auto":
+            if not getattr(sys, "_is_gil_enabled", lambda: True)():
+                # Free-threaded CPython: processes buy us nothing, use threads.
+                pool_kind = "thread"
+            elif self._interpreter_safe():
+                # Per-interpreter GIL: parallel like processes, lighter to start.
+                pool_kind = "interpreter"
+            else:
+                pool_kind = "process"
+        elif executor == "interpreter" and not self._interpreter_safe():
+            log.warning(
+                "The interpreter executor needs Python 3.14+ and codemods which can run in a subinterpreter; "
+                "falling back to the process executor"
+            )
+            pool_kind = "process"
+        if supervised and pool_kind != "process":
+            _warn_unsupervised(pool_kind)
+        if run_prefetched:
+            # Small run: cap the batches so every in-flight slot still gets some of the work.
+            batcher = _Batcher(size=self.config.batch_size, max_files=max(-(-prefetched // window), 1))
+        else:
+            batcher = _Batcher(size=self.config.batch_size)
+        return pool_kind, jobs, window, batcher
+
+    def _interpreter_safe(self) -> bool:
+        modules = frozenset({__name__, *(codemod.__module__ for codemod in self.codemods)})
+        if modules not in _INTERPRETER_SAFE:
+            _INTERPRETER_SAFE[modules] = _probe_interpreter(modules)
+        return _INTERPRETER_SAFE[modules]
+
+    def _by_cost(self, work_items: Iterator[_Work], pool_kind: str) -> Iterator[_Work]:
+        """
+        Reorder ``work_items`` so the most expensive ones are dispatched first.
+
+        Only ``_SCHEDULE_LOOKAHEAD`` items are held back at any time, so memory
+        stays bounded; as that buffer drains at the end of the stream, the tail
+        of the run goes out strictly longest first, which is what keeps one
+        worker from grinding through a huge file while the others sit idle.
+        """
+        if pool_kind == "sync":
+            # A single worker gets through the same total work in any order.
+            yield from work_items
+            return
+        heap: list[tuple[float, int, _Work]] = []
+        for position, work in enumerate(work_items):
+            # Ties keep the original (stream) order.
+            heapq.heappush(heap, (-self._predicted_cost(work), position, work))
+            if len(heap) > _SCHEDULE_LOOKAHEAD:
+                yield heapq.heappop(heap)[-1]
+        while heap:
+            yield heapq.heappop(heap)[-1]
+
+    def _predicted_cost(self, work: _Work) -> float:
+        """
+        Predict how many seconds transforming ``work`` will take.
+
+        Uses the duration recorded by a previous run when there is one, and an
+        estimate from the source size and number of codemods to apply otherwise.
+        """
+        if self.cache is not None:
+            duration = self.cache.duration(work.filename)
+            if duration is not None:
+                return duration
+        return len(work.source) * len(work.codemod_names) * _ESTIMATED_SECONDS_PER_BYTE
+
+    def _run_pool(
+        self,
+        submit_batch: _SubmitBatch,
+        window: int,
+        batcher: _Batcher,
+        work_items: Iterator[_Work],
         progress: Progress,
         tally: _ResultTally,
-    ) -> None:
+    ) -> int:
         """
         Dispatch ``work_items`` across the executor, accounting results as they complete.
 
-        Keeps at most ``jobs`` tasks in flight (rather than materialising a future
-        per file up front) so ``fail_fast`` can stop before submitting further work
-        and memory stays bounded regardless of the number of files. This preserves
-        the lazy-stop semantics of libCST 1.7's ``DummyPool.imap_unordered``.
-        """
-        remaining = iter(work_items)
-        stop = False
-        with pool_impl() as executor:
-            in_flight = {
-                executor.submit(self._process_path, metadata_manager, work)
-                for work in itertools.islice(remaining, jobs)
-            }
-            try:
-                while in_flight:
-                    done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
-                    for future in done:
-                        result = future.result()
-                        self._mark_clean_if_unchanged(result)
-                        if tally.account(
-                            result, progress, repo_root=self.config.repo_root, fail_fast=self.config.fail_fast
-                        ):
-                            stop = True
-                            break
-                    if stop:
-                        break
-                    # Refill the window with as many new items as just completed.
-                    in_flight.update(
-                        executor.submit(self._process_path, metadata_manager, work)
-                        for work in itertools.islice(remaining, len(done))
+        Work items are grouped by ``batcher`` and each batch is submitted as
+        one task, so tiny files do not each pay for a round-trip to a worker. At most
+        ``window`` tasks are kept in flight (rather than materialising a future
+        per file up front) so ``fail_fast`` can stop before submitting further
+        work and memory stays bounded regardless of the number of files. This
+        preserves the lazy-stop semantics of libCST 1.7's
+        ``DummyPool.imap_unordered``.
+
+        Returns the number of results accounted.
+        """
+        accounted = 0
+        batches = batcher.batches(work_items)
+        # What is left of batches whose worker timed out, to dispatch again.
+        leftovers: collections.deque[list[_Work]] = collections.deque()
+        in_flight: dict[concurrent.futures.Future[list[_FileResult]], list[_Work]] = {}
+
+        def submit(count: int) -> None:
+            for batch in itertools.islice(itertools.chain(_drain(leftovers), batches), count):
+                with tally.tracer.span("dispatch", files=len(batch)):
+                    in_flight[submit_batch(batch)] = batch
+
+        def account(result: _FileResult) -> bool:
+            nonlocal accounted
+            accounted += 1
+            if self.cache is not None:
+                self.cache.record_duration(result.filename, result.duration)
+            self._record_in_cache(result)
+            return tally.account(result, progress, repo_root=self.config.repo_root, fail_fast=self.config.fail_fast)
+
+        submit(window)
+        completed: list[_FileResult] = []
+        try:
+            while in_flight and not tally.stopped:
+                with tally.tracer.span("wait"):
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                completed = []
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        results = future.result()
+                    except WorkerTimeoutError as exc:
+                        results = self._timed_out(batch, exc, leftovers)
+                    batcher.observe(
+                        sum(len(work.source) for work in batch[: len(results)]),
+                        sum(result.duration for result in results),
                     )
-            finally:
-                if stop:
-                    # cancel_futures drops not-yet-started work; the enclosing
-                    # ``with`` then shuts down waiting for already-running futures,
-                    # so their atomic writes finish cleanly (safer than the old
-                    # Pool.terminate(), which could strand a .refine-tmp).
-                    executor.shutdown(cancel_futures=True)
-
-    def _mark_clean_if_unchanged(self, result: ExecutionResult) -> None:
-        if (
-            self.cache is not None
-            and isinstance(result.transform_result, TransformSuccess)
-            and not result.changed
-            and not result.transform_result.warning_messages
-        ):
-            self.cache.mark_clean(result.filename, result.transform_result.code)
-
-    def _process_path(self, metadata_manager: FullRepoManager | None, work: _Work) -> ExecutionResult:
+                    completed.extend(results)
+                # The files staged by every batch which just completed are committed together.
+                results, completed = completed, []
+                with tally.tracer.span("account", files=len(results)):
+                    if self._commit_and_account(results, tally, account):
+                        return accounted
+                # Refill the window with as many new batches as just completed.
+                submit(len(done))
+        finally:
+            # On an early stop, drop not-yet-started work and wait for the
+            # already-running futures, so their atomic writes finish cleanly
+            # (safer than the old Pool.terminate(), which could strand a
+            # .refine-tmp). Only our own futures are touched, so a pool kept
+            # alive for later runs stays usable.
+            for future in in_flight:
+                future.cancel()
+            concurrent.futures.wait(in_flight)
+            # Their results are dropped, and so are the new contents they staged.
+            dropped = itertools.chain(completed, *(_completed_results(future) for future in in_flight))
+            discard(result.staged for result in dropped if result.staged)
+        return accounted
+
+    def _commit_and_account(
+        self, results: list[_FileResult], tally: _ResultTally, account: Callable[[_FileResult], bool]
+    ) -> bool:
+        """
+        Commit the new contents staged for ``results``, and ``account`` each result once committed.
+
+        The contents are committed in groups, each ending with the first result
+        which stops processing by itself, so that no file is replaced past it:
+        once stopped, the contents left are discarded. Returns whether to stop.
+        """
+        pending = results
+        try:
+            while pending:
+                end = next(
+                    (
+                        idx + 1
+                        for idx, result in enumerate(pending)
+                        if tally.stops(result, fail_fast=self.config.fail_fast)
+                    ),
+                    len(pending),
+                )
+                group, pending = self._commit_staged(pending[:end], tally.tracer), pending[end:]
+                # Each file of the group got replaced, or failed to: they are all accounted.
+                stopped = False
+                for result in group:
+                    stopped = account(result) or stopped
+                if stopped:
+                    return True
+            return False
+        finally:
+            discard(result.staged for result in pending if result.staged)
+
+    def _commit_staged(self, results: list[_FileResult], tracer: Tracer) -> list[_FileResult]:
+        """
+        Commit the new contents staged for ``results``, as one group.
+
+        Returns ``results``, those whose file could not be replaced turned into failures.
+        """
+        staged = [(result.staged, result.filename) for result in results if result.staged]
+        if not staged:
+            return results
+        with tracer.span("commit", files=len(staged)):
+            errors = commit(staged)
+        committed = []
+        for result in results:
+            exc = errors.get(result.filename) if result.staged else None
+            if exc is not None:
+                committed.append(
+                    _FileResult(
+                        filename=result.filename,
+                        status="failure",
+                        warnings=result.warnings,
+                        message=str(exc),
+                        traceback="".join(traceback.format_exception(exc)),
+                        duration=result.duration,
+                        timings=result.timings,
+                    )
+                )
+            else:
+                committed.append(msgspec.structs.replace(result, staged=""))
+        return committed
+
+    def _timed_out(
+        self, batch: list[_Work], exc: WorkerTimeoutError, leftovers: collections.deque[list[_Work]]
+    ) -> list[_FileResult]:
+        """
+        Report the file a killed worker was stuck on, and queue the rest of its batch again.
+        """
+        results: list[_FileResult] = list(exc.partial)
+        log.debug("%s", exc)
+        if len(results) == len(batch):
+            # Killed after sending back every file, before telling it was done: nothing got stuck.
+            return results
+        stuck = batch[len(results)]
+        results.append(
+            _FileResult(
+                filename=stuck.filename,
+                status="failure",
+                message=f"Timed out after {self.config.file_timeout}s",
+                traceback=f"Timed out: processing took longer than file_timeout={self.config.file_timeout}s\n",
+                duration=self.config.file_timeout,
+            )
+        )
+        if len(results) < len(batch) and not self.config.fail_fast:
+            leftovers.append(batch[len(results) :])
+        return results
+
+    def _record_in_cache(self, result: _FileResult) -> None:
+        """
+        Record the file of ``result`` as clean, or as failing, if unchanged.
+        """
+        stat = self._stats.pop(result.filename, None)
+        if self.cache is None or result.digest is None or result.changed:
+            return
+        # Where git knows the file, its blob id is what the next runs look the cache up with.
+        digest = self._blob_ids.get(result.filename, result.digest)
+        if result.status == "failure":
+            failure = CachedFailure(
+                codemods=dict(self.codemod_keys),
+                message=result.message,
+                traceback=result.traceback,
+                warnings=list(result.warnings),
+            )
+            self.cache.mark_failed(result.filename, digest, failure, stat)
+            return
+        # Its warnings are recorded, to be reported again rather than transforming it again.
+        self.cache.mark_clean_digest(result.filename, digest, self.codemod_keys, stat, result.codemod_warnings)
+
+    def _git_blob_ids(self, tracer: Tracer) -> dict[str, str]:
+        """
+        The git blob ids of the files git tracks unmodified, to look the cache up with, when ``cache_key = "git"``.
+        """
+        if self.cache is None or self.config.cache_key != "git":
+            return {}
+        try:
+            with tracer.span("git blob ids"):
+                return git.blob_ids(Path(self.config.repo_root))
+        except git.GitError as exc:
+            log.warning("Unable to get the files' blob ids from git, reading every file instead: %s", exc)
+            return {}
+
+    def _process_batch(self, metadata_manager: FullRepoManager | None, batch: list[_Work]) -> list[_FileResult]:
+        """
+        Process a batch of work items in a worker.
+        """
+        return list(self._iter_batch(metadata_manager, batch))
+
+    def _iter_batch(self, metadata_manager: FullRepoManager | None, batch: list[_Work]) -> Iterator[_FileResult]:
+        """
+        Process a batch of work items in a worker, yielding each result as soon as it is known.
+
+        With ``fail_fast``, the batch stops at its first failure, exactly like
+        the files which were never dispatched. With ``exit_on_first_change``, it
+        stops at its first changed file.
+        """
+        for work in batch:
+            profiler = Profiler(
+                enabled=self.config.profile > 0, trace=bool(self.config.trace_file), timings=work.timings
+            )
+            started = time.perf_counter()
+            with profiler.span("transform"):
+                result = self._process_path(metadata_manager, work, profiler)
+            yield msgspec.structs.replace(
+                result,
+                warnings=work.cached_warnings + result.warnings,
+                duration=time.perf_counter() - started,
+                timings=profiler.timings(),
+                spans=profiler.spans(),
+            )
+            if self.config.fail_fast and result.status == "failure":
+                break
+            if self.config.exit_on_first_change and result.changed:
+                break
+
+    def _process_path(self, metadata_manager: FullRepoManager | None, work: _Work, profiler: Profiler) -> _FileResult:
         filename = work.filename
         # determine the module and package name for this file
         try:
@@ -483,17 +1412,22 @@ class Processor:
             full_package_name=pkg_name,
             metadata_manager=metadata_manager,
         )
+        # Lets the codemods time their metadata resolution.
+        context.scratch[_PROFILER_KEY] = profiler
 
         try:
             old_code = work.source
 
             # Run the transform, bail if we failed or if we aren't formatting code
             try:
-                input_tree = cst.parse_module(old_code)
+                with profiler.phase("parse"):
+                    input_tree = cst.parse_module(old_code)
                 context.scratch[_PRISTINE_TREE_KEY] = input_tree
                 output_tree = input_tree
+                codemod_warnings: dict[str, tuple[str, ...]] = {}
                 for codemod_name in work.codemod_names:
                     codemod = self.codemods_by_name[codemod_name]
+                    emitted = len(context.warnings)
                     try:
                         # log.info(" - Applying %s", codemod.NAME)
                         mod = codemod(
@@ -501,7 +1435,11 @@ class Processor:
                             # Pass copies of the configuration
                             config=self.codemod_configs[codemod_name],
                         )
-                        output_tree = mod.transform_module(output_tree)
+                        with (
+                            profiler.phase(f"codemod:{codemod.NAME}"),
+                            _time_budget(self.config.codemod_timeout, codemod.NAME),
+                        ):
+                            output_tree = mod.transform_module(output_tree)
                     except SkipFile as exc:
                         log.info(
                             " - Skipping %s on %s: %s",
@@ -509,147 +1447,256 @@ class Processor:
                             os.path.relpath(filename, self.config.repo_root),
                             exc,
                         )
-                        continue
+                    if len(context.warnings) > emitted:
+                        codemod_warnings[codemod_name] = tuple(context.warnings[emitted:])
 
-                new_code = output_tree.code
+                with profiler.phase("codegen"):
+                    new_code = output_tree.code
             except KeyboardInterrupt:
-                return ExecutionResult(
-                    filename=filename,
-                    changed=False,
-                    transform_result=TransformExit(),
-                )
+                return _FileResult(filename=filename, status="exit")
             except SkipFile as ex:
-                return ExecutionResult(
+                return _FileResult(
                     filename=filename,
-                    changed=False,
-                    transform_result=TransformSkip(
-                        skip_reason=SkipReason.OTHER,
-                        skip_description=str(ex),
-                        warning_messages=context.warnings,
-                    ),
+                    status="skip",
+                    warnings=tuple(context.warnings),
+                    message=str(ex),
                 )
+            except (CodemodTimeoutError, OSError, subprocess.SubprocessError) as ex:
+                # Depends on the environment (load, missing tools), not on the content: could
+                # go differently on another run, so not worth caching.
+                return _FileResult.failure(filename, ex, context.warnings)
             except Exception as ex:
-                return ExecutionResult(
-                    filename=filename,
-                    changed=False,
-                    transform_result=TransformFailure(
-                        error=ex,
-                        traceback_str=traceback.format_exc(),
-                        warning_messages=context.warnings,
-                    ),
-                )
+                digest = None
+                if self.config.cache:
+                    # The same content fails the same way: let the parent remember it.
+                    with profiler.phase("cache"):
+                        digest = source_digest(old_code)
+                return _FileResult.failure(filename, ex, context.warnings, digest)
             if new_code != old_code:
-                try:
-                    # Write to a temporary file in the target's own directory, then
-                    # atomically replace the target. Keeping the temp file on the same
-                    # filesystem keeps ``os.replace`` atomic, and closing the handle
-                    # before the replace is required on Windows (an open temp file
-                    # cannot be replaced there).
-                    target_dir = os.path.dirname(filename) or "."
-                    tmp_fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".refine-tmp")
-                    try:
-                        with os.fdopen(tmp_fd, mode="w", encoding="utf-8") as wfh:
-                            wfh.write(new_code)
-                            # Ensure all data is written to disk
-                            wfh.flush()
-                            os.fsync(wfh.fileno())
-                        # Preserve the original file's permission bits before replacing it.
-                        shutil.copymode(filename, tmp_path)
-                        os.replace(tmp_path, filename)
-                    except BaseException:
-                        # Never leave a stray temporary file behind on failure.
-                        with contextlib.suppress(OSError):
-                            os.unlink(tmp_path)
-                        raise
-                except Exception as exc:
-                    return ExecutionResult(
-                        filename=filename,
-                        changed=False,
-                        transform_result=TransformFailure(
-                            error=exc,
-                            traceback_str=traceback.format_exc(),
-                            warning_messages=context.warnings,
-                        ),
-                    )
-                return ExecutionResult(
-                    filename=filename,
-                    changed=True,
-                    transform_result=TransformSuccess(
-                        warning_messages=context.warnings,
-                        code=new_code,
-                    ),
-                )
-            return ExecutionResult(
+                self._store_output(work, old_code, new_code, tuple(context.warnings), profiler)
+                return self._write_back(filename, old_code, new_code, tuple(context.warnings), profiler)
+            digest = None
+            if self.config.cache:
+                # Only the parent holds the cache, hand it the digest rather than the code.
+                with profiler.phase("cache"):
+                    digest = source_digest(new_code)
+            return _FileResult(
                 filename=filename,
-                changed=False,
-                transform_result=TransformSuccess(
-                    warning_messages=context.warnings,
-                    code=new_code,
-                ),
+                status="success",
+                warnings=tuple(context.warnings),
+                digest=digest,
+                codemod_warnings=codemod_warnings if digest is not None else {},
             )
         except KeyboardInterrupt:
-            return ExecutionResult(
-                filename=filename,
-                changed=False,
-                transform_result=TransformExit(),
-            )
+            return _FileResult(filename=filename, status="exit")
         except Exception as ex:
-            return ExecutionResult(
-                filename=filename,
-                changed=False,
-                transform_result=TransformFailure(
-                    error=ex,
-                    traceback_str=traceback.format_exc(),
-                    warning_messages=context.warnings,
-                ),
-            )
+            return _FileResult.failure(filename, ex, context.warnings)
+
+    def _store_output(
+        self, work: _Work, old_code: str, new_code: str, warnings: tuple[str, ...], profiler: Profiler
+    ) -> None:
+        """
+        Keep ``new_code`` in the output cache, for when ``old_code`` comes back.
+        """
+        if self.outputs is None or not self._cacheable_outputs or warnings:
+            # Replaying the output would not replay the warnings.
+            return
+        with profiler.phase("store"):
+            self.outputs.store(self._output_key(work.filename, source_digest(old_code), work.codemod_names), new_code)
+
+    def _write_back(
+        self, filename: str, old_code: str, new_code: str, warnings: tuple[str, ...], profiler: Profiler
+    ) -> _FileResult:
+        """
+        Write the changed ``new_code`` back to ``filename``, or only report it with ``check`` or ``diff``.
+        """
+        if self.config.check or self.config.diff:
+            diff = ""
+            if self.config.diff:
+                with profiler.phase("diff"):
+                    diff = _unified_diff(
+                        old_code, new_code, Path(os.path.relpath(filename, self.config.repo_root)).as_posix()
+                    )
+            return _FileResult(filename=filename, status="success", changed=True, warnings=warnings, diff=diff)
+        staged = ""
+        try:
+            with profiler.phase("write"):
+                if self.config.fsync == "batch":
+                    staged = stage(filename, new_code)
+                else:
+                    write_atomically(filename, new_code, fsync=self.config.fsync != "none")
+        except Exception as exc:
+            return _FileResult.failure(filename, exc, warnings)
+        return _FileResult(filename=filename, status="success", changed=True, warnings=warnings, staged=staged)
+
+
+#: Whether the codemods of a set of modules can run in a subinterpreter, see :func:`_probe_interpreter`.
+_INTERPRETER_SAFE: dict[frozenset[str], bool] = {}
+
+
+def _probe_interpreter(modules: frozenset[str]) -> bool:
+    """
+    Check whether ``modules`` import, and libCST parses, in a subinterpreter.
+
+    Extension modules which do not support subinterpreters fail to import there.
+    """
+    if not hasattr(concurrent.futures, "InterpreterPoolExecutor"):
+        # Python < 3.14
+        return False
+    try:
+        with concurrent.futures.InterpreterPoolExecutor(max_workers=1) as pool:
+            pool.submit(_import_and_parse, sorted(modules)).result()
+    except Exception as exc:
+        log.debug("Codemods cannot run in a subinterpreter: %s", exc)
+        return False
+    return True
+
+
+def _import_and_parse(modules: list[str]) -> None:
+    for module in modules:
+        importlib.import_module(module)
+    cst.parse_module("pass\n")
+
+
+#: What process pool (or interpreter pool) workers got installed by :func:`_init_worker`.
+_WORKER_STATE: tuple[Processor, FullRepoManager | None] | None = None
+
+
+def _init_worker(processor: Processor, metadata_manager: FullRepoManager | None) -> None:
+    global _WORKER_STATE  # noqa: PLW0603
+    _WORKER_STATE = (processor, metadata_manager)
+
+
+def _process_batch_in_worker(batch: list[_Work]) -> list[_FileResult]:
+    return list(_iter_batch_in_worker(batch))
+
+
+def _iter_batch_in_worker(batch: list[_Work]) -> Iterator[_FileResult]:
+    if _WORKER_STATE is None:
+        error = "The process pool worker was not initialized"
+        raise RuntimeError(error)
+    processor, metadata_manager = _WORKER_STATE
+    return processor._iter_batch(metadata_manager, batch)  # noqa: SLF001
+
+
+def _unified_diff(old_code: str, new_code: str, path: str) -> str:
+    """
+    A unified diff from ``old_code`` to ``new_code``, which ``git apply`` can apply.
+    """
+    lines = []
+    for line in difflib.unified_diff(
+        _split_lines(old_code), _split_lines(new_code), fromfile=f"a/{path}", tofile=f"b/{path}"
+    ):
+        lines.append(line)
+        if not line.endswith("\n"):
+            lines.append("\n\\ No newline at end of file\n")
+    return "".join(lines)
+
+
+def _split_lines(code: str) -> list[str]:
+    # Unlike str.splitlines(), only split on newlines: a form feed does not end a line in a diff.
+    lines = code.split("\n")
+    last = lines.pop()
+    return [f"{line}\n" for line in lines] + ([last] if last else [])
+
+
+def _warn_unsupervised(pool_kind: str) -> None:
+    log.warning(
+        "The %s executor enforces neither file_timeout nor worker_max_rss, which are ignored; "
+        "use the process executor for them",
+        pool_kind,
+    )
+
+
+def _completed_results(future: concurrent.futures.Future[list[_FileResult]]) -> list[_FileResult]:
+    """
+    The results of a batch which is done, those got before its worker timed out included.
+    """
+    if future.cancelled():
+        return []
+    exc = future.exception()
+    if isinstance(exc, WorkerTimeoutError):
+        return list(exc.partial)
+    if exc is not None:
+        return []
+    return future.result()
+
+
+def _drain(items: collections.deque[_R]) -> Iterator[_R]:
+    while items:
+        yield items.popleft()
+
+
+@contextlib.contextmanager
+def _time_budget(seconds: float, codemod_name: str) -> Iterator[None]:
+    """
+    Interrupt the block with :class:`~refine.exc.CodemodTimeoutError` once it ran for ``seconds``.
+
+    Relies on ``SIGALRM``, so it is only enforced on Unix, from the main thread:
+    in process pool workers and with the sync executor. Time spent in C code
+    which does not check for signals cannot be interrupted.
+    """
+    if seconds <= 0 or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _interrupt(signum: int, frame: object) -> None:
+        error = f"{codemod_name} took longer than codemod_timeout={seconds}s"
+        raise CodemodTimeoutError(error)
+
+    previous_handler = signal.signal(signal.SIGALRM, _interrupt)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
 
 
 def _print_parallel_result(
-    exec_result: ExecutionResult,
+    result: _FileResult,
     progress: Progress,
     *,
     repo_root: str,
-    unified_diff: bool,
     show_successes: bool,
     show_changed: bool,
-    hide_generated: bool,
-    hide_blacklisted: bool,
+    dry_run: bool = False,
 ) -> None:
-    filename = os.path.relpath(exec_result.filename, repo_root)
-    result = exec_result.transform_result
+    filename = os.path.relpath(result.filename, repo_root)
 
-    if isinstance(result, TransformSkip):
+    if result.status == "skip":
         # Skipped file, print message and don't write back since not changed.
-        if not (
-            (result.skip_reason is SkipReason.BLACKLISTED and hide_blacklisted)
-            or (result.skip_reason is SkipReason.GENERATED and hide_generated)
-        ):
-            progress.clear()
-            print(f"Modifying {filename}", file=sys.stderr)
-            print_execution_result(result)
-            print(
-                f"Skipped codemodding {filename}: {result.skip_description}\n",
-                file=sys.stderr,
-            )
-    elif isinstance(result, TransformFailure):
+        progress.clear()
+        print(f"Modifying {filename}", file=sys.stderr)
+        _print_result_details(result)
+        print(f"Skipped codemodding {filename}: {result.message}\n", file=sys.stderr)
+    elif result.status == "failure":
         # Print any exception, don't write the file back.
         progress.clear()
         print(f"Modifying {filename}", file=sys.stderr)
-        print_execution_result(result)
+        _print_result_details(result)
         print(f"Failed to codemod {filename}\n", file=sys.stderr)
-    elif isinstance(result, TransformSuccess):
-        if show_successes or (exec_result.changed and show_changed) or result.warning_messages:
+    elif result.status == "success":
+        if show_successes or (result.changed and show_changed) or result.warnings:
             # Print any warnings, save the changes if there were any.
             progress.clear()
-            if show_successes or result.warning_messages:
+            if show_successes or result.warnings:
                 print(f"Modifying {filename}", file=sys.stderr)
-            print_execution_result(result)
+            _print_result_details(result)
+            if result.diff:
+                sys.stderr.flush()
+                sys.stdout.write(result.diff)
+                sys.stdout.flush()
+            verb = "Would codemod" if dry_run and result.changed else "Successfully codemodded"
             print(
-                f"Successfully codemodded {filename}" + (" with warnings\n" if result.warning_messages else "\n"),
+                f"{verb} {filename}" + (" with warnings\n" if result.warnings else "\n"),
                 file=sys.stderr,
             )
 
-        # In unified diff mode, the code is a diff we must print.
-        if unified_diff and result.code:
-            print(result.code)
+
+def _print_result_details(result: _FileResult) -> None:
+    # Same output as libCST's print_execution_result
+    for warning in result.warnings:
+        print(f"WARNING: {warning}", file=sys.stderr)
+    if result.traceback:
+        print(result.traceback, file=sys.stderr)
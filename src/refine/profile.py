@@ -0,0 +1,296 @@
+"""
+Per-phase timing and tracing of a processing run.
+
+Each file's time is split into phases: reading, cache hashing, gating, parsing,
+each codemod, metadata resolution, codegen and writing. Phases are timed where
+they run, in the parent or in the pool workers, travel back along with the
+file's result, and are aggregated into a :class:`ProfileReport` in the parent.
+
+When tracing, the phases are also recorded as spans, collected by a
+:class:`Tracer` along with the parent's own spans and written out in the
+Trace Event Format, for Perfetto or ``chrome://tracing`` to show. Spans use
+:func:`time.perf_counter`, a system-wide monotonic clock, so those recorded
+by the pool workers line up with the parent's.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import heapq
+import os
+import threading
+import time
+from collections.abc import Iterable
+from collections.abc import Iterator
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any
+
+import msgspec
+
+#: Key of the file's :class:`Profiler` in the codemod context's scratch.
+_PROFILER_KEY = "__refine_profiler__"
+
+
+class Timing(msgspec.Struct, array_like=True, frozen=True):
+    """
+    Time spent in a phase.
+    """
+
+    #: Wall-clock seconds.
+    wall: float
+    #: CPU seconds, of the thread running the phase.
+    cpu: float
+
+
+class Span(msgspec.Struct, array_like=True, frozen=True):
+    """
+    A traced block of code.
+    """
+
+    name: str
+    #: :func:`time.perf_counter` at the start and end of the block.
+    start: float
+    end: float
+    #: Process and native thread IDs of where the block ran.
+    pid: int
+    tid: int
+
+
+class Profiler:
+    """
+    Records the time a single file spends in each phase, and traces them.
+
+    Phases may nest: a phase's time excludes that of the phases nested in it,
+    so the phases of a file add up to the time spent on it. A profiler neither
+    enabled nor tracing records nothing.
+    """
+
+    def __init__(self, *, enabled: bool, trace: bool = False, timings: Mapping[str, Timing] | None = None) -> None:
+        self.enabled = enabled
+        self.trace = trace
+        self._timings: dict[str, Timing] = dict(timings or {})
+        # Wall and CPU time of the phases nested in each running phase.
+        self._nested: list[list[float]] = []
+        self._spans: list[Span] = []
+        self._pid = os.getpid()
+        self._tid = threading.get_native_id()
+
+    @property
+    def active(self) -> bool:
+        """
+        Whether this profiler records anything.
+        """
+        return self.enabled or self.trace
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Trace the enclosed block, without accounting it as a phase.
+        """
+        if not self.trace:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._spans.append(Span(name=name, start=started, end=time.perf_counter(), pid=self._pid, tid=self._tid))
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block as part of the ``name`` phase.
+        """
+        with self.span(name):
+            if not self.enabled:
+                yield
+                return
+            with self._timed(name):
+                yield
+
+    @contextlib.contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        self._nested.append([0.0, 0.0])
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_started
+            cpu = time.thread_time() - cpu_started
+            nested_wall, nested_cpu = self._nested.pop()
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+            previous = self._timings.get(name)
+            if previous is not None:
+                wall += previous.wall
+                cpu += previous.cpu
+            self._timings[name] = Timing(wall=wall - nested_wall, cpu=cpu - nested_cpu)
+
+    def timings(self) -> dict[str, Timing]:
+        """
+        The time spent in each phase so far.
+        """
+        return dict(self._timings)
+
+    def spans(self) -> tuple[Span, ...]:
+        """
+        The spans traced so far.
+        """
+        return tuple(self._spans)
+
+
+class Tracer:
+    """
+    Collects the spans of a run, and writes them out in the Trace Event Format.
+
+    Each process gets a track: the parent, and each pool worker. A disabled
+    tracer records nothing.
+    """
+
+    def __init__(self, *, enabled: bool) -> None:
+        self.enabled = enabled
+        self._origin = time.perf_counter()
+        self._events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, spans: Iterable[Span], **args: Any) -> None:
+        """
+        Collect ``spans``, annotated with ``args``.
+        """
+        if not self.enabled:
+            return
+        events = [self._event(span, args) for span in spans]
+        with self._lock:
+            self._events.extend(events)
+
+    def add_span(self, name: str, start: float, end: float, **args: Any) -> None:
+        """
+        Collect a span of the current thread, from its :func:`time.perf_counter` bounds.
+        """
+        if self.enabled:
+            span = Span(name=name, start=start, end=end, pid=os.getpid(), tid=threading.get_native_id())
+            self.add((span,), **args)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        """
+        Trace the enclosed block, on the current thread.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, started, time.perf_counter(), **args)
+
+    def worker_started(self, pid: int, start: float, end: float) -> None:
+        """
+        Trace the start of pool worker ``pid``.
+        """
+        self.add_span("start worker", start, end, pid=pid)
+
+    def dump(self, path: Path) -> None:
+        """
+        Write the collected spans to ``path``, as JSON.
+        """
+        with self._lock:
+            events = list(self._events)
+        parent = os.getpid()
+        for pid in sorted({event["pid"] for event in events}):
+            name = "refine" if pid == parent else f"refine worker {pid}"
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+            # List the parent first.
+            events.append(
+                {"name": "process_sort_index", "ph": "M", "pid": pid, "args": {"sort_index": 0 if pid == parent else 1}}
+            )
+        path.write_bytes(msgspec.json.encode({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+    def _event(self, span: Span, args: Mapping[str, Any]) -> dict[str, Any]:
+        return {
+            "name": span.name,
+            "cat": "refine",
+            "ph": "X",
+            # Microseconds since the tracer was created.
+            "ts": (span.start - self._origin) * 1e6,
+            "dur": (span.end - span.start) * 1e6,
+            "pid": span.pid,
+            "tid": span.tid,
+            "args": args,
+        }
+
+
+class ProfileReport:
+    """
+    Aggregates the per-phase timings of every file of a run.
+    """
+
+    def __init__(self) -> None:
+        self._phases: dict[str, list[Timing]] = {}
+        self._files: list[tuple[float, str]] = []
+
+    def add(self, filename: str, timings: Mapping[str, Timing]) -> None:
+        """
+        Account the phase timings of one file.
+        """
+        for name, timing in timings.items():
+            self._phases.setdefault(name, []).append(timing)
+        self._files.append((sum(timing.wall for timing in timings.values()), filename))
+
+    def totals(self) -> dict[str, Timing]:
+        """
+        The time spent in each phase, over every file.
+        """
+        return {
+            name: Timing(wall=sum(timing.wall for timing in timings), cpu=sum(timing.cpu for timing in timings))
+            for name, timings in self._phases.items()
+        }
+
+    def render(self, *, slowest: int) -> str:
+        """
+        Render the report as a table of the phases, followed by the ``slowest`` files.
+        """
+        total_wall = sum(timing.wall for timings in self._phases.values() for timing in timings)
+        rows: list[tuple[str, ...]] = [
+            ("Phase", "Files", "Wall (s)", "CPU (s)", "Share", "p50 (ms)", "p90 (ms)", "p99 (ms)", "Max (ms)")
+        ]
+        for name, timings in sorted(self._phases.items(), key=lambda item: -sum(timing.wall for timing in item[1])):
+            walls = sorted(timing.wall for timing in timings)
+            wall = sum(walls)
+            rows.append(
+                (
+                    name,
+                    str(len(walls)),
+                    f"{wall:.3f}",
+                    f"{sum(timing.cpu for timing in timings):.3f}",
+                    f"{wall / total_wall:.1%}" if total_wall else "-",
+                    *(f"{_percentile(walls, quantile) * 1000:.2f}" for quantile in (0.5, 0.9, 0.99)),
+                    f"{walls[-1] * 1000:.2f}",
+                )
+            )
+        widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+        lines = [f"Profile of {len(self._files)} files:"]
+        for row in rows:
+            lines.append(
+                "  ".join(
+                    cell.ljust(width) if column == 0 else cell.rjust(width)
+                    for column, (cell, width) in enumerate(zip(row, widths, strict=True))
+                )
+            )
+        if slowest > 0 and self._files:
+            lines.append(f"Slowest {min(slowest, len(self._files))} files:")
+            lines.extend(
+                f"  {wall * 1000:10.2f} ms  {filename}" for wall, filename in heapq.nlargest(slowest, self._files)
+            )
+        return "\n".join(lines)
+
+
+def _percentile(values: list[float], quantile: float) -> float:
+    """
+    Nearest-rank percentile of the sorted ``values``.
+    """
+    return values[min(int(len(values) * quantile), len(values) - 1)]
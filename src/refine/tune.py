@@ -0,0 +1,215 @@
+"""
+Find the fastest executor, pool size and batch size for a tree.
+
+``refine tune`` runs a sample of the tree's files through the selected codemods
+under several settings, on a scratch copy of the files so nothing gets
+rewritten, and saves the fastest settings as a :class:`Recommendation` in the
+cache directory. Later runs use it for the settings their configuration leaves
+out.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Any
+
+import msgspec
+
+from refine.processor import Processor
+
+if TYPE_CHECKING:
+    from refine.abc import BaseCodemod
+    from refine.config import Config
+    from refine.registry import Registry
+
+log = logging.getLogger(__name__)
+
+#: Name of the recommendation file, in the cache directory.
+RECOMMENDATION_FILE = "tune.json"
+
+#: Batch sizes tried on the fastest executor and pool size, next to the adaptive batching.
+_BATCH_SIZES = (1, 4, 16)
+
+
+class Trial(msgspec.Struct, frozen=True):
+    """
+    A timed run over the sampled files.
+    """
+
+    executor: str
+    jobs: int
+    #: 0 for the adaptive batching.
+    batch_size: int
+    seconds: float
+
+
+class Recommendation(msgspec.Struct, frozen=True):
+    """
+    The fastest settings found by ``refine tune``.
+    """
+
+    executor: str
+    process_pool_size: int
+    batch_size: int
+    #: :func:`os.cpu_count` when tuning. A recommendation made on other hardware is ignored.
+    cpus: int
+    #: Number of sampled files.
+    files: int
+    trials: list[Trial] = msgspec.field(default_factory=list)
+
+    def as_config(self) -> dict[str, Any]:
+        """
+        The recommended settings, as configuration values.
+        """
+        return {
+            "executor": self.executor,
+            "process_pool_size": self.process_pool_size,
+            "batch_size": self.batch_size,
+        }
+
+
+def load_recommendation(cache_dir: Path) -> Recommendation | None:
+    """
+    Load the recommendation saved in ``cache_dir``, if any and if made for this machine.
+    """
+    path = cache_dir / RECOMMENDATION_FILE
+    try:
+        recommendation = msgspec.json.decode(path.read_bytes(), type=Recommendation)
+    except FileNotFoundError:
+        return None
+    except (OSError, msgspec.DecodeError) as exc:
+        log.debug("Ignoring the tuning recommendation in %s: %s", path, exc)
+        return None
+    if recommendation.cpus != (os.cpu_count() or 1):
+        log.debug(
+            "Ignoring the tuning recommendation in %s, made for %s CPUs instead of %s",
+            path,
+            recommendation.cpus,
+            os.cpu_count() or 1,
+        )
+        return None
+    return recommendation
+
+
+def save_recommendation(cache_dir: Path, recommendation: Recommendation) -> Path:
+    """
+    Save ``recommendation`` in ``cache_dir``, returning the path it was written to.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / RECOMMENDATION_FILE
+    path.write_bytes(msgspec.json.format(msgspec.json.encode(recommendation)) + b"\n")
+    return path
+
+
+def sample(files: Sequence[Path], size: int) -> list[Path]:
+    """
+    Pick up to ``size`` files, evenly spread over ``files``.
+    """
+    if len(files) <= size:
+        return list(files)
+    step = len(files) / size
+    return [files[int(index * step)] for index in range(size)]
+
+
+def candidates(*, cpus: int, max_jobs: int | None = None) -> list[tuple[str, int]]:
+    """
+    The ``(executor, jobs)`` combinations worth trying on ``cpus`` CPUs.
+    """
+    limit = min(cpus, max_jobs) if max_jobs else cpus
+    pool_sizes = sorted({jobs for jobs in (cpus // 4, cpus // 2, cpus - 1, cpus) if 1 < jobs <= limit})
+    executors = ["process", "thread"]
+    if hasattr(concurrent.futures, "InterpreterPoolExecutor"):
+        executors.append("interpreter")
+    return [("sync", 1), *((executor, jobs) for executor in executors for jobs in pool_sizes)]
+
+
+def tune(
+    config: Config,
+    registry: Registry,
+    codemods: list[type[BaseCodemod]],
+    files: Sequence[Path],
+    *,
+    max_jobs: int | None = None,
+) -> Recommendation:
+    """
+    Time ``codemods`` over ``files`` under several settings, and recommend the fastest.
+
+    Every executor and pool size is tried with the adaptive batching, then the
+    fastest of them with fixed batch sizes. Each trial runs on a fresh copy of
+    ``files``, without the cache, so they all do the same work. Only its second
+    run is timed, on the pool the first one started: a full-size run spreads
+    that startup over many more files than a sample, which would otherwise
+    favour the ``sync`` executor.
+    """
+    repo_root = Path(config.repo_root)
+    trials: list[Trial] = []
+    with tempfile.TemporaryDirectory(prefix="refine-tune-") as tmpdir:
+        scratch = Path(tmpdir)
+        paths = [scratch / path.relative_to(repo_root) for path in files]
+
+        def copy() -> None:
+            for source, destination in zip(files, paths, strict=True):
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, destination)
+
+        def trial(executor: str, jobs: int, batch_size: int) -> Trial:
+            processor = Processor(
+                config=msgspec.structs.replace(
+                    config,
+                    repo_root=str(scratch),
+                    executor=executor,
+                    process_pool_size=jobs,
+                    batch_size=batch_size,
+                    cache=False,
+                    hide_progress=True,
+                    fail_fast=False,
+                    check=False,
+                    diff=False,
+                    exit_on_first_change=False,
+                    profile=0,
+                    trace_file="",
+                ),
+                registry=registry,
+                codemods=codemods,
+                keep_pool=True,
+            )
+            # The trials' own diffs and warnings are of no interest here.
+            try:
+                with contextlib.redirect_stderr(io.StringIO()):
+                    copy()
+                    processor.process(paths)
+                    copy()
+                    started = time.perf_counter()
+                    processor.process(paths)
+                    seconds = time.perf_counter() - started
+            finally:
+                processor.close()
+            log.info(" - %s, %s jobs, batch size %s: %.2f seconds", executor, jobs, batch_size or "auto", seconds)
+            return Trial(executor=executor, jobs=jobs, batch_size=batch_size, seconds=seconds)
+
+        trials.extend(
+            trial(executor, jobs, 0) for executor, jobs in candidates(cpus=os.cpu_count() or 1, max_jobs=max_jobs)
+        )
+        fastest = min(trials, key=lambda candidate: candidate.seconds)
+        if fastest.executor != "sync":
+            trials.extend(trial(fastest.executor, fastest.jobs, batch_size) for batch_size in _BATCH_SIZES)
+            fastest = min(trials, key=lambda candidate: candidate.seconds)
+
+    return Recommendation(
+        executor=fastest.executor,
+        process_pool_size=fastest.jobs,
+        batch_size=fastest.batch_size,
+        cpus=os.cpu_count() or 1,
+        files=len(files),
+        trials=trials,
+    )
@@ -0,0 +1,179 @@
+"""
+Writing rewritten files back to disk.
+
+A file is never rewritten in place: its new content goes to a temporary file
+in the same directory, which then atomically replaces it. How that content is
+made durable depends on the ``fsync`` setting:
+
+- ``per-file``: :func:`write_atomically` fsyncs each temporary file before
+  replacing the original with it.
+- ``batch``: the workers only :func:`stage` the new contents, which the parent
+  then :func:`commit` in groups, with a single sync of each filesystem
+  before the renames, and a single fsync of each directory after them.
+- ``none``: :func:`write_atomically` without the fsync.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import ctypes
+import functools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Sequence
+
+log = logging.getLogger(__name__)
+
+#: Suffix of the temporary files holding new contents.
+TMP_SUFFIX = ".refine-tmp"
+
+
+def write_atomically(filename: str, code: str, *, fsync: bool = True) -> None:
+    """
+    Replace the content of ``filename`` with ``code``, atomically.
+
+    Write to a temporary file in the target's own directory, then atomically
+    replace the target. Keeping the temp file on the same filesystem keeps
+    ``os.replace`` atomic, and closing the handle before the replace is
+    required on Windows (an open temp file cannot be replaced there).
+    """
+    tmp_path = _write_tmp(filename, code, fsync=fsync)
+    try:
+        os.replace(tmp_path, filename)
+    except BaseException:
+        # Never leave a stray temporary file behind on failure.
+        discard((tmp_path,))
+        raise
+
+
+def stage(filename: str, code: str) -> str:
+    """
+    Write ``code`` to a temporary file next to ``filename``, for :func:`commit` to move over it.
+
+    Returns the temporary file's path.
+    """
+    return _write_tmp(filename, code, fsync=False)
+
+
+def commit(staged: Sequence[tuple[str, str]]) -> dict[str, OSError]:
+    """
+    Move each staged ``(temporary file, target)`` over its target, durably, as a group.
+
+    The staged contents are made durable first, with one ``syncfs`` per
+    filesystem on Linux and an fsync of each temporary file elsewhere. Only then
+    are the targets replaced, after which each of their directories is fsynced
+    once, for the renames to be durable too.
+
+    Returns the error of each target which could not be replaced. Their
+    temporary files are removed, and so are those left over on failure.
+    """
+    pending = dict(staged)
+    errors: dict[str, OSError] = {}
+    try:
+        try:
+            _sync_contents(list(pending))
+        except OSError as exc:
+            # Nothing got replaced: every target keeps its previous content.
+            return dict.fromkeys(pending.values(), exc)
+        directories: set[str] = set()
+        for tmp_path in list(pending):
+            filename = pending.pop(tmp_path)
+            try:
+                os.replace(tmp_path, filename)
+            except OSError as exc:
+                discard((tmp_path,))
+                errors[filename] = exc
+            else:
+                directories.add(os.path.dirname(filename) or ".")
+        for directory in directories:
+            try:
+                _fsync_directory(directory)
+            except OSError as exc:
+                # The files were replaced, only the durability of the renames is in doubt.
+                log.warning("Failed to sync directory %s: %s", directory, exc)
+    finally:
+        discard(pending)
+    return errors
+
+
+def discard(tmp_paths: Iterable[str]) -> None:
+    """
+    Remove temporary files, ignoring those already gone.
+    """
+    for tmp_path in tmp_paths:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+
+
+def _write_tmp(filename: str, code: str, *, fsync: bool) -> str:
+    target_dir = os.path.dirname(filename) or "."
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=TMP_SUFFIX)
+    try:
+        with os.fdopen(tmp_fd, mode="w", encoding="utf-8") as wfh:
+            wfh.write(code)
+            if fsync:
+                # Ensure all data is written to disk
+                wfh.flush()
+                os.fsync(wfh.fileno())
+        # Preserve the original file's permission bits before replacing it.
+        shutil.copymode(filename, tmp_path)
+    except BaseException:
+        discard((tmp_path,))
+        raise
+    return tmp_path
+
+
+def _sync_contents(tmp_paths: Sequence[str]) -> None:
+    """
+    Make the contents of ``tmp_paths`` durable.
+    """
+    syncfs = _syncfs()
+    if syncfs is not None:
+        # One file per filesystem is enough for syncfs to flush all of them.
+        by_device = {os.stat(tmp_path).st_dev: tmp_path for tmp_path in tmp_paths}
+        for tmp_path in by_device.values():
+            _with_fd(tmp_path, os.O_RDONLY, syncfs)
+        return
+    for tmp_path in tmp_paths:
+        _with_fd(tmp_path, os.O_RDONLY, os.fsync)
+
+
+def _fsync_directory(directory: str) -> None:
+    if sys.platform == "win32":
+        # Directories cannot be opened, nor fsynced, on Windows.
+        return
+    _with_fd(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0), os.fsync)
+
+
+def _with_fd(path: str, flags: int, func: Callable[[int], None]) -> None:
+    fd = os.open(path, flags)
+    try:
+        func(fd)
+    finally:
+        os.close(fd)
+
+
+@functools.cache
+def _syncfs() -> Callable[[int], None] | None:
+    """
+    Linux's ``syncfs(2)``, which the :mod:`os` module does not expose.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc_syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+    libc_syncfs.argtypes = [ctypes.c_int]
+
+    def syncfs(fd: int) -> None:
+        if libc_syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    return syncfs
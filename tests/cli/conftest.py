@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import os
 import pathlib
+from collections.abc import Iterable
 from collections.abc import Iterator
 from contextlib import contextmanager
 from dataclasses import dataclass
@@ -80,7 +81,7 @@ def codemods():
 @pytest.fixture
 def _mock_registry_codemods(codemods):
     """Fixture to mock the Registry class."""
-    with patch("refine.cli.Registry._load", return_value={mod.NAME: mod for mod in codemods}):
+    with patch("refine.registry.Registry._load", return_value={mod.NAME: mod for mod in codemods}):
         yield
 
 
@@ -94,11 +95,11 @@ class MockedProcessor:
         self.codemods = codemods
         self.files = []
 
-    def process(self, files: list[pathlib.Path]) -> ParallelTransformResult:
+    def process(self, files: Iterable[pathlib.Path]) -> ParallelTransformResult:
         """
         Mocked process method for testing purposes.
         """
-        self.files = files
+        self.files = list(files)
         return ParallelTransformResult(successes=1, failures=0, warnings=0, skips=0, changed=0)
 
 
@@ -107,7 +108,7 @@ def processor(_mock_registry_codemods):
     """
     Mocked processor for testing purposes.
     """
-    with patch("refine.cli.Processor", MockedProcessor) as mocked_processor:
+    with patch("refine.processor.Processor", MockedProcessor) as mocked_processor:
         yield mocked_processor
 
 
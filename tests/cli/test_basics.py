@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import logging
 import os
+import subprocess
+import sys
 import textwrap
 from unittest.mock import call
 from unittest.mock import patch
@@ -9,6 +11,8 @@ from unittest.mock import patch
 import pytest
 
 from refine import __version__
+from refine import git
+from refine import tune
 from refine.exc import InvalidConfigError
 from refine.exc import RefineSystemExit
 from refine.processor import ParallelTransformResult
@@ -209,6 +213,24 @@ def test_no_cache_functionality(cli, file_to_modify, subtests):
         assert cli.config.cache is True
 
 
+def test_no_output_cache_flag(cli, file_to_modify):
+    exitcode = cli.run("--no-output-cache", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.output_cache is False
+
+
+def test_cache_paranoid_flag(cli, file_to_modify):
+    exitcode = cli.run("--cache-paranoid", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.cache_paranoid is True
+
+
+def test_retry_failures_flag(cli, file_to_modify):
+    exitcode = cli.run("--retry-failures", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.retry_failures is True
+
+
 def test_respect_gitignore_functionality(cli, file_to_modify, subtests):
     """
     Test that --respect-gitignore CLI flag works correctly.
@@ -368,6 +390,22 @@ def test_file_outside_repo_root_system_exit(cli, caplog):
     assert "is not inside the repo root" in caplog.text
 
 
+def test_files_walked_outside_repo_root_are_skipped(cli, caplog, file_to_modify):
+    """
+    Test that files found through symlinks leading out of the repo root are skipped, not failing the run midway.
+    """
+    external_file = cli.cwd.parent / "external_file.py"
+    external_file.write_text("print('external')")
+    (cli.cwd / "linked.py").symlink_to(external_file)
+
+    with caplog.at_level("WARNING"):
+        exitcode = cli.run(cli.cwd)
+
+    assert exitcode == 0
+    assert cli.processor.files == [file_to_modify]
+    assert "outside the repo root" in caplog.text
+
+
 # Tests for processor exception handling
 @pytest.mark.parametrize(
     ("exception", "expected_code", "expected_message"),
@@ -394,7 +432,7 @@ def test_processor_exceptions(cli, caplog, file_to_modify, exception, expected_c
     if isinstance(exception, Exception) and not isinstance(exception, (SystemExit, KeyboardInterrupt)):
         exception = InvalidConfigError(str(exception))
 
-    with patch("refine.cli.Processor") as mock_processor:
+    with patch("refine.processor.Processor") as mock_processor:
         if isinstance(exception, InvalidConfigError):
             # Exception during processor creation
             mock_processor.side_effect = exception
@@ -417,7 +455,7 @@ def test_processor_refine_system_exit(cli, file_to_modify):
     """
     Test that CLI handles RefineSystemExit correctly.
     """
-    with patch("refine.cli.Processor") as mock_processor:
+    with patch("refine.processor.Processor") as mock_processor:
         mock_processor_instance = mock_processor.return_value
         mock_processor_instance.process.side_effect = RefineSystemExit(code=42, message="Custom exit message")
 
@@ -429,7 +467,7 @@ def test_processing_failures_system_exit(cli, file_to_modify):
     """
     Test that CLI exits with status 1 when processor reports failures.
     """
-    with patch("refine.cli.Processor") as mock_processor:
+    with patch("refine.processor.Processor") as mock_processor:
         mock_processor_instance = mock_processor.return_value
         mock_processor_instance.process.return_value = ParallelTransformResult(
             successes=0, failures=1, warnings=0, skips=0, changed=0
@@ -551,3 +589,229 @@ def test_verbose_flag_sets_log_level(cli, file_to_modify):
         mock_logger = mock_get_logger.return_value
         cli.run("--verbose", file_to_modify)
         assert mock_logger.setLevel.call_args_list == [call(logging.DEBUG), call(logging.INFO)]
+
+
+def test_daemon_flag_falls_back_to_in_process(cli, file_to_modify):
+    """
+    Test that --daemon processes in-process when no daemon is running.
+    """
+    with patch("refine.cli.daemon.forward", return_value=None) as mock_forward:
+        exitcode = cli.run("--daemon", file_to_modify)
+    assert exitcode == 0
+    mock_forward.assert_called_once()
+    assert cli.processor.files == [file_to_modify]
+
+
+def test_daemon_flag_forwards_to_running_daemon(cli, file_to_modify):
+    """
+    Test that --daemon exits with the exit code of the run forwarded to the daemon.
+    """
+    with patch("refine.cli.daemon.forward", return_value=3) as mock_forward:
+        exitcode = cli.run("--daemon", file_to_modify)
+    assert exitcode == 3
+    assert mock_forward.call_args.args[0] == ["--daemon", str(file_to_modify)]
+    assert not hasattr(cli, "processor")
+
+
+def test_daemon_flag_forwards_before_importing_libcst():
+    """
+    Test that importing the CLI, all a run forwarded to the daemon needs, does not import libCST.
+    """
+    code = "import sys, refine.cli; print(sorted(name for name in sys.modules if name.startswith('libcst')))"
+    ret = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)  # noqa: S603
+    assert ret.stdout.strip() == "[]"
+
+
+def test_daemon_status_without_daemon(cli, caplog):
+    """
+    Test that 'refine daemon status' exits with status 1 when no daemon is running.
+    """
+    with patch("refine.cli.daemon.status", return_value=None), caplog.at_level("INFO"):
+        exitcode = cli.run("daemon", "status")
+    assert exitcode == 1
+    assert "No refine daemon is running" in caplog.text
+
+
+def test_files_are_deduplicated(cli, file_to_modify):
+    """
+    Test that a file passed more than once is only processed once.
+    """
+    exitcode = cli.run(file_to_modify, file_to_modify, cli.cwd)
+    assert exitcode == 0
+    assert cli.processor.files == [file_to_modify]
+
+
+def test_ingest_concurrency_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that --ingest-concurrency CLI flag overrides config.
+    """
+    cli.with_config(ingest_concurrency=1)
+    exitcode = cli.run("--ingest-concurrency=3", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.ingest_concurrency == 3
+
+
+def test_batch_size_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that --batch-size CLI flag overrides config.
+    """
+    cli.with_config(batch_size=8)
+    exitcode = cli.run("--batch-size=0", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.batch_size == 0
+
+
+def test_executor_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that --executor CLI flag overrides config.
+    """
+    cli.with_config(executor="process")
+    exitcode = cli.run("--executor=sync", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.executor == "sync"
+
+
+def test_timeout_cli_flags_override_config(cli, file_to_modify):
+    """
+    Test that --file-timeout and --codemod-timeout CLI flags override config.
+    """
+    cli.with_config(file_timeout=10, codemod_timeout=5)
+    exitcode = cli.run("--file-timeout=60", "--codemod-timeout=30", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.file_timeout == 60
+    assert cli.config.codemod_timeout == 30
+
+
+def test_worker_max_rss_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that the --worker-max-rss CLI flag overrides config.
+    """
+    cli.with_config(worker_max_rss=512)
+    exitcode = cli.run("--worker-max-rss=2048", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.worker_max_rss == 2048
+
+
+def test_profile_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that the --profile CLI flag enables profiling, keeping a configured number of slowest files.
+    """
+    exitcode = cli.run("--profile", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.profile == 10
+    cli.with_config(profile=3)
+    exitcode = cli.run("--profile", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.profile == 3
+
+
+def test_trace_file_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that the --trace-file CLI flag overrides config.
+    """
+    cli.with_config(trace_file="configured.json")
+    exitcode = cli.run("--trace-file=trace.json", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.trace_file == "trace.json"
+
+
+@pytest.mark.parametrize("name", ["tune", "daemon"])
+def test_path_named_like_a_subcommand_is_processed(cli, name):
+    """
+    Test that a directory named like a subcommand is processed rather than running the subcommand.
+    """
+    directory = cli.cwd / name
+    directory.mkdir()
+    module = directory / "module.py"
+    module.write_text("print('Hello, World!')")
+
+    with patch("refine.tune.tune") as mock_tune, patch("refine.cli.daemon.start") as mock_start:
+        exitcode = cli.run(name)
+
+    assert exitcode == 0
+    assert cli.processor.files == [module]
+    mock_tune.assert_not_called()
+    mock_start.assert_not_called()
+
+
+def test_tune_recommendation_fills_unconfigured_settings(cli, caplog, file_to_modify):
+    """
+    Test that the settings saved by 'refine tune' are used, unless configured or passed on the CLI.
+    """
+    recommendation = tune.Recommendation(
+        executor="thread", process_pool_size=5, batch_size=8, cpus=os.cpu_count() or 1, files=1
+    )
+    tune.save_recommendation(cli.cwd / ".refine_cache", recommendation)
+    cli.with_config(process_pool_size=2)
+    with caplog.at_level("INFO"):
+        exitcode = cli.run("--batch-size=3", file_to_modify)
+    assert exitcode == 0
+    assert "Using the settings saved by 'refine tune'" in caplog.text
+    assert "executor=thread, batch_size=8" in caplog.text
+    assert cli.config.executor == "thread"
+    assert cli.config.process_pool_size == 2
+    assert cli.config.batch_size == 3
+
+
+def test_tune_command_saves_recommendation(cli, file_to_modify, caplog):
+    """
+    Test that 'refine tune' saves its recommendation to the cache directory.
+    """
+    recommendation = tune.Recommendation(
+        executor="process", process_pool_size=2, batch_size=0, cpus=os.cpu_count() or 1, files=1
+    )
+    with caplog.at_level("INFO"), patch("refine.tune.tune", return_value=recommendation) as mock_tune:
+        exitcode = cli.run("tune", "--sample=5", "--max-jobs=2")
+    assert exitcode == 0
+    assert mock_tune.call_args.args[3] == [file_to_modify]
+    assert mock_tune.call_args.kwargs == {"max_jobs": 2}
+    assert tune.load_recommendation(cli.cwd / ".refine_cache") == recommendation
+    assert "Fastest: the process executor, 2 jobs, batch size auto." in caplog.text
+
+
+def test_fsync_cli_flag_overrides_config(cli, file_to_modify):
+    """
+    Test that the --fsync CLI flag overrides config.
+    """
+    cli.with_config(fsync="none")
+    exitcode = cli.run("--fsync=batch", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.fsync == "batch"
+
+
+def test_check_cli_flag_fails_when_files_would_change(cli, processor, file_to_modify):
+    """
+    Test that --check exits with a non-zero status when any file would change.
+    """
+    exitcode = cli.run("--check", "--diff", "--exit-on-first-change", file_to_modify)
+    assert exitcode == 0
+    assert cli.config.check is True
+    assert cli.config.diff is True
+    assert cli.config.exit_on_first_change is True
+    changed = ParallelTransformResult(successes=1, failures=0, warnings=0, skips=0, changed=1)
+    with patch.object(processor, "process", return_value=changed):
+        assert cli.run("--check", file_to_modify) == 1
+        assert cli.run("--diff", file_to_modify) == 0
+
+
+def test_since_cli_flag_only_processes_changed_files(cli, file_to_modify):
+    """
+    Test that --since only processes the files git lists as changed, minus the excluded ones.
+    """
+    changed = [cli.cwd / "pkg" / "changed.py", cli.cwd / "build" / "generated.py", cli.cwd / "other.py"]
+    cli.with_config(exclude_patterns=["build/"])
+    with patch("refine.cli.git.changed_files", return_value=changed) as mock_changed_files:
+        exitcode = cli.run("--since", "main", cli.cwd / "pkg", cli.cwd / "build")
+    assert exitcode == 0
+    assert mock_changed_files.call_args.kwargs == {"since": "main", "staged": False}
+    assert cli.processor.files == [cli.cwd / "pkg" / "changed.py"]
+
+
+def test_since_cli_flag_fails_on_git_errors(cli, caplog):
+    """
+    Test that --staged fails when git cannot list the changed files.
+    """
+    with patch("refine.cli.git.changed_files", side_effect=git.GitError("not a git repository")):
+        exitcode = cli.run("--staged")
+    assert exitcode == 1
+    assert "not a git repository" in caplog.text
@@ -1,49 +1,64 @@
 from __future__ import annotations
 
+import os
+
+import pytest
+
 from refine.cache import Cache
-from refine.cache import compute_context_key
+from refine.cache import CachedFailure
+from refine.cache import FileStat
+from refine.cache import compute_codemod_key
+from refine.cache import source_digest
 from refine.mods.cli.flags import CliDashes
 from refine.mods.cli.flags import CliDashesConfig
 from refine.mods.sql.fmt import FormatSQL
 from refine.mods.sql.fmt import FormatSQLConfig
 
+CODEMODS = {"cli-dashes-over-underscores": "key-1", "sqlfmt": "key-2"}
+
 
 def test_roundtrip(tmp_path):
-    cache = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    assert not cache.is_clean("a.py", "print(1)\n")
-    cache.mark_clean("a.py", "print(1)\n")
-    assert cache.is_clean("a.py", "print(1)\n")
+    cache = Cache.load(tmp_path / ".refine_cache")
+    assert not cache.is_clean("a.py", "print(1)\n", CODEMODS)
+    cache.mark_clean("a.py", "print(1)\n", CODEMODS)
+    assert cache.is_clean("a.py", "print(1)\n", CODEMODS)
     cache.dump()
 
-    reloaded = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    assert reloaded.is_clean("a.py", "print(1)\n")
+    reloaded = Cache.load(tmp_path / ".refine_cache")
+    assert reloaded.is_clean("a.py", "print(1)\n", CODEMODS)
 
 
 def test_content_change_invalidates(tmp_path):
-    cache = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    cache.mark_clean("a.py", "print(1)\n")
-    assert not cache.is_clean("a.py", "print(2)\n")
+    cache = Cache.load(tmp_path / ".refine_cache")
+    cache.mark_clean("a.py", "print(1)\n", CODEMODS)
+    assert not cache.is_clean("a.py", "print(2)\n", CODEMODS)
 
 
-def test_context_key_change_discards_everything(tmp_path):
-    cache = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    cache.mark_clean("a.py", "print(1)\n")
-    cache.dump()
+def test_clean_status_is_per_codemod(tmp_path):
+    cache = Cache.load(tmp_path / ".refine_cache")
+    cache.mark_clean("a.py", "print(1)\n", {"cli-dashes-over-underscores": "key-1"})
+    cache.mark_clean("a.py", "print(1)\n", {"sqlfmt": "key-2"})
+    assert cache.is_clean("a.py", "print(1)\n", CODEMODS)
+    # Reconfigured: only that codemod's clean status is gone.
+    assert cache.clean_codemods("a.py", source_digest("print(1)\n")) == CODEMODS
+    assert not cache.is_clean("a.py", "print(1)\n", {**CODEMODS, "sqlfmt": "key-3"})
+    assert cache.is_clean("a.py", "print(1)\n", {"cli-dashes-over-underscores": "key-1"})
 
-    reloaded = Cache.load(tmp_path / ".refine_cache", "ctx-2")
-    assert not reloaded.is_clean("a.py", "print(1)\n")
+    # A new content is no longer clean under the codemods the previous one was.
+    cache.mark_clean("a.py", "print(2)\n", {"sqlfmt": "key-2"})
+    assert cache.clean_codemods("a.py", source_digest("print(2)\n")) == {"sqlfmt": "key-2"}
 
 
 def test_corrupt_cache_file_is_treated_as_miss(tmp_path):
     cache_dir = tmp_path / ".refine_cache"
     cache_dir.mkdir()
     (cache_dir / "cache.msgpack").write_bytes(b"definitely not msgpack")
-    cache = Cache.load(cache_dir, "ctx-1")
-    assert not cache.is_clean("a.py", "print(1)\n")
+    cache = Cache.load(cache_dir)
+    assert not cache.is_clean("a.py", "print(1)\n", CODEMODS)
 
 
 def test_dump_writes_gitignore(tmp_path):
-    cache = Cache.load(tmp_path / ".refine_cache", "ctx-1")
+    cache = Cache.load(tmp_path / ".refine_cache")
     cache.dump()
     assert (tmp_path / ".refine_cache" / ".gitignore").read_text() == "*\n"
 
@@ -51,59 +66,205 @@ def test_dump_writes_gitignore(tmp_path):
 def test_dump_prunes_deleted_files(tmp_path):
     kept = tmp_path / "kept.py"
     kept.write_text("x = 1\n")
-    cache = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    cache.mark_clean(str(kept), "x = 1\n")
-    cache.mark_clean(str(tmp_path / "deleted.py"), "gone\n")
+    cache = Cache.load(tmp_path / ".refine_cache")
+    cache.mark_clean(str(kept), "x = 1\n", CODEMODS)
+    cache.mark_clean(str(tmp_path / "deleted.py"), "gone\n", CODEMODS)
     cache.dump()
 
-    reloaded = Cache.load(tmp_path / ".refine_cache", "ctx-1")
-    assert reloaded.is_clean(str(kept), "x = 1\n")
-    assert not reloaded.is_clean(str(tmp_path / "deleted.py"), "gone\n")
+    reloaded = Cache.load(tmp_path / ".refine_cache")
+    assert reloaded.is_clean(str(kept), "x = 1\n", CODEMODS)
+    assert not reloaded.is_clean(str(tmp_path / "deleted.py"), "gone\n", CODEMODS)
 
 
-def test_context_key_changes_with_config():
-    base = compute_context_key(
-        refine_version="1.0",
-        codemods=[CliDashes],
-        codemod_configs={"cli-dashes-over-underscores": CliDashesConfig()},
-    )
-    changed_config = compute_context_key(
-        refine_version="1.0",
-        codemods=[CliDashes],
-        codemod_configs={"cli-dashes-over-underscores": CliDashesConfig(exclude=["x/*"])},
-    )
-    changed_version = compute_context_key(
-        refine_version="1.1",
-        codemods=[CliDashes],
-        codemod_configs={"cli-dashes-over-underscores": CliDashesConfig()},
+def test_codemod_key_changes_with_config():
+    base = compute_codemod_key(refine_version="1.0", codemod=CliDashes, codemod_config=CliDashesConfig())
+    changed_config = compute_codemod_key(
+        refine_version="1.0", codemod=CliDashes, codemod_config=CliDashesConfig(exclude=["x/*"])
     )
+    changed_version = compute_codemod_key(refine_version="1.1", codemod=CliDashes, codemod_config=CliDashesConfig())
     assert base != changed_config
     assert base != changed_version
-    assert base == compute_context_key(
-        refine_version="1.0",
-        codemods=[CliDashes],
-        codemod_configs={"cli-dashes-over-underscores": CliDashesConfig()},
-    )
+    assert base == compute_codemod_key(refine_version="1.0", codemod=CliDashes, codemod_config=CliDashesConfig())
+    assert base != compute_codemod_key(refine_version="1.0", codemod=FormatSQL, codemod_config=FormatSQLConfig())
 
 
-def test_context_key_changes_with_referenced_config_file_contents(tmp_path):
+def test_codemod_key_changes_with_referenced_config_file_contents(tmp_path):
     sqlfluff_config = tmp_path / ".sqlfluff"
     sqlfluff_config.write_text("[sqlfluff]\nmax_line_length = 80\n")
 
     config = FormatSQLConfig(sqlfluff_config_file=str(sqlfluff_config))
-    key_before = compute_context_key(
-        refine_version="1.0",
-        codemods=[FormatSQL],
-        codemod_configs={"sqlfmt": config},
-    )
+    key_before = compute_codemod_key(refine_version="1.0", codemod=FormatSQL, codemod_config=config)
 
     # Editing the file's contents in place (path string unchanged) must
-    # invalidate the cache context key.
+    # invalidate the codemod key.
     sqlfluff_config.write_text("[sqlfluff]\nmax_line_length = 120\n")
-    key_after = compute_context_key(
-        refine_version="1.0",
-        codemods=[FormatSQL],
-        codemod_configs={"sqlfmt": config},
-    )
+    key_after = compute_codemod_key(refine_version="1.0", codemod=FormatSQL, codemod_config=config)
 
     assert key_before != key_after
+
+
+def test_durations_roundtrip(tmp_path):
+    cache = Cache.load(tmp_path / ".refine_cache")
+    assert cache.duration("a.py") is None
+    cache.record_duration("a.py", 1.5)
+    cache.dump()
+
+    reloaded = Cache.load(tmp_path / ".refine_cache")
+    assert reloaded.duration("a.py") == 1.5
+
+
+def test_source_digest_is_the_git_blob_id():
+    # `git hash-object` of the same contents.
+    assert source_digest("") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+    assert source_digest("print('hé')\n") == "cdc1b1a1c687489858da523f18707948eedc8c75"
+
+
+def test_clean_codemods(tmp_path):
+    cache = Cache.load(tmp_path)
+    cache.mark_clean("a.py", "x = 1\n", CODEMODS)
+    assert cache.clean_codemods("a.py", source_digest("x = 1\n")) == CODEMODS
+    assert cache.clean_codemods("a.py", source_digest("x = 2\n")) == {}
+    assert cache.clean_codemods("b.py", source_digest("x = 1\n")) == {}
+
+
+def test_stat_fast_path(tmp_path):
+    target = tmp_path / "a.py"
+    target.write_text("x = 1\n")
+    # Well before the cache file gets written.
+    os.utime(target, ns=(10**18, 10**18))
+    stat = FileStat.of(str(target))
+    cache = Cache.load(tmp_path / ".refine_cache")
+    cache.mark_clean(str(target), "x = 1\n", CODEMODS, stat)
+    cache.dump()
+
+    reloaded = Cache.load(tmp_path / ".refine_cache")
+    entry = reloaded.entry_for_stat(str(target), stat)
+    assert entry is not None
+    assert entry.digest == source_digest("x = 1\n")
+    assert entry.codemods == CODEMODS
+    assert (
+        reloaded.entry_for_stat(str(target), FileStat(size=stat.size + 1, mtime_ns=stat.mtime_ns, inode=stat.inode))
+        is None
+    )
+    assert (
+        reloaded.entry_for_stat(str(target), FileStat(size=stat.size, mtime_ns=stat.mtime_ns, inode=stat.inode + 1))
+        is None
+    )
+
+    # Marked clean without a stat: the stale one is forgotten.
+    reloaded.mark_clean(str(target), "x = 1\n", CODEMODS)
+    assert reloaded.entry_for_stat(str(target), stat) is None
+
+
+def test_racily_clean_stat_is_not_trusted(tmp_path):
+    target = tmp_path / "a.py"
+    target.write_text("x = 1\n")
+    cache = Cache.load(tmp_path / ".refine_cache")
+    cache.dump()
+    # Modified no earlier than the cache file was written: could change again unnoticed.
+    cache_mtime_ns = (tmp_path / ".refine_cache" / "cache.msgpack").stat().st_mtime_ns
+    os.utime(target, ns=(cache_mtime_ns, cache_mtime_ns))
+    stat = FileStat.of(str(target))
+    cache.mark_clean(str(target), "x = 1\n", CODEMODS, stat)
+    assert cache.entry_for_stat(str(target), stat) is None
+
+
+def test_sqlite_roundtrip(tmp_path):
+    cache = Cache.load(tmp_path / ".refine_cache", backend="sqlite")
+    assert not cache.is_clean("a.py", "print(1)\n", CODEMODS)
+    cache.mark_clean("a.py", "print(1)\n", CODEMODS)
+    cache.record_duration("a.py", 1.5)
+    assert cache.is_clean("a.py", "print(1)\n", CODEMODS)
+    cache.dump()
+
+    reloaded = Cache.load(tmp_path / ".refine_cache", backend="sqlite")
+    assert reloaded.is_clean("a.py", "print(1)\n", CODEMODS)
+    assert not reloaded.is_clean("a.py", "print(2)\n", CODEMODS)
+    assert not reloaded.is_clean("a.py", "print(1)\n", {**CODEMODS, "sqlfmt": "key-3"})
+    assert reloaded.duration("a.py") == 1.5
+    assert (tmp_path / ".refine_cache" / ".gitignore").read_text() == "*\n"
+
+
+def test_sqlite_concurrent_runs_keep_each_other_entries(tmp_path):
+    first = Cache.load(tmp_path / ".refine_cache", backend="sqlite")
+    second = Cache.load(tmp_path / ".refine_cache", backend="sqlite")
+    other_codemods = Cache.load(tmp_path / ".refine_cache", backend="sqlite")
+    first.mark_clean("a.py", "a = 1\n", CODEMODS)
+    second.mark_clean("b.py", "b = 1\n", CODEMODS)
+    other_codemods.mark_clean("a.py", "a = 1\n", {"other": "key-4"})
+    first.dump()
+    other_codemods.dump()
+    second.dump()
+
+    # Looked up live: no need to reload to see what the others wrote.
+    assert first.is_clean("b.py", "b = 1\n", CODEMODS)
+    assert second.is_clean("a.py", "a = 1\n", {**CODEMODS, "other": "key-4"})
+
+
+@pytest.mark.parametrize("backend", ["msgpack", "sqlite"])
+def test_stat_is_only_trusted_once_written(tmp_path, backend):
+    target = tmp_path / "a.py"
+    target.write_text("x = 1\n")
+    stat = FileStat.of(str(target))
+    cache = Cache.load(tmp_path / ".refine_cache", backend=backend)
+    cache.mark_clean(str(target), "x = 1\n", CODEMODS, stat)
+    assert cache.entry_for_stat(str(target), stat) is None
+
+    os.utime(target, ns=(10**18, 10**18))
+    stat = FileStat.of(str(target))
+    cache.mark_clean(str(target), "x = 1\n", CODEMODS, stat)
+    cache.dump()
+    assert cache.entry_for_stat(str(target), stat) is not None
+    assert Cache.load(tmp_path / ".refine_cache", backend=backend).entry_for_stat(str(target), stat) is not None
+
+
+def test_corrupt_sqlite_cache_falls_back_to_msgpack(tmp_path, caplog):
+    cache_dir = tmp_path / ".refine_cache"
+    cache_dir.mkdir()
+    (cache_dir / "cache.sqlite3").write_bytes(b"definitely not sqlite" * 100)
+    cache = Cache.load(cache_dir, backend="sqlite")
+    assert "using the msgpack one instead" in caplog.text
+    cache.mark_clean("a.py", "print(1)\n", CODEMODS)
+    cache.dump()
+    assert (cache_dir / "cache.msgpack").exists()
+
+
+@pytest.mark.parametrize("backend", ["msgpack", "sqlite"])
+def test_warnings_roundtrip(tmp_path, backend):
+    digest = source_digest("x = 1\n")
+    cache = Cache.load(tmp_path / ".refine_cache", backend=backend)
+    cache.mark_clean_digest("a.py", digest, CODEMODS, warnings={"sqlfmt": ["could not format a query"]})
+    cache.dump()
+
+    reloaded = Cache.load(tmp_path / ".refine_cache", backend=backend)
+    entry = reloaded.entry_for_digest("a.py", digest)
+    assert entry is not None
+    assert entry.warnings == {"sqlfmt": ["could not format a query"]}
+
+    # Marked clean again under the same keys: the warnings are kept.
+    reloaded.mark_clean_digest("a.py", digest, CODEMODS)
+    assert reloaded.entry_for_digest("a.py", digest).warnings == {"sqlfmt": ["could not format a query"]}
+    # Under another key, they are superseded.
+    reloaded.mark_clean_digest("a.py", digest, {**CODEMODS, "sqlfmt": "key-3"})
+    assert reloaded.entry_for_digest("a.py", digest).warnings == {}
+
+
+@pytest.mark.parametrize("backend", ["msgpack", "sqlite"])
+def test_failures_roundtrip(tmp_path, backend):
+    digest = source_digest("x = (\n")
+    failure = CachedFailure(codemods=CODEMODS, message="Syntax Error", traceback="Traceback ...\n")
+    cache = Cache.load(tmp_path / ".refine_cache", backend=backend)
+    cache.mark_clean_digest("a.py", digest, {"sqlfmt": "key-2"})
+    cache.mark_failed("a.py", digest, failure)
+    cache.dump()
+
+    reloaded = Cache.load(tmp_path / ".refine_cache", backend=backend)
+    entry = reloaded.entry_for_digest("a.py", digest)
+    assert entry is not None
+    assert entry.failure == failure
+    # Still clean under the codemods it was clean under.
+    assert entry.codemods == {"sqlfmt": "key-2"}
+
+    # Processed again, successfully: the failure is forgotten.
+    reloaded.mark_clean_digest("a.py", digest, CODEMODS)
+    assert reloaded.entry_for_digest("a.py", digest).failure is None
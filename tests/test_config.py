@@ -120,3 +120,10 @@ def test_config_from_pyproject_file_invalid(tmp_path):
     with pytest.raises(InvalidConfigError) as exc_info:
         Config.from_pyproject_file(pyproject_path)
     assert "Invalid configuration" in str(exc_info.value)
+
+
+def test_config_unconfigured_settings(tmp_path):
+    config_file = tmp_path / ".refine.toml"
+    config_file.write_text("process_pool_size = 3\n")
+    config = Config.from_default_file(config_file)
+    assert config.unconfigured({"process_pool_size": 7, "batch_size": 4}) == {"batch_size": 4}
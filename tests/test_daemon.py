@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import io
+import os
+import socket
+import stat
+
+import pytest
+
+from refine import daemon
+
+pytestmark = pytest.mark.skip_on_windows
+
+
+@pytest.fixture
+def running_daemon(tmp_path):
+    daemon.start(str(tmp_path), idle_timeout=120)
+    try:
+        yield tmp_path
+    finally:
+        daemon.stop(str(tmp_path))
+
+
+def test_forward_without_daemon_returns_none(tmp_path):
+    assert daemon.status(str(tmp_path)) is None
+    assert daemon.forward(["--hide-progress"], cwd=str(tmp_path)) is None
+
+
+def test_forwarded_runs_reuse_the_warm_processor(running_daemon):
+    target = running_daemon / "flags.py"
+    target.write_text('parser.add_argument("--dry_run")\n')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+
+    exitcode = daemon.forward(
+        ["--hide-progress", "--select=cli-dashes-over-underscores", str(target)],
+        cwd=str(running_daemon),
+        stdout=stdout,
+        stderr=stderr,
+    )
+
+    assert exitcode == 0
+    assert target.read_text() == 'parser.add_argument("--dry-run")\n'
+    assert "Successfully codemodded flags.py" in stderr.getvalue()
+
+    # A second run is served by the same daemon, and gets the exit code of the run.
+    broken = running_daemon / "broken.py"
+    broken.write_text('parser.add_argument("--dry_run"\n')
+    exitcode = daemon.forward(
+        ["--hide-progress", "--select=cli-dashes-over-underscores", str(broken)],
+        cwd=str(running_daemon),
+        stdout=stdout,
+        stderr=stderr,
+    )
+    assert exitcode == 1
+    assert "Failed to codemod broken.py" in stderr.getvalue()
+
+    status = daemon.status(str(running_daemon))
+    assert status is not None
+    assert status.runs == 2
+
+
+def test_version_mismatch_falls_back(running_daemon, monkeypatch):
+    monkeypatch.setattr(daemon, "__version__", "0.0.0.other")
+    assert daemon.forward(["--hide-progress"], cwd=str(running_daemon)) is None
+
+
+def test_start_refuses_a_second_daemon(running_daemon):
+    with pytest.raises(daemon.DaemonError, match="already serving"):
+        daemon.start(str(running_daemon))
+
+
+def test_stop(running_daemon):
+    assert daemon.stop(str(running_daemon)) is True
+    assert daemon.status(str(running_daemon)) is None
+    assert daemon.stop(str(running_daemon)) is False
+
+
+def test_socket_is_private_to_the_user(running_daemon):
+    path = daemon.socket_path(str(running_daemon))
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+
+
+def test_socket_directory_shared_with_others_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    (tmp_path / "refine").mkdir()
+    os.chmod(tmp_path / "refine", 0o755)  # noqa: S103
+
+    assert daemon.forward(["--hide-progress"], cwd=str(tmp_path)) is None
+    with pytest.raises(daemon.DaemonError, match="not a directory private to the current user"):
+        daemon.serve(str(tmp_path))
+
+
+def test_daemon_of_another_user_is_not_forwarded_to(running_daemon, monkeypatch):
+    monkeypatch.setattr(daemon, "_peer_uid", lambda *_: os.getuid() + 1)
+    assert daemon.forward(["--hide-progress"], cwd=str(running_daemon)) is None
+
+
+def test_only_the_needed_environment_is_forwarded(monkeypatch):
+    monkeypatch.setenv("PATH", "/usr/bin")
+    monkeypatch.setenv("GIT_INDEX_FILE", ".git/index")
+    monkeypatch.setenv("SOME_API_TOKEN", "secret")
+
+    env = daemon._forwarded_env()
+
+    assert env["PATH"] == "/usr/bin"
+    assert env["GIT_INDEX_FILE"] == ".git/index"
+    assert "SOME_API_TOKEN" not in env
+
+
+def test_terminating_a_run_does_not_report_it_as_a_success(tmp_path, monkeypatch):
+    def _killed(request, conn, state):
+        raise daemon._Terminated
+
+    monkeypatch.setattr(daemon, "_run", _killed)
+    server, client = socket.socketpair()
+    with server, client:
+        daemon._send(
+            client,
+            daemon._RunRequest(argv=["--hide-progress"], cwd=str(tmp_path), env={}, version=daemon.__version__),
+        )
+        # The daemon goes down rather than serving on...
+        with pytest.raises(daemon._Terminated):
+            daemon._handle(server, daemon._WarmState(str(tmp_path)))
+        # ... and the client is told the run did not succeed.
+        frame = daemon._frame_decoder.decode(daemon._recv(client))
+    assert frame == daemon._ExitFrame(code=143)
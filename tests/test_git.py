@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import shutil
+import subprocess
+
+import pytest
+
+from refine import git
+from refine.cache import source_digest
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def _git(repo, *args):
+    subprocess.run(  # noqa: S603
+        [shutil.which("git"), "-c", "user.name=refine", "-c", "user.email=refine@example.com", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """
+    A git repository with a first commit on ``main``.
+    """
+    _git(tmp_path, "init", "--initial-branch=main")
+    for name in ("kept.py", "modified.py", "renamed.py", "deleted.py", "README.md"):
+        (tmp_path / name).write_text(f"# {name}\n")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "commit", "-m", "Initial commit")
+    return tmp_path
+
+
+def test_changed_files_since_ref(repo):
+    _git(repo, "switch", "-c", "feature")
+    (repo / "modified.py").write_text("# modified\n")
+    _git(repo, "add", "modified.py")
+    _git(repo, "mv", "renamed.py", "new_name.py")
+    _git(repo, "rm", "deleted.py")
+    _git(repo, "commit", "-m", "Feature")
+    # Committed on main after the feature branch forked: not a change of the feature branch.
+    _git(repo, "switch", "main")
+    (repo / "kept.py").write_text("# changed on main\n")
+    _git(repo, "commit", "-am", "Main")
+    _git(repo, "switch", "feature")
+    # Not committed, staged or not, and untracked.
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "untracked.py").write_text("# untracked\n")
+    (repo / "staged.py").write_text("# staged\n")
+    _git(repo, "add", "staged.py")
+    (repo / "README.md").write_text("# not python\n")
+
+    assert sorted(git.changed_files(repo, since="main")) == [
+        repo / "modified.py",
+        repo / "new_name.py",
+        repo / "pkg" / "untracked.py",
+        repo / "staged.py",
+    ]
+    assert git.changed_files(repo, staged=True) == [repo / "staged.py"]
+    assert sorted(git.changed_files(repo, since="main", staged=True)) == [
+        repo / "modified.py",
+        repo / "new_name.py",
+        repo / "staged.py",
+    ]
+
+
+def test_changed_files_are_relative_to_repo_root(repo):
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "inside.py").write_text("# inside\n")
+    (repo / "modified.py").write_text("# modified\n")
+    assert git.changed_files(repo / "pkg", since="HEAD") == [repo / "pkg" / "inside.py"]
+
+
+def test_unknown_ref_raises(repo):
+    with pytest.raises(git.GitError, match="'git merge-base not-a-ref HEAD' failed"):
+        git.changed_files(repo, since="not-a-ref")
+
+
+def test_blob_ids_of_unmodified_tracked_files(repo):
+    (repo / "modified.py").write_text("# modified\n")
+    (repo / "untracked.py").write_text("# untracked\n")
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "inside.py").write_text("# inside\n")
+    _git(repo, "add", "pkg")
+
+    ids = git.blob_ids(repo)
+    assert sorted(ids) == [
+        str(repo / name) for name in ("README.md", "deleted.py", "kept.py", "pkg/inside.py", "renamed.py")
+    ]
+    assert ids[str(repo / "kept.py")] == source_digest("# kept.py\n")
+    assert git.blob_ids(repo / "pkg") == {str(repo / "pkg" / "inside.py"): source_digest("# inside\n")}
@@ -81,3 +81,40 @@ def test_golden_end_to_end(tmp_path, original, updated, codemod_name):
 
     assert result.failures == 0
     assert target.read_text() == _dedent(updated)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process", "interpreter"])
+def test_golden_parity_across_executors(tmp_path, executor):
+    # test_golden_end_to_end covers the sync executor, one file at a time.
+    # Here every case of a codemod runs at once, so the pool executors do get parallel work.
+    # The interpreter executor falls back to the process one where subinterpreters
+    # cannot run the codemods; the output must not change either way.
+    for codemod_name in sorted({case.values[2] for case in _CASES}):
+        workdir = tmp_path / codemod_name
+        workdir.mkdir()
+        expected = {}
+        for original, updated, case_codemod_name in (case.values for case in _CASES):
+            if case_codemod_name != codemod_name:
+                continue
+            target = workdir / original.name
+            target.write_text(_dedent(original))
+            expected[target] = _dedent(updated)
+
+        registry = Registry()
+        registry.load([])
+        codemods = list(registry.codemods(select_codemods=[codemod_name]))
+        config = Config.from_dict(
+            {
+                "repo_root": str(workdir),
+                "process_pool_size": 2,
+                "executor": executor,
+                "hide_progress": True,
+                "cache": False,
+                "sqlfmt": {"backend": "sqlfluff", "dialect": "mysql"},
+            }
+        )
+        result = Processor(config=config, registry=registry, codemods=codemods).process(list(expected))
+
+        assert result.failures == 0
+        for target, expected_content in expected.items():
+            assert target.read_text() == expected_content, f"{executor}: mismatch for {target.name}"
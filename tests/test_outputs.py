@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import os
+
+from refine.cache import source_digest
+from refine.outputs import OutputStore
+from refine.outputs import output_key
+
+
+def test_roundtrip(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_size=0)
+    key = output_key(["key-1"], "pkg/mod.py", source_digest("x=1\n"))
+    assert store.load(key) is None
+    store.store(key, "x = 1\n")
+    assert store.load(key) == "x = 1\n"
+    assert OutputStore(tmp_path / "outputs", max_size=0).load(key) == "x = 1\n"
+
+
+def test_output_key_depends_on_every_input():
+    digest = source_digest("x=1\n")
+    key = output_key(["key-1", "key-2"], "mod.py", digest)
+    assert key == output_key(["key-1", "key-2"], "mod.py", digest)
+    assert key != output_key(["key-2", "key-1"], "mod.py", digest)
+    assert key != output_key(["key-1"], "mod.py", digest)
+    assert key != output_key(["key-1", "key-2"], "other.py", digest)
+    assert key != output_key(["key-1", "key-2"], "mod.py", source_digest("x=2\n"))
+
+
+def test_outputs_are_stored_once(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_size=0)
+    store.store("a" * 64, "x = 1\n")
+    store.store("b" * 64, "x = 1\n")
+    assert len(list((tmp_path / "outputs" / "objects").rglob("*"))) == 2  # A bucket and its object
+    assert store.load("a" * 64) == store.load("b" * 64) == "x = 1\n"
+
+
+def test_corrupted_outputs_are_misses(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_size=0)
+    store.store("a" * 64, "x = 1\n")
+    digest = source_digest("x = 1\n")
+    (tmp_path / "outputs" / "objects" / digest[:2] / digest[2:]).write_text("x = 2\n")
+    assert store.load("a" * 64) is None
+
+
+def test_prune_evicts_the_least_recently_used(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_size=0)
+    for idx in range(10):
+        store.store(f"{idx:064x}", f"value = {'x' * 100}{idx}\n")
+    for path in (tmp_path / "outputs").rglob("*"):
+        if path.is_file():
+            os.utime(path, ns=(10**18, 10**18))
+    # Used since: kept.
+    assert store.load(f"{9:064x}") is not None
+
+    store.max_size = 1000
+    assert store.prune() > 0
+    sizes = sum(path.stat().st_size for path in (tmp_path / "outputs").rglob("*") if path.is_file())
+    assert sizes <= 1000
+    assert store.load(f"{9:064x}") is not None
+    assert store.load(f"{0:064x}") is None
+
+
+def test_unbounded_store_is_never_pruned(tmp_path):
+    store = OutputStore(tmp_path / "outputs", max_size=0)
+    store.store("a" * 64, "x = 1\n")
+    assert store.prune() == 0
+    assert store.load("a" * 64) == "x = 1\n"
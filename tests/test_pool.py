@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import os
+import time
+from collections.abc import Iterator
+
+import pytest
+
+from refine.pool import WorkerError
+from refine.pool import WorkerPool
+from refine.pool import WorkerTimeoutError
+from refine.processor import _get_pool_context
+
+_OFFSET = 0
+
+
+def _set_offset(offset: int) -> None:
+    global _OFFSET  # noqa: PLW0603
+    _OFFSET = offset
+
+
+def _handle(request: list[int]) -> list[int]:
+    if request == [-1]:
+        error = "boom"
+        raise ValueError(error)
+    if request == [-2]:
+        os._exit(3)
+    return [value * 2 + _OFFSET for value in request]
+
+
+def _stream(request: list[int]) -> Iterator[int]:
+    for value in request:
+        if value < 0:
+            time.sleep(60)
+        yield value
+
+
+def _stuck_after_the_last_item(request: list[int]) -> Iterator[int]:
+    yield from request
+    time.sleep(60)
+
+
+def _pid(_request: list[int]) -> list[int]:
+    return [os.getpid()]
+
+
+@pytest.fixture
+def pool():
+    with WorkerPool(
+        workers=2,
+        mp_context=_get_pool_context(),
+        handler=_handle,
+        request_type=list[int],
+        response_type=int,
+        initializer=_set_offset,
+        initargs=(1,),
+    ) as pool:
+        yield pool
+
+
+def test_requests_are_handled_by_initialized_workers(pool):
+    futures = [pool.submit([idx, idx + 1]) for idx in range(10)]
+    assert [future.result(timeout=60) for future in futures] == [[idx * 2 + 1, idx * 2 + 3] for idx in range(10)]
+
+
+def test_handler_errors_are_reported_with_their_traceback(pool):
+    with pytest.raises(WorkerError, match="ValueError: boom") as excinfo:
+        pool.submit([-1]).result(timeout=60)
+    assert "Traceback (most recent call last)" in str(excinfo.value)
+    # The worker is still serving requests.
+    assert pool.submit([1]).result(timeout=60) == [3]
+
+
+def test_dead_workers_are_replaced(pool):
+    with pytest.raises(WorkerError, match=r"died \(exit code 3\)"):
+        pool.submit([-2]).result(timeout=60)
+    assert pool.submit([1]).result(timeout=60) == [3]
+
+
+def test_shutdown_can_cancel_pending_requests():
+    pool = WorkerPool(
+        workers=1,
+        mp_context=_get_pool_context(),
+        handler=_handle,
+        request_type=list[int],
+        response_type=int,
+    )
+    futures = [pool.submit([idx]) for idx in range(50)]
+    pool.shutdown(wait=True, cancel_futures=True)
+    assert any(future.cancelled() for future in futures)
+    assert all(future.result() == [idx * 2] for idx, future in enumerate(futures) if not future.cancelled())
+    with pytest.raises(RuntimeError):
+        pool.submit([1])
+
+
+def test_stuck_workers_are_killed_and_replaced():
+    with WorkerPool(
+        workers=1,
+        mp_context=_get_pool_context(),
+        handler=_stream,
+        request_type=list[int],
+        response_type=int,
+        item_timeout=1,
+    ) as pool:
+        started = time.monotonic()
+        with pytest.raises(WorkerTimeoutError, match="more than 1s on a single item") as excinfo:
+            pool.submit([1, 2, -1, 3]).result(timeout=60)
+        assert time.monotonic() - started < 30
+        # What the worker produced before getting stuck is kept.
+        assert excinfo.value.partial == [1, 2]
+        assert pool.submit([4, 5]).result(timeout=60) == [4, 5]
+
+
+def test_workers_stuck_after_the_last_item_are_killed():
+    with WorkerPool(
+        workers=1,
+        mp_context=_get_pool_context(),
+        handler=_stuck_after_the_last_item,
+        request_type=list[int],
+        response_type=int,
+        item_timeout=1,
+    ) as pool:
+        with pytest.raises(WorkerTimeoutError) as excinfo:
+            pool.submit([1, 2]).result(timeout=60)
+        # Every item got sent back before the worker got stuck.
+        assert excinfo.value.partial == [1, 2]
+
+
+@pytest.mark.parametrize(("max_rss", "recycled"), [(1, 3), (None, 0)])
+def test_workers_past_max_rss_are_recycled(max_rss, recycled):
+    with WorkerPool(
+        workers=1,
+        mp_context=_get_pool_context(),
+        handler=_pid,
+        request_type=list[int],
+        response_type=int,
+        max_rss=max_rss,
+    ) as pool:
+        pids = {pool.submit([]).result(timeout=60)[0] for _ in range(3)}
+        (stats,) = pool.stats()
+    assert len(pids) == (3 if recycled else 1)
+    assert stats.recycled == recycled
+    assert stats.peak_rss > 0
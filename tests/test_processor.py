@@ -1,23 +1,39 @@
 from __future__ import annotations
 
+import collections
 import logging
+import os
 import pathlib
+import pickle
 import shutil
+import subprocess
 import sys
+import time
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import libcst
+import msgspec
 import pytest
 
+from refine.abc import BaseCodemod
+from refine.abc import BaseConfig
+from refine.cache import source_digest
 from refine.config import Config
 from refine.exc import RefineSystemExit
 from refine.mods.cli.flags import CliDashes
 from refine.mods.sql import sqruff_backend
+from refine.pool import WorkerTimeoutError
 from refine.processor import Processor
+from refine.processor import _Batcher
 from refine.processor import _compute_jobs
+from refine.processor import _FileResult
 from refine.processor import _get_pool_context
+from refine.processor import _ResultTally
+from refine.processor import _Work
 from refine.registry import Registry
+from refine.writeback import commit
+from refine.writeback import stage
 
 log = logging.getLogger(__name__)
 
@@ -41,6 +57,14 @@ def test_write_file_exception(tmp_path, subtests):
     config = MagicMock()
     config.repo_root = tmp_path
     config.process_pool_size = 1
+    config.ingest_concurrency = 1
+    config.batch_size = 0
+    config.codemod_timeout = 0
+    config.profile = 0
+    config.trace_file = ""
+    config.check = False
+    config.diff = False
+    config.resolved_cache_dir.return_value = tmp_path / ".refine_cache"
     config.__remaining_config__ = {}
 
     registry = MagicMock()
@@ -98,6 +122,7 @@ def test_process_zero_files_raises():
     config.repo_root = "."
     config.process_pool_size = 1
     config.hide_progress = True
+    config.cache = False
     config.__remaining_config__ = {}
 
     registry = MagicMock()
@@ -210,7 +235,8 @@ def test_config_excluded_file_is_never_parsed(tmp_path, monkeypatch):
     assert target.read_text() == 'parser.add_argument("--dry_run")\n'
 
 
-def test_second_run_hits_cache_and_skips_parsing(tmp_path, monkeypatch):
+@pytest.mark.parametrize("backend", ["msgpack", "sqlite"])
+def test_second_run_hits_cache_and_skips_parsing(tmp_path, monkeypatch, backend):
     target = tmp_path / "sql.py"
     target.write_text('QUERY = "SELECT a FROM b"\n')
 
@@ -218,11 +244,13 @@ def test_second_run_hits_cache_and_skips_parsing(tmp_path, monkeypatch):
     registry.load([])
     codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
 
-    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True})
+    config = Config.from_dict(
+        {"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True, "cache_backend": backend}
+    )
 
     # First run: processes (or gates) the file and records it clean.
     Processor(config=config, registry=registry, codemods=codemods).process([target])
-    assert (tmp_path / ".refine_cache" / "cache.msgpack").exists()
+    assert (tmp_path / ".refine_cache" / f"cache.{'sqlite3' if backend == 'sqlite' else backend}").exists()
 
     parse_calls = []
     real_parse = libcst.parse_module
@@ -249,6 +277,73 @@ def test_second_run_hits_cache_and_skips_parsing(tmp_path, monkeypatch):
     assert gate_calls == []
 
 
+@pytest.mark.parametrize("paranoid", [False, True], ids=["stat", "paranoid"])
+def test_unchanged_files_are_not_read_again(tmp_path, monkeypatch, paranoid):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text(f"value = {idx}\n")
+        # Well before the cache file gets written, so their stat can be trusted.
+        os.utime(target, ns=(10**18, 10**18))
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True, "cache_paranoid": paranoid}
+    )
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    # Touched, but not changed.
+    os.utime(targets[0], ns=(2 * 10**18, 2 * 10**18))
+    opened = []
+    real_open = open
+
+    def counting_open(file, *args, **kwargs):
+        opened.append(file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("refine.processor.open", counting_open, raising=False)
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+    assert result.successes == 3
+    assert opened == [str(target) for target in targets] if paranoid else [str(targets[0])]
+
+
+def test_added_codemod_only_runs_its_own_work(tmp_path, monkeypatch):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text(f'parser.add_argument("--value-{idx}")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True})
+    cli_dashes = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    Processor(config=config, registry=registry, codemods=cli_dashes).process(targets)
+
+    gated = []
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores", "sqlfmt"]))
+    for codemod in codemods:
+
+        def counting_gate(source, filename, *, name=codemod.NAME, gate=codemod.should_process):
+            gated.append(name)
+            return gate(source, filename)
+
+        monkeypatch.setattr(codemod, "should_process", counting_gate)
+
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    result = processor.process(targets)
+    assert result.successes == 3
+    assert gated == ["sqlfmt"] * 3
+
+    # Both are now known clean: nothing left to gate.
+    gated.clear()
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+    assert gated == []
+
+
 def test_no_cache_config_disables_cache(tmp_path):
     target = tmp_path / "plain.py"
     target.write_text("x = 1\n")
@@ -278,7 +373,7 @@ def test_process_pool_size_zero_with_work_raises(tmp_path):
         processor.process([target])
 
 
-def test_warned_results_are_not_cached(tmp_path, monkeypatch):
+def test_warned_results_are_replayed_from_the_cache(tmp_path, monkeypatch, capsys):
     monkeypatch.setattr(sqruff_backend, "format_sql", lambda *_args, **_kwargs: None)
 
     target = tmp_path / "sql.py"
@@ -291,10 +386,37 @@ def test_warned_results_are_not_cached(tmp_path, monkeypatch):
 
     result = Processor(config=config, registry=registry, codemods=codemods).process([target])
     assert result.warnings > 0
+    warnings = capsys.readouterr().err
+    assert "WARNING: " in warnings
+
+    parse_calls = []
+    real_parse = libcst.parse_module
+
+    def counting_parse(*args, **kwargs):
+        parse_calls.append(args)
+        return real_parse(*args, **kwargs)
 
-    # Second run must NOT be a cache hit: the gate/codemod must run again (warn again).
+    monkeypatch.setattr("refine.processor.cst.parse_module", counting_parse)
+
+    # Second run: a cache hit, still reporting (and counting) the same warnings.
     result2 = Processor(config=config, registry=registry, codemods=codemods).process([target])
-    assert result2.warnings > 0
+    assert parse_calls == []
+    assert result2.warnings == result.warnings
+    assert capsys.readouterr().err == warnings
+
+    # Another codemod added: only it runs, the cached warnings are reported along with its own.
+    codemods = list(registry.codemods(select_codemods=["sqlfmt", "cli-dashes-over-underscores"]))
+    added = next(codemod for codemod in codemods if codemod.NAME == "cli-dashes-over-underscores")
+    monkeypatch.setattr(added, "should_process", lambda *_args: True)
+    result3 = Processor(config=config, registry=registry, codemods=codemods).process([target])
+    assert len(parse_calls) == 1
+    assert result3.warnings == result.warnings
+
+    # The warnings are still cached under both codemods.
+    parse_calls.clear()
+    result4 = Processor(config=config, registry=registry, codemods=codemods).process([target])
+    assert parse_calls == []
+    assert result4.warnings == result.warnings
 
 
 @pytest.mark.skip_on_windows
@@ -328,3 +450,846 @@ def test_fail_fast_stops_before_later_files(tmp_path):
     assert result.changed == 0
     # fail_fast stopped before the valid file was transformed/written.
     assert valid.read_text() == 'parser.add_argument("--dry_run")\n'
+
+
+def test_process_streams_files_lazily(tmp_path):
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+
+    targets = []
+    for idx in range(12):
+        target = tmp_path / f"flags{idx:02d}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    rewritten_when_pulled = []
+
+    def discover():
+        for target in targets:
+            rewritten_when_pulled.append(
+                sum(path.read_text() == 'parser.add_argument("--dry-run")\n' for path in targets)
+            )
+            yield target
+            # Duplicates are only processed once
+            yield target
+
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True})
+    result = Processor(config=config, registry=registry, codemods=codemods).process(discover())
+
+    assert result.failures == 0
+    assert result.changed == len(targets)
+    # Files were already being written back while later ones were still being discovered.
+    assert rewritten_when_pulled[0] == 0
+    assert rewritten_when_pulled[-1] > 0
+
+
+def test_parallel_ingestion_matches_serial_ingestion(tmp_path):
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+
+    targets = []
+    for idx in range(20):
+        target = tmp_path / f"file{idx:02d}.py"
+        # Every other file needs no transform and is gated out during ingestion.
+        target.write_text('parser.add_argument("--dry_run")\n' if idx % 2 else "x = 1\n")
+        targets.append(target)
+
+    config = Config.from_dict(
+        {"repo_root": str(tmp_path), "process_pool_size": 1, "ingest_concurrency": 4, "hide_progress": True}
+    )
+    started = time.perf_counter()
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+    elapsed = time.perf_counter() - started
+
+    assert result.failures == 0
+    assert result.successes == 20
+    assert result.changed == 10
+    for idx, target in enumerate(targets):
+        expected = 'parser.add_argument("--dry-run")\n' if idx % 2 else "x = 1\n"
+        assert target.read_text() == expected
+    # Ingestion and transform throughput are reported separately.
+    assert result.ingestion is not None
+    assert result.ingestion.files == 20
+    assert result.ingestion.workers == 4
+    # The wall-clock time ingestion spanned, within the run's.
+    assert 0 < result.ingestion.seconds <= elapsed
+    assert result.transform is not None
+    assert result.transform.files == 10
+    assert result.transform.files_per_second > 0
+
+
+def _work(name: str, size: int) -> _Work:
+    return _Work(filename=name, source="x" * size, codemod_names=())
+
+
+def test_batcher_fixed_size():
+    batcher = _Batcher(size=3)
+    batches = list(batcher.batches(iter([_work(f"f{idx}", 10_000_000) for idx in range(7)])))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_batcher_adapts_to_worker_latency():
+    batcher = _Batcher(size=0)
+    # Initially, batches are cut at 16KiB of source.
+    batches = list(batcher.batches(iter([_work(f"f{idx}", 4096) for idx in range(8)])))
+    assert [len(batch) for batch in batches] == [4, 4]
+    # Slow workers shrink the batches, down to a single file.
+    batcher.observe(4096, 1.0)
+    batches = list(batcher.batches(iter([_work(f"f{idx}", 4096) for idx in range(3)])))
+    assert [len(batch) for batch in batches] == [1, 1, 1]
+    # Fast workers grow them, up to the file count cap.
+    for _ in range(20):
+        batcher.observe(10_000_000, 0.01)
+    batches = list(batcher.batches(iter([_work(f"f{idx}", 10) for idx in range(100)])))
+    assert [len(batch) for batch in batches] == [64, 36]
+
+
+def test_fail_fast_stops_within_a_batch(tmp_path, monkeypatch):
+    # Force a thread pool (as on free-threaded builds) running a single batch
+    # of four files, the broken one first: it is the largest, so it is deemed
+    # the most expensive and dispatched first.
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+    broken = tmp_path / "aaa_broken.py"
+    broken.write_text('# A rather long comment making this the largest file.\nparser.add_argument("--dry_run"\n')
+    valid = []
+    for idx in range(3):
+        target = tmp_path / f"zzz_valid{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        valid.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "batch_size": 4,
+            "hide_progress": True,
+            "fail_fast": True,
+            "cache": False,
+        }
+    )
+    with patch("refine.processor._print_parallel_result", MagicMock()):
+        result = Processor(config=config, registry=registry, codemods=codemods).process([broken, *valid])
+
+    assert result.failures == 1
+    assert result.successes == 0
+    assert result.changed == 0
+    for target in valid:
+        assert target.read_text() == 'parser.add_argument("--dry_run")\n'
+
+
+def test_batched_run_accounts_every_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+    targets = []
+    for idx in range(30):
+        target = tmp_path / f"file{idx:02d}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, "hide_progress": True})
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.successes == 30
+    assert result.changed == 30
+    assert result.transform is not None
+    assert result.transform.files == 30
+    for target in targets:
+        assert target.read_text() == 'parser.add_argument("--dry-run")\n'
+
+
+def test_work_is_dispatched_most_expensive_first(tmp_path):
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    assert processor.cache is not None
+    # A previous run found the small file to be the slowest one.
+    processor.cache.record_duration("small.py", 10.0)
+
+    work_items = [
+        _Work(filename="medium.py", source="x" * 100, codemod_names=("a",)),
+        _Work(filename="large.py", source="x" * 1000, codemod_names=("a",)),
+        _Work(filename="small.py", source="x", codemod_names=("a",)),
+        _Work(filename="many-codemods.py", source="x" * 400, codemod_names=("a", "b", "c")),
+    ]
+    ordered = [work.filename for work in processor._by_cost(iter(work_items), "process")]
+    assert ordered == ["small.py", "many-codemods.py", "large.py", "medium.py"]
+    # A single worker keeps the stream order.
+    ordered = [work.filename for work in processor._by_cost(iter(work_items), "sync")]
+    assert ordered == ["medium.py", "large.py", "small.py", "many-codemods.py"]
+
+
+def test_transform_durations_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, "_is_gil_enabled", lambda: False, raising=False)
+    targets = []
+    for idx in range(4):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, "hide_progress": True})
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    assert processor.cache is not None
+    for target in targets:
+        duration = processor.cache.duration(str(target))
+        assert duration is not None
+        assert duration > 0
+
+
+@pytest.mark.parametrize("executor", ["sync", "process"])
+def test_profile_times_every_phase(tmp_path, executor):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+    gated_out = tmp_path / "gated_out.py"
+    gated_out.write_text("x = 1\n")
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "executor": executor,
+            "profile": 2,
+            "hide_progress": True,
+        }
+    )
+    result = Processor(config=config, registry=registry, codemods=codemods).process([*targets, gated_out])
+
+    assert result.changed == 3
+    assert result.profile is not None
+    report = result.profile.render(slowest=2)
+    for phase in (
+        "read",
+        "cache",
+        "gate",
+        "parse",
+        "metadata",
+        "codemod:cli-dashes-over-underscores",
+        "codegen",
+        "write",
+    ):
+        assert phase in report
+    assert "Profile of 4 files:" in report
+    assert "Slowest 2 files:" in report
+
+
+def test_trace_file_has_a_track_per_worker(tmp_path):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    trace_file = tmp_path / "trace.json"
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "executor": "process",
+            "trace_file": str(trace_file),
+            "hide_progress": True,
+        }
+    )
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.changed == 3
+    events = msgspec.json.decode(trace_file.read_bytes())["traceEvents"]
+    names_by_pid: dict[int, set[str]] = {}
+    for event in events:
+        if event["ph"] == "X":
+            names_by_pid.setdefault(event["pid"], set()).add(event["name"])
+    parent = names_by_pid.pop(os.getpid())
+    assert {"ingest", "read", "gate", "start worker", "dispatch", "wait", "account"} <= parent
+    assert names_by_pid
+    for worker in names_by_pid.values():
+        assert {"transform", "parse", "codemod:cli-dashes-over-underscores", "codegen", "write"} <= worker
+
+
+def test_pool_workers_do_not_receive_the_cache(tmp_path):
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    assert processor.cache is not None
+    for idx in range(1000):
+        processor.cache.mark_clean(f"file{idx}.py", "x = 1\n", processor.codemod_keys)
+
+    worker_processor = pickle.loads(pickle.dumps(processor))  # noqa: S301
+    assert worker_processor.cache is None
+    assert worker_processor.registry is None
+    assert worker_processor.codemods_by_name == processor.codemods_by_name
+    # The parent side processor is left untouched.
+    assert processor.cache.is_clean("file0.py", "x = 1\n", processor.codemod_keys)
+
+
+def test_worker_results_carry_a_digest_rather_than_the_code(tmp_path):
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+
+    clean_source = "".join(f'parser.add_argument("--option-{idx}")\n' for idx in range(200))
+    clean = tmp_path / "clean.py"
+    clean.write_text(clean_source)
+    dirty = tmp_path / "dirty.py"
+    dirty.write_text('parser.add_argument("--dry_run")\n')
+    names = (CliDashes.NAME,)
+    clean_result, dirty_result = processor._process_batch(
+        None,
+        [
+            _Work(filename=str(clean), source=clean_source, codemod_names=names),
+            _Work(filename=str(dirty), source=dirty.read_text(), codemod_names=names),
+        ],
+    )
+
+    assert clean_result.status == "success"
+    assert not clean_result.changed
+    assert clean_result.digest == source_digest(clean_source)
+    assert len(msgspec.msgpack.encode(clean_result)) < len(clean_source) // 10
+    assert dirty_result.status == "success"
+    assert dirty_result.changed
+    assert dirty_result.digest is None
+
+
+def test_failures_are_reported_with_their_traceback(tmp_path, capsys):
+    broken = tmp_path / "broken.py"
+    broken.write_text('parser.add_argument("--dry_run"\n')
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    result = Processor(config=config, registry=registry, codemods=codemods).process([broken])
+
+    assert result.failures == 1
+    stderr = capsys.readouterr().err
+    assert "Traceback (most recent call last)" in stderr
+    assert "ParserSyntaxError" in stderr
+    assert "Failed to codemod broken.py" in stderr
+
+
+def test_known_failures_are_replayed_without_parsing(tmp_path, monkeypatch, capsys):
+    broken = tmp_path / "broken.py"
+    broken.write_text('parser.add_argument("--dry_run"\n')
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    assert Processor(config=config, registry=registry, codemods=codemods).process([broken]).failures == 1
+    stderr = capsys.readouterr().err
+
+    parse_calls = []
+    real_parse = libcst.parse_module
+
+    def counting_parse(*args, **kwargs):
+        parse_calls.append(args)
+        return real_parse(*args, **kwargs)
+
+    monkeypatch.setattr("refine.processor.cst.parse_module", counting_parse)
+
+    # Same content, same codemods: the same failure, without parsing the file again.
+    assert Processor(config=config, registry=registry, codemods=codemods).process([broken]).failures == 1
+    assert parse_calls == []
+    assert capsys.readouterr().err == stderr
+
+    retry_config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True, "retry_failures": True})
+    assert Processor(config=retry_config, registry=registry, codemods=codemods).process([broken]).failures == 1
+    assert len(parse_calls) == 1
+
+    # Fixed: processed again.
+    broken.write_text('parser.add_argument("--dry_run")\n')
+    result = Processor(config=config, registry=registry, codemods=codemods).process([broken])
+    assert result.failures == 0
+    assert result.changed == 1
+    assert len(parse_calls) == 2
+
+
+def test_interpreter_executor_falls_back_to_processes(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr("refine.processor._probe_interpreter", lambda _modules: False)
+    monkeypatch.setattr("refine.processor._INTERPRETER_SAFE", {})
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, "executor": "interpreter"})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+
+    with caplog.at_level(logging.WARNING):
+        pool_kind, jobs, _, _ = processor._plan_dispatch(2, 8, run_prefetched=True)
+    assert (pool_kind, jobs) == ("process", 2)
+    assert "falling back to the process executor" in caplog.text
+
+    # Explicitly synchronous, whatever the number of jobs.
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, "executor": "sync"})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    pool_kind, jobs, _, _ = processor._plan_dispatch(2, 8, run_prefetched=True)
+    assert (pool_kind, jobs) == ("sync", 1)
+
+
+@pytest.mark.parametrize("setting", [{"file_timeout": 30}, {"worker_max_rss": 512}])
+def test_worker_supervision_needs_the_process_executor(tmp_path, monkeypatch, caplog, setting):
+    monkeypatch.setattr("refine.processor._probe_interpreter", lambda _modules: True)
+    monkeypatch.setattr("refine.processor._INTERPRETER_SAFE", {})
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+
+    # Even for a single job, or where subinterpreters would do.
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, **setting})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    assert processor._plan_dispatch(1, 1, run_prefetched=True)[:2] == ("process", 1)
+    assert processor._plan_dispatch(2, 8, run_prefetched=True)[:2] == ("process", 2)
+
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 2, "executor": "thread", **setting})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    with caplog.at_level(logging.WARNING):
+        assert processor._plan_dispatch(2, 8, run_prefetched=True)[0] == "thread"
+    assert "enforces neither file_timeout nor worker_max_rss" in caplog.text
+
+
+class SleepyCodemod(BaseCodemod):
+    """
+    Sleeps on files asking for it, standing in for a runaway transform.
+    """
+
+    NAME = "sleepy"
+    CONFIG_CLS = BaseConfig
+
+    def leave_Module(self, original_node: libcst.Module, updated_node: libcst.Module) -> libcst.Module:  # noqa: N802
+        if "# sleep" in original_node.code:
+            time.sleep(60)
+        return updated_node
+
+
+class FailingCodemod(BaseCodemod):
+    """
+    Raises the exception its test asks for, standing in for a codemod calling an external tool.
+    """
+
+    NAME = "failing"
+    CONFIG_CLS = BaseConfig
+    EXCEPTION: Exception = OSError("sqruff: not found")
+
+    def leave_Module(self, original_node: libcst.Module, updated_node: libcst.Module) -> libcst.Module:  # noqa: N802, ARG002
+        raise self.EXCEPTION
+
+
+@pytest.mark.parametrize(
+    "exception",
+    [OSError("sqruff: not found"), subprocess.CalledProcessError(1, ["sqruff"])],
+    ids=["os-error", "called-process-error"],
+)
+def test_environment_failures_are_not_cached(tmp_path, monkeypatch, exception):
+    target = tmp_path / "mod.py"
+    target.write_text("x = 1\n")
+    monkeypatch.setattr(FailingCodemod, "EXCEPTION", exception)
+
+    registry = Registry()
+    registry.load([])
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True})
+    assert Processor(config=config, registry=registry, codemods=[FailingCodemod]).process([target]).failures == 1
+
+    parse_calls = []
+    real_parse = libcst.parse_module
+
+    def counting_parse(*args, **kwargs):
+        parse_calls.append(args)
+        return real_parse(*args, **kwargs)
+
+    monkeypatch.setattr("refine.processor.cst.parse_module", counting_parse)
+    assert Processor(config=config, registry=registry, codemods=[FailingCodemod]).process([target]).failures == 1
+    assert len(parse_calls) == 1
+
+
+def _sleepy_codemods():
+    registry = Registry()
+    registry.load([])
+    return registry, [SleepyCodemod, *registry.codemods(select_codemods=["cli-dashes-over-underscores"])]
+
+
+@pytest.mark.skip_on_windows
+def test_stuck_worker_is_replaced_and_the_run_carries_on(tmp_path):
+    # The stuck file is the largest, so it goes first in the only batch; the
+    # files after it are dispatched again to the replacement worker.
+    stuck = tmp_path / "stuck.py"
+    stuck.write_text('# sleep, and take a while doing it\nparser.add_argument("--dry_run")\n')
+    others = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        others.append(target)
+
+    registry, codemods = _sleepy_codemods()
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "executor": "process",
+            "batch_size": 4,
+            "file_timeout": 2,
+            "hide_progress": True,
+        }
+    )
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    started = time.monotonic()
+    with patch("refine.processor._print_parallel_result", MagicMock()):
+        result = processor.process([stuck, *others])
+
+    assert time.monotonic() - started < 30
+    assert result.failures == 1
+    assert result.successes == 3
+    assert result.changed == 3
+    for target in others:
+        assert target.read_text() == 'parser.add_argument("--dry-run")\n'
+    assert "--dry_run" in stuck.read_text()
+    # The timeout is remembered, so the file is dispatched first next time.
+    assert processor.cache is not None
+    assert processor.cache.duration(str(stuck)) == 2
+
+
+def test_worker_timing_out_after_the_last_file_fails_none(tmp_path):
+    registry, codemods = _sleepy_codemods()
+    config = Config.from_dict({"repo_root": str(tmp_path), "executor": "process", "file_timeout": 2})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    batch = [_Work(filename=f"file{idx}.py", source="", codemod_names=("sleepy",)) for idx in range(2)]
+    partial = [_FileResult(filename=work.filename, status="success") for work in batch]
+    leftovers: collections.deque[list[_Work]] = collections.deque()
+
+    results = processor._timed_out(batch, WorkerTimeoutError("killed", partial=partial), leftovers)
+
+    assert results == partial
+    assert not leftovers
+
+
+@pytest.mark.skip_on_windows
+def test_codemod_timeout_fails_the_file(tmp_path):
+    stuck = tmp_path / "stuck.py"
+    stuck.write_text("# sleep\n")
+    registry, codemods = _sleepy_codemods()
+    config = Config.from_dict(
+        {"repo_root": str(tmp_path), "executor": "sync", "codemod_timeout": 0.5, "hide_progress": True}
+    )
+    started = time.monotonic()
+    with patch("refine.processor._print_parallel_result", MagicMock()) as print_result:
+        result = Processor(config=config, registry=registry, codemods=codemods).process([stuck])
+
+    assert time.monotonic() - started < 30
+    assert result.failures == 1
+    (file_result,) = [call.args[0] for call in print_result.call_args_list]
+    assert "sleepy took longer than codemod_timeout=0.5s" in file_result.message
+
+
+def test_workers_past_worker_max_rss_are_recycled(tmp_path):
+    targets = []
+    for idx in range(4):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    registry, codemods = _sleepy_codemods()
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "executor": "process",
+            "batch_size": 1,
+            # Any worker is past 1MiB after its first batch.
+            "worker_max_rss": 1,
+            "hide_progress": True,
+        }
+    )
+    with patch("refine.processor._print_parallel_result", MagicMock()):
+        result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.successes == 4
+    assert result.changed == 4
+    assert result.workers
+    assert sum(stats.recycled for stats in result.workers) == 4
+    assert all(stats.peak_rss > 1024 * 1024 for stats in result.workers)
+
+
+@pytest.mark.parametrize("executor", ["sync", "thread", "process"])
+def test_batch_fsync_commits_files_in_groups(tmp_path, executor):
+    targets = []
+    for idx in range(6):
+        target = tmp_path / f"pkg{idx % 2}" / f"file{idx}.py"
+        target.parent.mkdir(exist_ok=True)
+        target.write_text('parser.add_argument("--dry_run")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 2,
+            "executor": executor,
+            "fsync": "batch",
+            "hide_progress": True,
+            "cache": False,
+        }
+    )
+    with patch("refine.processor.commit", wraps=commit) as mock_commit:
+        result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.changed == 6
+    assert result.failures == 0
+    assert mock_commit.call_count <= len(targets)
+    assert sorted(filename for call in mock_commit.call_args_list for _, filename in call.args[0]) == sorted(
+        str(target) for target in targets
+    )
+    for target in targets:
+        assert target.read_text() == 'parser.add_argument("--dry-run")\n'
+    assert not list(tmp_path.rglob("*.refine-tmp"))
+
+
+def test_nothing_is_committed_past_the_first_change_with_exit_on_first_change(tmp_path):
+    targets = []
+    for idx in range(4):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text("x = 1\n")
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "fsync": "batch", "hide_progress": True, "cache": False})
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    tally = _ResultTally(exit_on_change=True)
+    # As if two batches completed at once, each with a changed file.
+    results = [
+        _FileResult(filename=str(target), status="success", changed=True, staged=stage(str(target), "x = 2\n"))
+        for target in targets
+    ]
+    accounted = []
+
+    def account(result):
+        accounted.append(result.filename)
+        return tally.account(result, MagicMock(), repo_root=str(tmp_path), fail_fast=False)
+
+    assert processor._commit_and_account(results, tally, account)
+    assert accounted == [str(targets[0])]
+    assert [target.read_text() for target in targets] == ["x = 2\n"] + ["x = 1\n"] * 3
+    assert not list(tmp_path.rglob("*.refine-tmp"))
+
+
+@pytest.mark.parametrize("fsync", ["per-file", "batch"])
+def test_known_outputs_are_replayed_without_parsing(tmp_path, monkeypatch, fsync):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text(f'parser.add_argument("--dry_run_{idx}")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "executor": "sync", "fsync": fsync, "hide_progress": True})
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+    expected = [target.read_text() for target in targets]
+    assert expected[0] == 'parser.add_argument("--dry-run-0")\n'
+
+    # Back to the original contents, as if switching branches.
+    for idx, target in enumerate(targets):
+        target.write_text(f'parser.add_argument("--dry_run_{idx}")\n')
+    parse_calls = []
+    real_parse = libcst.parse_module
+
+    def counting_parse(*args, **kwargs):
+        parse_calls.append(args)
+        return real_parse(*args, **kwargs)
+
+    monkeypatch.setattr("refine.processor.cst.parse_module", counting_parse)
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.changed == 3
+    assert result.failures == 0
+    assert parse_calls == []
+    assert [target.read_text() for target in targets] == expected
+    assert not list(tmp_path.rglob("*.refine-tmp"))
+
+
+@pytest.mark.parametrize("fsync", ["per-file", "batch"])
+def test_replayed_outputs_are_not_written_past_the_first_change(tmp_path, fsync):
+    targets = []
+    for idx in range(20):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text(f'parser.add_argument("--dry_run_{idx}")\n')
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "executor": "sync", "hide_progress": True})
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+    for idx, target in enumerate(targets):
+        target.write_text(f'parser.add_argument("--dry_run_{idx}")\n')
+
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "executor": "sync",
+            "fsync": fsync,
+            "ingest_concurrency": 4,
+            "exit_on_first_change": True,
+            "hide_progress": True,
+        }
+    )
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.changed == 1
+    assert sum("dry-run" in target.read_text() for target in targets) == 1
+    assert not list(tmp_path.rglob("*.refine-tmp"))
+
+
+def test_files_ingested_ahead_leave_nothing_staged_on_an_early_stop(tmp_path, monkeypatch):
+    targets = []
+    for idx in range(20):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text("x = 1\n")
+        targets.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "executor": "sync",
+            "ingest_concurrency": 4,
+            "exit_on_first_change": True,
+            "hide_progress": True,
+        }
+    )
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+
+    def staging_ingest(filename):
+        # Whatever ingestion stages, e.g. a write ahead of time.
+        return _FileResult(filename=filename, status="success", changed=True, staged=stage(filename, "x = 2\n"))
+
+    monkeypatch.setattr(processor, "_ingest", staging_ingest)
+    result = processor.process(targets)
+
+    assert result.changed == 1
+    assert not list(tmp_path.rglob("*.refine-tmp"))
+
+
+@pytest.mark.parametrize("mode", ["check", "diff"])
+def test_check_and_diff_never_write(tmp_path, capsys, mode):
+    changed = tmp_path / "pkg" / "changed.py"
+    changed.parent.mkdir()
+    changed.write_text('parser.add_argument("--dry_run")\n')
+    unchanged = tmp_path / "unchanged.py"
+    unchanged.write_text('parser.add_argument("--dry-run")\n')
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path), "hide_progress": True, "cache": False, mode: True})
+    result = Processor(config=config, registry=registry, codemods=codemods).process([changed, unchanged])
+
+    assert result.changed == 1
+    assert result.failures == 0
+    assert changed.read_text() == 'parser.add_argument("--dry_run")\n'
+    captured = capsys.readouterr()
+    assert "Would codemod pkg/changed.py" in captured.err
+    if mode == "diff":
+        assert captured.out == (
+            "--- a/pkg/changed.py\n"
+            "+++ b/pkg/changed.py\n"
+            "@@ -1 +1 @@\n"
+            '-parser.add_argument("--dry_run")\n'
+            '+parser.add_argument("--dry-run")\n'
+        )
+    else:
+        assert captured.out == ""
+
+
+def test_exit_on_first_change_stops_before_later_files(tmp_path):
+    # process_pool_size=1 -> _SyncExecutor, files are processed in order.
+    first = tmp_path / "aaa.py"
+    second = tmp_path / "zzz.py"
+    for target in (first, second):
+        target.write_text('parser.add_argument("--dry_run")\n')
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {
+            "repo_root": str(tmp_path),
+            "process_pool_size": 1,
+            "hide_progress": True,
+            "cache": False,
+            "check": True,
+            "exit_on_first_change": True,
+        }
+    )
+    with patch("refine.processor._print_parallel_result", MagicMock()):
+        result = Processor(config=config, registry=registry, codemods=codemods).process([first, second])
+
+    assert result.changed == 1
+    assert result.successes == 1
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_cache_key_only_reads_unknown_or_modified_files(tmp_path, monkeypatch):
+    targets = []
+    for idx in range(3):
+        target = tmp_path / f"file{idx}.py"
+        target.write_text(f"value = {idx}\n")
+        targets.append(target)
+    for args in (
+        ("init",),
+        ("add", "."),
+        ("-c", "user.name=refine", "-c", "user.email=refine@example.com", "commit", "-m", "Initial"),
+    ):
+        subprocess.run([shutil.which("git"), *args], cwd=tmp_path, check=True, capture_output=True)  # noqa: S603
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    # Recorded by a run hashing the contents: git's blob ids find them all the same.
+    config = Config.from_dict({"repo_root": str(tmp_path), "process_pool_size": 1, "hide_progress": True})
+    Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    targets[0].write_text("value = 'modified'\n")
+    opened = []
+    real_open = open
+
+    def counting_open(file, *args, **kwargs):
+        opened.append(file)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("refine.processor.open", counting_open, raising=False)
+    config = msgspec.structs.replace(config, cache_key="git")
+    result = Processor(config=config, registry=registry, codemods=codemods).process(targets)
+
+    assert result.successes == 3
+    assert opened == [str(targets[0])]
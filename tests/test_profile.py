@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+
+from refine.profile import Profiler
+from refine.profile import ProfileReport
+from refine.profile import Span
+from refine.profile import Timing
+from refine.profile import Tracer
+
+
+def test_nested_phases_are_not_counted_twice():
+    profiler = Profiler(enabled=True, timings={"read": Timing(wall=1.0, cpu=0.5)})
+    with profiler.phase("codemod"):
+        time.sleep(0.05)
+        with profiler.phase("metadata"):
+            time.sleep(0.1)
+    with profiler.phase("codemod"):
+        time.sleep(0.05)
+
+    timings = profiler.timings()
+    assert timings["read"] == Timing(wall=1.0, cpu=0.5)
+    assert 0.1 <= timings["codemod"].wall < 0.15
+    assert 0.1 <= timings["metadata"].wall < 0.15
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    with profiler.phase("parse"), profiler.span("transform"):
+        pass
+    assert not profiler.active
+    assert profiler.timings() == {}
+    assert profiler.spans() == ()
+
+
+def test_tracing_profiler_records_spans_only():
+    profiler = Profiler(enabled=False, trace=True)
+    with profiler.span("transform"), profiler.phase("parse"):
+        pass
+    assert profiler.timings() == {}
+    parse, transform = profiler.spans()
+    assert parse.name == "parse"
+    assert transform.name == "transform"
+    assert transform.start <= parse.start <= parse.end <= transform.end
+    assert parse.pid == os.getpid()
+
+
+def test_tracer_writes_trace_events(tmp_path):
+    tracer = Tracer(enabled=True)
+    with tracer.span("dispatch", files=2):
+        pass
+    started = time.perf_counter()
+    tracer.add((Span(name="parse", start=started, end=started + 0.5, pid=1, tid=2),), file="a.py")
+    trace_file = tmp_path / "trace.json"
+    tracer.dump(trace_file)
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert spans["dispatch"]["pid"] == os.getpid()
+    assert spans["dispatch"]["args"] == {"files": 2}
+    assert spans["parse"]["pid"] == 1
+    assert spans["parse"]["tid"] == 2
+    assert spans["parse"]["args"] == {"file": "a.py"}
+    assert spans["parse"]["dur"] == 500000
+    assert spans["parse"]["ts"] >= spans["dispatch"]["ts"]
+    names = {event["pid"]: event["args"]["name"] for event in events if event["name"] == "process_name"}
+    assert names == {os.getpid(): "refine", 1: "refine worker 1"}
+
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = Tracer(enabled=False)
+    with tracer.span("dispatch"):
+        pass
+    tracer.add((Span(name="parse", start=0, end=1, pid=1, tid=2),))
+    trace_file = tmp_path / "trace.json"
+    tracer.dump(trace_file)
+    assert json.loads(trace_file.read_text())["traceEvents"] == []
+
+
+def test_report_lists_phases_and_slowest_files():
+    report = ProfileReport()
+    for idx in range(10):
+        report.add(
+            f"file{idx}.py",
+            {"parse": Timing(wall=idx / 1000, cpu=idx / 1000), "write": Timing(wall=0.5 / 1000, cpu=0.0)},
+        )
+    lines = report.render(slowest=2).splitlines()
+
+    assert lines[0] == "Profile of 10 files:"
+    assert lines[1].split() == ["Phase", "Files", "Wall", "(s)", "CPU", "(s)", "Share"] + [
+        "p50",
+        "(ms)",
+        "p90",
+        "(ms)",
+        "p99",
+        "(ms)",
+        "Max",
+        "(ms)",
+    ]
+    # Phases are sorted by total time.
+    assert lines[2].split() == ["parse", "10", "0.045", "0.045", "90.0%", "5.00", "9.00", "9.00", "9.00"]
+    assert lines[3].split()[:2] == ["write", "10"]
+    assert lines[4] == "Slowest 2 files:"
+    assert lines[5].split() == ["9.50", "ms", "file9.py"]
+    assert lines[6].split() == ["8.50", "ms", "file8.py"]
+    totals = report.totals()
+    assert totals["parse"].wall == sum(idx / 1000 for idx in range(10))
+    assert totals["write"].cpu == 0
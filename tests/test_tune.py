@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+from unittest.mock import patch
+
+from refine.config import Config
+from refine.processor import Processor
+from refine.registry import Registry
+from refine.tune import RECOMMENDATION_FILE
+from refine.tune import Recommendation
+from refine.tune import candidates
+from refine.tune import load_recommendation
+from refine.tune import sample
+from refine.tune import save_recommendation
+from refine.tune import tune
+
+
+def test_recommendation_round_trips(tmp_path):
+    recommendation = Recommendation(
+        executor="process", process_pool_size=3, batch_size=4, cpus=os.cpu_count() or 1, files=10
+    )
+    save_recommendation(tmp_path / "cache", recommendation)
+    assert load_recommendation(tmp_path / "cache") == recommendation
+    assert recommendation.as_config() == {"executor": "process", "process_pool_size": 3, "batch_size": 4}
+
+
+def test_recommendation_for_other_hardware_is_ignored(tmp_path):
+    recommendation = Recommendation(
+        executor="process", process_pool_size=3, batch_size=4, cpus=(os.cpu_count() or 1) + 1, files=10
+    )
+    save_recommendation(tmp_path, recommendation)
+    assert load_recommendation(tmp_path) is None
+
+
+def test_missing_or_invalid_recommendation_is_ignored(tmp_path):
+    assert load_recommendation(tmp_path) is None
+    (tmp_path / RECOMMENDATION_FILE).write_text("{not json")
+    assert load_recommendation(tmp_path) is None
+
+
+def test_sample_spreads_evenly(tmp_path):
+    files = [tmp_path / f"file{idx}.py" for idx in range(10)]
+    assert sample(files, 20) == files
+    assert sample(files, 5) == files[::2]
+
+
+def test_candidates():
+    with patch("refine.tune.concurrent.futures", spec=["ProcessPoolExecutor"]):
+        assert candidates(cpus=1) == [("sync", 1)]
+        assert candidates(cpus=8) == [
+            ("sync", 1),
+            *(("process", jobs) for jobs in (2, 4, 7, 8)),
+            *(("thread", jobs) for jobs in (2, 4, 7, 8)),
+        ]
+        assert candidates(cpus=8, max_jobs=4) == [
+            ("sync", 1),
+            ("process", 2),
+            ("process", 4),
+            ("thread", 2),
+            ("thread", 4),
+        ]
+
+
+def test_tune_leaves_the_files_untouched(tmp_path):
+    source = 'parser.add_argument("--dry_run")\n'
+    files = []
+    for idx in range(4):
+        target = tmp_path / "pkg" / f"file{idx}.py"
+        target.parent.mkdir(exist_ok=True)
+        target.write_text(source)
+        files.append(target)
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path)})
+    with patch("refine.tune.candidates", return_value=[("sync", 1), ("thread", 2)]):
+        recommendation = tune(config, registry, codemods, files)
+
+    assert [(trial.executor, trial.jobs, trial.batch_size) for trial in recommendation.trials][:2] == [
+        ("sync", 1, 0),
+        ("thread", 2, 0),
+    ]
+    fastest = min(recommendation.trials, key=lambda trial: trial.seconds)
+    assert recommendation.as_config() == {
+        "executor": fastest.executor,
+        "process_pool_size": fastest.jobs,
+        "batch_size": fastest.batch_size,
+    }
+    assert recommendation.files == 4
+    for target in files:
+        assert target.read_text() == source
+    assert not (tmp_path / ".refine_cache").exists()
+
+
+def test_tune_times_runs_on_an_already_started_pool(tmp_path):
+    target = tmp_path / "file.py"
+    target.write_text('parser.add_argument("--dry_run")\n')
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict({"repo_root": str(tmp_path)})
+    with (
+        patch("refine.tune.candidates", return_value=[("thread", 2)]),
+        patch("refine.tune._BATCH_SIZES", ()),
+        patch.object(Processor, "_new_executor", autospec=True, side_effect=Processor._new_executor) as new_executor,
+        patch.object(Processor, "process", autospec=True, side_effect=Processor.process) as process,
+    ):
+        tune(config, registry, codemods, [target])
+
+    # The pool started by the first run is the one the second, timed, run uses.
+    assert process.call_count == 2
+    assert new_executor.call_count == 1
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import os
+import stat
+from unittest.mock import patch
+
+import pytest
+
+from refine import writeback
+
+
+@pytest.fixture(params=["syncfs", "fsync"])
+def sync_contents(request):
+    """
+    Commit with Linux's syncfs, when available, and with an fsync per file.
+    """
+    if request.param == "syncfs":
+        if writeback._syncfs() is None:
+            pytest.skip("syncfs is only available on Linux")
+        yield
+        return
+    with patch("refine.writeback._syncfs", return_value=None):
+        yield
+
+
+@pytest.mark.usefixtures("sync_contents")
+def test_commit_replaces_targets(tmp_path):
+    targets = []
+    for idx in range(3):
+        directory = tmp_path / f"dir{idx % 2}"
+        directory.mkdir(exist_ok=True)
+        target = directory / f"file{idx}.py"
+        target.write_text("old\n")
+        target.chmod(0o755)
+        targets.append(target)
+
+    staged = [(writeback.stage(str(target), f"new {idx}\n"), str(target)) for idx, target in enumerate(targets)]
+    for target in targets:
+        # Nothing is replaced before the commit.
+        assert target.read_text() == "old\n"
+
+    with patch("refine.writeback._fsync_directory", wraps=writeback._fsync_directory) as fsync_directory:
+        assert writeback.commit(staged) == {}
+
+    for idx, target in enumerate(targets):
+        assert target.read_text() == f"new {idx}\n"
+        assert stat.S_IMODE(target.stat().st_mode) == 0o755
+    assert sorted(call.args[0] for call in fsync_directory.call_args_list) == [
+        str(tmp_path / "dir0"),
+        str(tmp_path / "dir1"),
+    ]
+    assert not list(tmp_path.rglob(f"*{writeback.TMP_SUFFIX}"))
+
+
+def test_commit_reports_targets_it_could_not_replace(tmp_path):
+    good = tmp_path / "good.py"
+    bad = tmp_path / "bad.py"
+    for target in (good, bad):
+        target.write_text("old\n")
+    staged = [(writeback.stage(str(target), "new\n"), str(target)) for target in (good, bad)]
+
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if dst == str(bad):
+            error = "Read-only file system"
+            raise OSError(error)
+        real_replace(src, dst)
+
+    with patch("refine.writeback.os.replace", side_effect=replace):
+        errors = writeback.commit(staged)
+
+    assert list(errors) == [str(bad)]
+    assert good.read_text() == "new\n"
+    assert bad.read_text() == "old\n"
+    assert not list(tmp_path.glob(f"*{writeback.TMP_SUFFIX}"))
+
+
+def test_commit_replaces_nothing_when_contents_cannot_be_synced(tmp_path):
+    target = tmp_path / "file.py"
+    target.write_text("old\n")
+    staged = [(writeback.stage(str(target), "new\n"), str(target))]
+
+    with patch("refine.writeback._sync_contents", side_effect=OSError("I/O error")):
+        errors = writeback.commit(staged)
+
+    assert list(errors) == [str(target)]
+    assert target.read_text() == "old\n"
+    assert not list(tmp_path.glob(f"*{writeback.TMP_SUFFIX}"))
@@ -0,0 +1,5 @@
+"""
+Refine benchmarks.
+
+Each module is runnable on its own, e.g. ``python -m tools.bench.scheduling``.
+"""
@@ -0,0 +1,113 @@
+"""
+Synthetic source trees to benchmark refine against.
+"""
+
+from __future__ import annotations
+
+import math
+import pathlib
+import random
+import shutil
+
+
+def _module(flags: int) -> str:
+    lines = ["import argparse", "", "parser = argparse.ArgumentParser()"]
+    lines.extend(f'parser.add_argument("--option_{idx}", help="Option number {idx}.")' for idx in range(flags))
+    return "\n".join(lines) + "\n"
+
+
+def skewed_corpus(root: pathlib.Path, *, small: int, large: int, large_flags: int = 4000) -> list[pathlib.Path]:
+    """
+    Lay out ``small`` tiny modules followed, in sorted order, by ``large`` huge ones.
+
+    Every module has flags for the ``cli-dashes-over-underscores`` codemod to
+    rewrite. The huge modules sort last, which is the worst case for a
+    dispatch in filename order: they start once everything else is done.
+    """
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    paths = []
+    for idx in range(small):
+        path = root / f"a_small_{idx:05d}.py"
+        path.write_text(_module(3))
+        paths.append(path)
+    for idx in range(large):
+        path = root / f"z_large_{idx:05d}.py"
+        path.write_text(_module(large_flags))
+        paths.append(path)
+    return paths
+
+
+def _filler(rng: random.Random, lines: int) -> list[str]:
+    """
+    Plain Python neither codemod has anything to do with, about ``lines`` long.
+    """
+    out: list[str] = []
+    while len(out) < lines:
+        idx = rng.randrange(1_000_000)
+        out.extend(
+            [
+                "",
+                f"def function_{idx}(value, factor={idx % 7}):",
+                f'    """Scale ``value`` by {idx % 7}."""',
+                "    total = 0",
+                "    for item in range(value):",
+                "        total += item * factor",
+                "    return total",
+            ]
+        )
+    return out
+
+
+def synthetic_corpus(  # noqa: PLR0913
+    root: pathlib.Path,
+    *,
+    files: int,
+    lines: int = 200,
+    size_sigma: float = 1.0,
+    sql_fraction: float = 0.1,
+    cli_fraction: float = 0.2,
+    unchanged_fraction: float = 0.1,
+    seed: int = 0,
+) -> list[pathlib.Path]:
+    """
+    Lay out ``files`` modules of log-normally distributed sizes.
+
+    The median module has ``lines`` lines, and ``size_sigma`` sets how skewed
+    the sizes are. A ``sql_fraction`` of the modules hold SQL query strings
+    for the ``sqlfmt`` codemod to format, and a ``cli_fraction`` of them flags
+    for the ``cli-dashes-over-underscores`` codemod to rewrite. Another
+    ``unchanged_fraction`` of the modules trip both codemods' gates, but hold
+    nothing for them to change. The rest is plain code, which the gates skip.
+    The same ``seed`` always lays out the same corpus.
+    """
+    if root.exists():
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    rng = random.Random(seed)  # noqa: S311
+    paths = []
+    for idx in range(files):
+        size = max(int(rng.lognormvariate(math.log(lines), size_sigma)), 4)
+        kind = rng.random()
+        body = ["import argparse", "", "parser = argparse.ArgumentParser()"]
+        if kind < sql_fraction:
+            body.extend(
+                f'QUERY_{line} = "select id, name from table_{line} where id = {line} and name = {line}"'  # noqa: S608
+                for line in range(max(size // 20, 1))
+            )
+        elif kind < sql_fraction + cli_fraction:
+            body.extend(
+                f'parser.add_argument("--option_{line}", help="Option {line}.")' for line in range(max(size // 10, 1))
+            )
+        elif kind < sql_fraction + cli_fraction + unchanged_fraction:
+            # Matches the gates, but neither an SQL string nor a flag.
+            body.extend(
+                ["# Use --dry_run to select what would change from the output.", 'parser.add_argument("--dry-run")']
+            )
+        body.extend(_filler(rng, size - len(body)))
+        path = root / f"pkg_{idx // 100:03d}" / f"module_{idx:06d}.py"
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("\n".join(body) + "\n")
+        paths.append(path)
+    return paths
@@ -0,0 +1,69 @@
+"""
+Benchmark dispatching work in filename order against longest-job-first.
+
+Run with ``python -m tools.bench.scheduling``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from refine.config import Config
+from refine.processor import Processor
+from refine.registry import Registry
+from tools.bench.corpus import skewed_corpus
+
+
+def _run(root: pathlib.Path, *, small: int, large: int, jobs: int, in_order: bool) -> float:
+    paths = skewed_corpus(root / "corpus", small=small, large=large)
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=["cli-dashes-over-underscores"]))
+    config = Config.from_dict(
+        {"repo_root": str(root), "process_pool_size": jobs, "hide_progress": True, "cache": False}
+    )
+    processor = Processor(config=config, registry=registry, codemods=codemods)
+    # Without a lookahead, every work item is dispatched as soon as it is read.
+    with (
+        patch("refine.processor._SCHEDULE_LOOKAHEAD", 0 if in_order else 256),
+        patch("refine.processor._print_parallel_result", MagicMock()),
+    ):
+        started = time.perf_counter()
+        result = processor.process(paths)
+        elapsed = time.perf_counter() - started
+    if result.changed != small + large:
+        error = f"Unexpected benchmark run outcome: {result}"
+        raise RuntimeError(error)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--small", type=int, default=400, help="Number of tiny modules.")
+    parser.add_argument("--large", type=int, default=4, help="Number of huge modules, sorted last.")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of worker processes.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per strategy; the median is reported.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        timings = {}
+        for label, in_order in (("filename order", True), ("longest first", False)):
+            timings[label] = statistics.median(
+                _run(root, small=args.small, large=args.large, jobs=args.jobs, in_order=in_order)
+                for _ in range(args.repeat)
+            )
+    for label, seconds in timings.items():
+        sys.stdout.write(f"{label:>15}: {seconds:.3f}s\n")
+    sys.stdout.write(f"{'speedup':>15}: {timings['filename order'] / timings['longest first']:.2f}x\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare the cost of shipping work and results between the parent and the workers.
+
+Pits pickling against the msgpack encoding of refine's own pool, on the same
+payloads, to isolate the cost of the encoding. Also times pickling libCST's
+``ExecutionResult``, carrying the whole transformed code, as
+``concurrent.futures.ProcessPoolExecutor`` used to ship: what the smaller results
+save on top. Run with ``python -m tools.bench.serialization``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import pickle
+import sys
+import timeit
+
+import msgspec
+from libcst.codemod._cli import ExecutionResult
+from libcst.codemod._runner import TransformSuccess
+
+from refine.cache import source_digest
+from refine.processor import _FileResult
+from refine.processor import _process_batch_in_worker
+from refine.processor import _Work
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=32, help="Number of files per batch.")
+    parser.add_argument("--lines", type=int, default=200, help="Number of lines per file.")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of batches to time.")
+    args = parser.parse_args()
+
+    # Distinct sources: pickle would otherwise only serialize a shared one once.
+    batch = [
+        _Work(
+            filename=f"pkg/mod{idx}.py",
+            source="".join(f'parser.add_argument("--option-{idx}-{line}")\n' for line in range(args.lines)),
+            codemod_names=("cli-dashes-over-underscores",),
+        )
+        for idx in range(args.files)
+    ]
+    old_results = [
+        ExecutionResult(
+            filename=work.filename,
+            changed=False,
+            transform_result=TransformSuccess(warning_messages=[], code=work.source),
+        )
+        for work in batch
+    ]
+    new_results = [
+        _FileResult(filename=work.filename, status="success", digest=source_digest(work.source), duration=0.01)
+        for work in batch
+    ]
+
+    encoder = msgspec.msgpack.Encoder()
+    work_decoder = msgspec.msgpack.Decoder(list[_Work])
+    result_decoder = msgspec.msgpack.Decoder(list[_FileResult])
+
+    def pickled(file_results):
+        def roundtrip():
+            task = pickle.dumps((_process_batch_in_worker, batch))
+            pickle.loads(task)  # noqa: S301
+            results = pickle.dumps(file_results)
+            pickle.loads(results)  # noqa: S301
+            return len(task) + len(results)
+
+        return roundtrip
+
+    def encoded():
+        task = encoder.encode(batch)
+        work_decoder.decode(task)
+        results = encoder.encode(new_results)
+        result_decoder.decode(results)
+        return len(task) + len(results)
+
+    for label, roundtrip in (
+        ("pickle, ExecutionResult", pickled(old_results)),
+        ("pickle", pickled(new_results)),
+        ("msgpack", encoded),
+    ):
+        seconds = timeit.timeit(roundtrip, number=args.repeat)
+        per_file_us = seconds / (args.repeat * args.files) * 1e6
+        per_file_bytes = roundtrip() // args.files
+        sys.stdout.write(f"{label:>23}: {per_file_us:8.2f}us/file {per_file_bytes:>8,} bytes/file\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Benchmark the processor end to end, the gates, and the transform phases on a synthetic corpus.
+
+Results are written as JSON, to compare across commits:
+
+    python -m tools.bench.suite --output before.json
+    git switch my-branch
+    python -m tools.bench.suite --output after.json --compare before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING
+from typing import Any
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import msgspec
+
+from refine import __version__
+from refine.config import Config
+from refine.processor import ParallelTransformResult
+from refine.processor import Processor
+from refine.registry import Registry
+from tools.bench.corpus import synthetic_corpus
+
+if TYPE_CHECKING:
+    from refine.abc import BaseCodemod
+
+_EXECUTORS = ("sync", "thread", "process", "interpreter")
+
+
+class EndToEnd(msgspec.Struct):
+    """
+    A whole run over the corpus.
+    """
+
+    executor: str
+    #: ``cold`` for a first run, ``warm`` for a run over a corpus the cache already knows.
+    cache: str
+    files: int
+    changed: int
+    seconds: float
+    files_per_second: float
+
+
+class Gate(msgspec.Struct):
+    """
+    A codemod's ``should_process`` gate over every file of the corpus.
+    """
+
+    codemod: str
+    files: int
+    matched: int
+    seconds: float
+    files_per_second: float
+    megabytes_per_second: float
+
+
+class Phase(msgspec.Struct):
+    """
+    The time spent in a transform phase, as reported by ``--profile``.
+    """
+
+    name: str
+    files: int
+    wall: float
+    cpu: float
+    ms_per_file: float
+
+
+class Results(msgspec.Struct):
+    """
+    Everything a benchmark run measured.
+    """
+
+    meta: dict[str, Any]
+    end_to_end: list[EndToEnd]
+    gates: list[Gate]
+    phases: list[Phase]
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _process(
+    root: pathlib.Path, paths: list[pathlib.Path], codemods: list[type[BaseCodemod]], registry: Registry, **config: Any
+) -> tuple[ParallelTransformResult, float]:
+    processor = Processor(
+        config=Config.from_dict(
+            {"repo_root": str(root), "cache_dir": str(root / "cache"), "hide_progress": True, **config}
+        ),
+        registry=registry,
+        codemods=codemods,
+    )
+    with patch("refine.processor._print_parallel_result", MagicMock()):
+        started = time.perf_counter()
+        result = processor.process(paths)
+        elapsed = time.perf_counter() - started
+    if result.failures:
+        error = f"Unexpected benchmark run outcome: {result}"
+        raise RuntimeError(error)
+    return result, elapsed
+
+
+def _end_to_end(
+    root: pathlib.Path, args: argparse.Namespace, codemods: list[type[BaseCodemod]], registry: Registry
+) -> list[EndToEnd]:
+    results = []
+    for run, executor in enumerate(args.executors):
+        if executor == "interpreter" and not hasattr(concurrent.futures, "InterpreterPoolExecutor"):
+            sys.stderr.write("Skipping the interpreter executor, which needs Python 3.14+\n")
+            continue
+        paths = _corpus(root, args)
+        config = {
+            "executor": executor,
+            "process_pool_size": args.jobs,
+            "cache_backend": args.cache_backend,
+            # The corpus comes back with the same content: a cache of its own for each run,
+            # so its cold run starts from nothing.
+            "cache_dir": str(root / f"cache-{run}-{executor}"),
+        }
+        # Cold: no outputs to replay either, whatever output_cache_dir is configured.
+        result, elapsed = _process(root, paths, codemods, registry, **config, output_cache=False)
+        results.append(_timed_run(executor, "cold", len(paths), result, elapsed))
+        # Let the cache learn the rewritten files too, so the next run has nothing left to do.
+        _process(root, paths, codemods, registry, **config)
+        result, elapsed = _process(root, paths, codemods, registry, **config)
+        results.append(_timed_run(executor, "warm", len(paths), result, elapsed))
+    return results
+
+
+def _timed_run(executor: str, cache: str, files: int, result: ParallelTransformResult, elapsed: float) -> EndToEnd:
+    return EndToEnd(
+        executor=executor,
+        cache=cache,
+        files=files,
+        changed=result.changed,
+        seconds=elapsed,
+        files_per_second=files / elapsed,
+    )
+
+
+def _gates(root: pathlib.Path, args: argparse.Namespace, codemods: list[type[BaseCodemod]]) -> list[Gate]:
+    sources = [(str(path), path.read_text()) for path in _corpus(root, args)]
+    total_bytes = sum(len(source) for _, source in sources)
+    results = []
+    for codemod in codemods:
+        started = time.perf_counter()
+        for _ in range(args.gate_repeat):
+            matched = sum(codemod.should_process(source, filename) for filename, source in sources)
+        elapsed = (time.perf_counter() - started) / args.gate_repeat
+        results.append(
+            Gate(
+                codemod=codemod.NAME,
+                files=len(sources),
+                matched=matched,
+                seconds=elapsed,
+                files_per_second=len(sources) / elapsed,
+                megabytes_per_second=total_bytes / elapsed / 1e6,
+            )
+        )
+    return results
+
+
+def _phases(
+    root: pathlib.Path, args: argparse.Namespace, codemods: list[type[BaseCodemod]], registry: Registry
+) -> list[Phase]:
+    paths = _corpus(root, args)
+    # A single process, so phases are not slowed down by workers competing for the CPU.
+    result, _ = _process(root, paths, codemods, registry, executor="sync", profile=1, cache=False)
+    if result.profile is None or result.transform is None:
+        error = f"Unexpected benchmark run outcome: {result}"
+        raise RuntimeError(error)
+    transformed = max(result.transform.files, 1)
+    return [
+        Phase(
+            name=name, files=transformed, wall=timing.wall, cpu=timing.cpu, ms_per_file=timing.wall / transformed * 1000
+        )
+        for name, timing in sorted(result.profile.totals().items(), key=lambda item: -item[1].wall)
+    ]
+
+
+def _corpus(root: pathlib.Path, args: argparse.Namespace) -> list[pathlib.Path]:
+    return synthetic_corpus(
+        root / "corpus",
+        files=args.files,
+        lines=args.lines,
+        size_sigma=args.size_sigma,
+        sql_fraction=args.sql_fraction,
+        cli_fraction=args.cli_fraction,
+        unchanged_fraction=args.unchanged_fraction,
+        seed=args.seed,
+    )
+
+
+def _report(results: Results, baseline: Results | None) -> None:
+    previous: dict[tuple[str, ...], float] = {}
+    if baseline is not None:
+        previous.update((("run", run.executor, run.cache), run.files_per_second) for run in baseline.end_to_end)
+        previous.update((("gate", gate.codemod), gate.files_per_second) for gate in baseline.gates)
+        # Lower is better: invert, so that above 1x still means faster than the baseline.
+        previous.update((("phase", phase.name), 1 / phase.ms_per_file) for phase in baseline.phases)
+
+    def versus(key: tuple[str, ...], value: float) -> str:
+        return f"  ({value / previous[key]:.2f}x baseline)" if key in previous else ""
+
+    sys.stdout.write("End to end:\n")
+    for run in results.end_to_end:
+        sys.stdout.write(
+            f"  {run.executor:>12} {run.cache}: {run.files_per_second:10.1f} files/s"
+            f"{versus(('run', run.executor, run.cache), run.files_per_second)}\n"
+        )
+    sys.stdout.write("Gates:\n")
+    for gate in results.gates:
+        sys.stdout.write(
+            f"  {gate.codemod:>36}: {gate.files_per_second:10.0f} files/s {gate.megabytes_per_second:8.1f} MB/s"
+            f" ({gate.matched}/{gate.files} matched){versus(('gate', gate.codemod), gate.files_per_second)}\n"
+        )
+    sys.stdout.write("Transform phases:\n")
+    for phase in results.phases:
+        sys.stdout.write(
+            f"  {phase.name:>36}: {phase.ms_per_file:10.3f} ms/file"
+            f"{versus(('phase', phase.name), 1 / phase.ms_per_file)}\n"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=500, help="Number of modules in the corpus.")
+    parser.add_argument("--lines", type=int, default=200, help="Median number of lines per module.")
+    parser.add_argument("--size-sigma", type=float, default=1.0, help="Spread of the log-normal module sizes.")
+    parser.add_argument("--sql-fraction", type=float, default=0.1, help="Fraction of modules with SQL strings.")
+    parser.add_argument("--cli-fraction", type=float, default=0.2, help="Fraction of modules with CLI flags.")
+    parser.add_argument(
+        "--unchanged-fraction", type=float, default=0.1, help="Fraction of modules passing the gates, left unchanged."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus layout.")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of pool workers.")
+    parser.add_argument(
+        "--executors", nargs="+", choices=_EXECUTORS, default=list(_EXECUTORS), help="Executors to run end to end."
+    )
+    parser.add_argument(
+        "--codemods",
+        nargs="+",
+        default=["cli-dashes-over-underscores", "sqlfmt"],
+        help="Codemods to run.",
+    )
+    parser.add_argument(
+        "--cache-backend", choices=("msgpack", "sqlite"), default="msgpack", help="Run cache backend, end to end."
+    )
+    parser.add_argument("--gate-repeat", type=int, default=20, help="Passes of each gate over the corpus.")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the results to this JSON file.")
+    parser.add_argument("--compare", type=pathlib.Path, help="Results of a previous run to compare against.")
+    args = parser.parse_args()
+
+    # The benchmark reports for itself.
+    logging.getLogger("refine").setLevel(logging.WARNING)
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods(select_codemods=args.codemods))
+    baseline = msgspec.json.decode(args.compare.read_bytes(), type=Results) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir)
+        results = Results(
+            meta={
+                "commit": _git_commit(),
+                "refine": __version__,
+                "python": sys.version,
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.time(),
+                "arguments": {
+                    key: str(value) if isinstance(value, pathlib.Path) else value for key, value in vars(args).items()
+                },
+            },
+            end_to_end=_end_to_end(root, args, codemods, registry),
+            gates=_gates(root, args, codemods),
+            phases=_phases(root, args, codemods, registry),
+        )
+    _report(results, baseline)
+    if args.output:
+        args.output.write_bytes(msgspec.json.format(msgspec.json.encode(results)) + b"\n")
+
+
+if __name__ == "__main__":
+    main()
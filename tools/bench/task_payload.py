@@ -0,0 +1,60 @@
+"""
+Measure the bytes shipped to the process pool workers with every task.
+
+Run with ``python -m tools.bench.task_payload``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import pathlib
+import pickle
+import sys
+import tempfile
+
+from refine.config import Config
+from refine.processor import Processor
+from refine.processor import _process_batch_in_worker
+from refine.processor import _Work
+from refine.registry import Registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cached-files", type=int, default=50_000, help="Number of entries in the run cache.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Number of files per task.")
+    args = parser.parse_args()
+
+    registry = Registry()
+    registry.load([])
+    codemods = list(registry.codemods())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = Config.from_dict({"repo_root": tmpdir, "hide_progress": True})
+        processor = Processor(config=config, registry=registry, codemods=codemods)
+        if processor.cache is None:
+            error = "The benchmark needs the run cache enabled"
+            raise RuntimeError(error)
+        for idx in range(args.cached_files):
+            processor.cache.mark_clean(
+                str(pathlib.Path(tmpdir, f"pkg{idx // 100}", f"mod{idx}.py")), f"x = {idx}\n", processor.codemod_keys
+            )
+
+        source = 'parser.add_argument("--dry_run")\n' * 20
+        batch = [
+            _Work(filename=f"mod{idx}.py", source=source, codemod_names=tuple(processor.codemods_by_name))
+            for idx in range(args.batch_size)
+        ]
+        # A task used to pickle the bound method, and with it the whole processor
+        # (its __dict__), plus the metadata manager, for every file.
+        before = len(pickle.dumps((vars(processor), None, batch))) // args.batch_size
+        # Now the processor is installed in the workers once, tasks carry the work items only.
+        once_per_worker = len(pickle.dumps((processor, None)))
+        after = len(pickle.dumps((_process_batch_in_worker, batch))) // args.batch_size
+
+        sys.stdout.write(f"{'before':>16}: {before:>10,} bytes/file\n")
+        sys.stdout.write(f"{'after':>16}: {after:>10,} bytes/file\n")
+        sys.stdout.write(f"{'worker startup':>16}: {once_per_worker:>10,} bytes, once per worker\n")
+
+
+if __name__ == "__main__":
+    main()